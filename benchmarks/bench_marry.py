@@ -0,0 +1,134 @@
+"""Benchmark: claim-to-reply database latency of /marry, old sequential path vs. record_marriage.
+
+Needs a reachable MongoDB. Writes go to a throwaway database that is dropped
+afterwards, never to the bot's own:
+
+    MONGODB_URL=mongodb://localhost:27017 python -m benchmarks.bench_marry
+"""
+import asyncio
+import os
+import statistics
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("TELEGRAM_API_HASH", "benchmark")
+os.environ.setdefault("TELEGRAM_API_ID", "1")
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import logging
+
+logging.disable(logging.WARNING)
+
+from shivu import lol
+from shivu import leaderboard_buffer as buffer_module
+from shivu import marriages
+from shivu import ownership
+from shivu.leaderboard_buffer import leaderboard_buffer
+
+BENCHMARK_DB = "Character_catcher_benchmark"
+CLAIMS = 500
+USERS = 50
+GROUPS = 5
+TODAY = "2024-01-01"
+
+
+async def legacy_record_marriage(user_collection, group_user_totals_collection, top_global_groups_collection, user, chat, character):
+    """The sequential read-then-write path guess() used before record_marriage, for comparison"""
+    await user_collection.find_one({'id': user.id})  # daily limit check
+    existing = await user_collection.find_one({'id': user.id})
+    if existing:
+        update_fields = {}
+        if user.username != existing.get('username'):
+            update_fields['username'] = user.username
+        if user.first_name != existing.get('first_name'):
+            update_fields['first_name'] = user.first_name
+        if 'characters' not in existing or existing['characters'] is None:
+            update_fields['characters'] = []
+        daily_marriages = existing.get('daily_marriages', {})
+        update_fields[f'daily_marriages.{TODAY}'] = daily_marriages.get(TODAY, 0) + 1
+        await user_collection.update_one({'id': user.id}, {'$set': update_fields})
+        await user_collection.update_one({'id': user.id}, {'$push': {'characters': character}})
+    else:
+        await user_collection.insert_one({
+            'id': user.id,
+            'username': user.username,
+            'first_name': user.first_name,
+            'characters': [character],
+            'daily_marriages': {TODAY: 1},
+        })
+
+    group_user_total = await group_user_totals_collection.find_one({'user_id': user.id, 'group_id': chat.id})
+    if group_user_total:
+        await group_user_totals_collection.update_one({'user_id': user.id, 'group_id': chat.id}, {'$inc': {'count': 1}})
+    else:
+        await group_user_totals_collection.insert_one({
+            'user_id': user.id, 'group_id': chat.id,
+            'username': user.username, 'first_name': user.first_name, 'count': 1,
+        })
+
+    group_info = await top_global_groups_collection.find_one({'group_id': chat.id})
+    if group_info:
+        await top_global_groups_collection.update_one({'group_id': chat.id}, {'$inc': {'count': 1}})
+    else:
+        await top_global_groups_collection.insert_one({'group_id': chat.id, 'group_name': chat.title, 'count': 1})
+
+
+async def new_record_marriage(user_collection, group_user_totals_collection, top_global_groups_collection, user, chat, character):
+    await marriages.daily_marriage_count(user.id, TODAY)
+    await marriages.record_marriage(user, chat, character, TODAY)
+
+
+def claims():
+    for i in range(CLAIMS):
+        user = SimpleNamespace(id=1000 + i % USERS, username=f"user{i % USERS}", first_name="Bench")
+        chat = SimpleNamespace(id=-100 - i % GROUPS, title=f"Group {i % GROUPS}")
+        character = {'id': str(i), 'name': f"Character {i}", 'anime': "Benchmark", 'rarity': "Common"}
+        yield user, chat, character
+
+
+async def run(name, path, database) -> None:
+    await lol.drop_database(BENCHMARK_DB)
+    collections = (database['users'], database['group_user_totals'], database['top_global_groups'])
+    marriages.user_collection = ownership.user_collection = collections[0]
+    ownership.ownership_collection = database['character_ownership']
+    ownership.character_stats_collection = database['character_stats']
+    buffer_module.group_user_totals_collection, buffer_module.top_global_groups_collection = collections[1:]
+    for collection in collections[1:]:
+        await collection.create_index([('group_id', 1)])
+    await collections[0].create_index([('id', 1)])
+    await ownership.ownership_collection.create_index([('user_id', 1), ('character_id', 1)], unique=True)
+    await ownership.ownership_collection.create_index([('character_id', 1), ('count', -1)])
+
+    latencies = []
+    for user, chat, character in claims():
+        start = time.perf_counter()
+        await path(*collections, user, chat, character)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    # Leaderboard counters written behind are flushed off the reply path
+    start = time.perf_counter()
+    await leaderboard_buffer.flush()
+    flush_ms = (time.perf_counter() - start) * 1000
+
+    latencies.sort()
+    print(
+        f"{name:>8}: mean {statistics.mean(latencies):6.2f} ms"
+        f"  p50 {latencies[len(latencies) // 2]:6.2f} ms"
+        f"  p95 {latencies[int(len(latencies) * 0.95)]:6.2f} ms"
+        f"  (+{flush_ms:.2f} ms in background flushes)"
+    )
+
+
+async def main() -> None:
+    database = lol[BENCHMARK_DB]
+    print(f"{CLAIMS} claims by {USERS} users in {GROUPS} groups")
+    try:
+        await run("legacy", legacy_record_marriage, database)
+        await run("upserts", new_record_marriage, database)
+    finally:
+        await lol.drop_database(BENCHMARK_DB)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""Microbenchmark: inline search over a 50k character catalog.
+
+Compares the in-memory search index with the regex scan inline queries used
+to run (done here in Python over the same documents, which is cheaper than
+the Mongo round trip it stands in for). Importing shivu builds the bot
+clients but never connects, so placeholder credentials are enough:
+
+    python -m benchmarks.bench_search
+"""
+import os
+import random
+import re
+import statistics
+import time
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("TELEGRAM_API_HASH", "benchmark")
+os.environ.setdefault("TELEGRAM_API_ID", "1")
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import logging
+
+logging.disable(logging.WARNING)
+
+from shivu.catalog import Catalog
+from shivu.search_index import SearchIndex
+
+CHARACTERS = 50_000
+ANIME = 2_000
+QUERIES = 2_000
+SYLLABLES = [consonant + vowel for consonant in ('', 'k', 's', 't', 'n', 'h', 'm', 'y', 'r', 'sh', 'ch', 'g', 'z', 'b') for vowel in 'aeiou']
+
+
+def _word(rng, syllables):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables)).capitalize()
+
+
+def _catalog(rng) -> Catalog:
+    anime = [' '.join(_word(rng, rng.randint(2, 4)) for _ in range(rng.randint(1, 3))) for _ in range(ANIME)]
+    catalog = Catalog()
+    for i in range(1, CHARACTERS + 1):
+        name = f"{_word(rng, rng.randint(2, 3))} {_word(rng, rng.randint(2, 4))}"
+        catalog.characters[str(i)] = {'id': str(i), 'name': name, 'anime': rng.choice(anime), 'rarity': 'Common'}
+    catalog.loaded = True
+    return catalog
+
+
+def _queries(rng, catalog) -> list:
+    characters = list(catalog.characters.values())
+    queries = []
+    for _ in range(QUERIES):
+        character = rng.choice(characters)
+        words = character['name'].lower().split()
+        kind = rng.randrange(4)
+        if kind == 0:
+            queries.append(' '.join(words))  # full name
+        elif kind == 1:
+            queries.append(words[0][:rng.randint(2, len(words[0]))])  # typing the first name
+        elif kind == 2:
+            queries.append(character['anime'].lower().split()[0])  # an anime word
+        else:
+            queries.append(words[-1][1:])  # the middle of a surname
+    return queries
+
+
+def _report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95)]
+    print(f"{label:<18}: mean {statistics.mean(samples) * 1e6:8.0f} us  p50 {samples[len(samples) // 2] * 1e6:8.0f} us  p95 {p95 * 1e6:8.0f} us")
+
+
+def main():
+    rng = random.Random(42)
+    catalog = _catalog(rng)
+    queries = _queries(rng, catalog)
+
+    start = time.perf_counter()
+    index = SearchIndex(catalog)
+    print(f"index build       : {(time.perf_counter() - start) * 1e3:8.0f} ms for {CHARACTERS} characters, {index.stats()}")
+
+    samples, found = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        found += len(index.search(query))
+        samples.append(time.perf_counter() - start)
+    _report("SearchIndex", samples)
+    print(f"{'':<18}  {found / QUERIES:.1f} results per query")
+
+    documents = list(catalog.characters.values())
+    samples, found = [], 0
+    for query in queries[:QUERIES // 10]:
+        start = time.perf_counter()
+        regex = re.compile(query, re.IGNORECASE)
+        found += len([character for character in documents if regex.search(character['name']) or regex.search(character['anime'])])
+        samples.append(time.perf_counter() - start)
+    _report("regex scan", samples)
+    print(f"{'':<18}  {found / (QUERIES // 10):.1f} results per query")
+
+    added = [{'id': str(CHARACTERS + i), 'name': f"{_word(rng, 3)} {_word(rng, 3)}", 'anime': 'Benchmark Extra'} for i in range(1, 1001)]
+    start = time.perf_counter()
+    for character in added:
+        catalog.add(character)
+    for character in added:
+        catalog.remove(character['id'])
+    print(f"add + remove      : {(time.perf_counter() - start) / len(added) * 1e6:8.0f} us per character")
+
+
+if __name__ == "__main__":
+    main()
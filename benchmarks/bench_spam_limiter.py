@@ -0,0 +1,73 @@
+"""Microbenchmark: per-message cost of the spam limiter at 100k active users.
+
+Importing shivu builds the bot clients but never connects, so placeholder
+credentials are enough:
+
+    python -m benchmarks.bench_spam_limiter
+"""
+import os
+import random
+import time
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("TELEGRAM_API_HASH", "benchmark")
+os.environ.setdefault("TELEGRAM_API_ID", "1")
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import logging
+
+logging.disable(logging.WARNING)
+
+from shivu.spam_limiter import SpamLimiter, SPAM_MESSAGE_LIMIT, SPAM_TIME_WINDOW
+
+ACTIVE_USERS = 100_000
+MESSAGES = 1_000_000
+
+
+def legacy_detect_spam(user_message_times, user_id, current_time):
+    """The list-rebuilding detector this limiter replaced, for comparison"""
+    if user_id not in user_message_times:
+        user_message_times[user_id] = []
+    user_message_times[user_id].append(current_time)
+    user_message_times[user_id] = [
+        msg_time for msg_time in user_message_times[user_id]
+        if current_time - msg_time <= SPAM_TIME_WINDOW
+    ]
+    if len(user_message_times[user_id]) > SPAM_MESSAGE_LIMIT:
+        user_message_times[user_id] = []
+        return True
+    return False
+
+
+def main():
+    rng = random.Random(42)
+    # ~3000 messages per second spread over 100k users, i.e. realistic group traffic
+    users = [rng.randrange(ACTIVE_USERS) for _ in range(MESSAGES)]
+    clock = [1_000_000 + i / 3000 for i in range(MESSAGES)]
+
+    limiter = SpamLimiter()
+    for user_id in range(ACTIVE_USERS):
+        limiter.hit(user_id, now=clock[0])
+
+    start = time.perf_counter()
+    for user_id, now in zip(users, clock):
+        limiter.hit(user_id, now=now)
+    elapsed = time.perf_counter() - start
+    print(f"SpamLimiter.hit   : {elapsed / MESSAGES * 1e9:8.0f} ns/message ({len(limiter.recent)} tracked users)")
+
+    start = time.perf_counter()
+    evicted = limiter.evict_idle(now=clock[-1])
+    print(f"SpamLimiter.evict : {(time.perf_counter() - start) * 1e3:8.1f} ms for {evicted} idle users, {len(limiter.recent)} left")
+
+    legacy = {}
+    for user_id in range(ACTIVE_USERS):
+        legacy_detect_spam(legacy, user_id, clock[0])
+    start = time.perf_counter()
+    for user_id, now in zip(users, clock):
+        legacy_detect_spam(legacy, user_id, now)
+    elapsed = time.perf_counter() - start
+    print(f"legacy detect_spam: {elapsed / MESSAGES * 1e9:8.0f} ns/message ({len(legacy)} users never evicted)")
+
+
+if __name__ == "__main__":
+    main()
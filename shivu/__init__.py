@@ -63,6 +63,11 @@ group_user_totals_collection = db['group_user_totalsssssss']
 top_global_groups_collection = db['top_global_groups']
 pm_users = db['total_pm_users']
 locked_spawns_collection = db['locked_spawns']
+spawn_decks_collection = db['spawn_decks']
+chat_states_collection = db['chat_states']
+ownership_collection = db['character_ownership']
+migrations_collection = db['migrations']
+character_stats_collection = db['character_stats']
 
 # Helper function to handle JFIF and other image formats
 async def process_image_url(url):
@@ -0,0 +1,32 @@
+"""Number of catalog characters per anime, for the "owned/total" harem headers.
+
+Kept in sync with the catalog, so rendering a harem page never has to count
+documents in Mongo.
+"""
+from collections import Counter
+
+from shivu.catalog import catalog, CatalogListener
+
+
+class AnimeTotals(CatalogListener):
+    def __init__(self, catalog):
+        self.totals = Counter()  # {anime: characters in the catalog}
+        catalog.subscribe(self)
+
+    def reset(self, catalog) -> None:
+        self.totals = Counter(character.get('anime') for character in catalog.characters.values())
+
+    def added(self, character: dict) -> None:
+        self.totals[character.get('anime')] += 1
+
+    def removed(self, character: dict) -> None:
+        anime = character.get('anime')
+        self.totals[anime] -= 1
+        if self.totals[anime] <= 0:
+            del self.totals[anime]
+
+    def total(self, anime: str) -> int:
+        return self.totals.get(anime, 0)
+
+
+anime_totals = AnimeTotals(catalog)
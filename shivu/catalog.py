@@ -0,0 +1,120 @@
+"""In-memory mirror of the character catalog.
+
+The catalog only changes through /upload, /update, /delete and the spawn lock
+commands, but spawns read it constantly. It is loaded once at startup and then
+patched by those commands, and every derived index (such as the spawn pool)
+subscribes to the change events instead of querying Mongo on its own.
+"""
+import asyncio
+
+from shivu import collection, locked_spawns_collection, LOGGER
+
+# Fields that only say how a character's picture is sent, never what is shown about it
+MEDIA_FIELDS = frozenset({'file_id', 'file_type', 'media_type', 'mime_type', 'media_url', 'message_id'})
+
+
+class CatalogListener:
+    """Base class for indexes kept in sync with the catalog"""
+
+    def reset(self, catalog) -> None:
+        """Rebuild from scratch after a full (re)load"""
+
+    def added(self, character: dict) -> None:
+        """A character was uploaded or its new version was stored"""
+
+    def removed(self, character: dict) -> None:
+        """A character was deleted or its old version was replaced"""
+
+    def media_changed(self, old: dict, character: dict) -> None:
+        """Only the MEDIA_FIELDS of a character changed, such as a file_id captured on first send"""
+        self.removed(old)
+        self.added(character)
+
+    def lock_changed(self, character_id: str, locked: bool) -> None:
+        """A character was locked or unlocked from spawning"""
+
+
+class Catalog:
+    def __init__(self):
+        self.characters = {}  # {character_id: character document}
+        self.locked = set()  # character ids locked from spawning
+        self.loaded = False
+        self._listeners = []
+        self._load_lock = asyncio.Lock()
+
+    def subscribe(self, listener: CatalogListener) -> None:
+        self._listeners.append(listener)
+        if self.loaded:
+            listener.reset(self)
+
+    async def load(self) -> None:
+        """Load (or reload) the whole catalog and the locked spawn list"""
+        async with self._load_lock:
+            characters = {}
+            async for character in collection.find({}):
+                characters[character['id']] = character
+            locked = set(await locked_spawns_collection.distinct('character_id'))
+
+            self.characters = characters
+            self.locked = locked
+            self.loaded = True
+            for listener in self._listeners:
+                listener.reset(self)
+
+        LOGGER.info(f"Catalog loaded: {len(self.characters)} characters, {len(self.locked)} locked from spawning")
+
+    async def ensure_loaded(self) -> None:
+        if not self.loaded:
+            await self.load()
+
+    def get(self, character_id: str):
+        return self.characters.get(character_id)
+
+    def __len__(self) -> int:
+        return len(self.characters)
+
+    def add(self, character: dict) -> None:
+        """Register a freshly uploaded character"""
+        old = self.characters.get(character['id'])
+        if old is not None:
+            for listener in self._listeners:
+                listener.removed(old)
+        self.characters[character['id']] = character
+        for listener in self._listeners:
+            listener.added(character)
+
+    def update(self, character_id: str, fields: dict) -> None:
+        """Apply a $set that was just written to the character document"""
+        old = self.characters.get(character_id)
+        if old is None:
+            return
+        if not MEDIA_FIELDS.issuperset(fields):
+            self.add({**old, **fields})
+            return
+        character = self.characters[character_id] = {**old, **fields}
+        for listener in self._listeners:
+            listener.media_changed(old, character)
+
+    def remove(self, character_id: str) -> None:
+        old = self.characters.pop(character_id, None)
+        if old is None:
+            return
+        for listener in self._listeners:
+            listener.removed(old)
+
+    def lock(self, character_id: str) -> None:
+        if character_id in self.locked:
+            return
+        self.locked.add(character_id)
+        for listener in self._listeners:
+            listener.lock_changed(character_id, True)
+
+    def unlock(self, character_id: str) -> None:
+        if character_id not in self.locked:
+            return
+        self.locked.discard(character_id)
+        for listener in self._listeners:
+            listener.lock_changed(character_id, False)
+
+
+catalog = Catalog()
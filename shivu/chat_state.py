@@ -0,0 +1,237 @@
+"""Per-chat spawn state in one object, held in a memory-bounded LRU registry.
+
+Everything the bot tracks about a group (the active spawn, who guessed it,
+whether it was summoned, progress toward the next spawns and the spawn decks)
+lives in a single ChatState. The registry keeps recently active chats in
+memory within a byte budget; the least recently active chats are hibernated
+to the chat_states collection and rehydrated on their next message.
+
+Changed chats are written with one bulk_write every few seconds and on
+shutdown, so neither counting nor eviction adds a per-message DB write.
+"""
+import asyncio
+from collections import OrderedDict
+
+from pymongo import UpdateOne
+
+from shivu import chat_states_collection, LOGGER
+from shivu import metrics
+from shivu.catalog import catalog
+from shivu.config import Config
+from shivu.guess_matcher import GuessMatcher
+
+FLUSH_INTERVAL = 5  # seconds between batched writes
+CHAT_STATE_BUDGET = Config.CHAT_STATE_BUDGET_MB * 1024 * 1024
+
+# Rough footprint of a ChatState without decks: the object, its slots and the
+# per-chat entries in the registry. The active character document is shared
+# with the catalog so it is not counted.
+BASE_STATE_BYTES = 512
+DECK_OVERHEAD_BYTES = 128
+
+
+class ChatState:
+    __slots__ = (
+        "chat_id",
+        "last_character",
+        "matcher",
+        "first_guess",
+        "manually_summoned",
+        "message_count",
+        "retro_message_count",
+        "decks",
+        "size",
+    )
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.last_character = None  # character document of the active spawn
+        self.matcher = None  # GuessMatcher for the active spawn
+        self.first_guess = None  # user id of the first correct guess
+        self.manually_summoned = False  # summoned characters can be married many times
+        self.message_count = 0  # messages since the last normal spawn
+        self.retro_message_count = 0  # messages since the last Retro spawn
+        self.decks = {}  # {kind: SpawnDeck}, see shivu.spawn_deck
+        self.size = 0
+
+    @classmethod
+    def from_document(cls, chat_id: int, document: dict) -> "ChatState":
+        state = cls(chat_id)
+        if document:
+            character_id = document.get('last_character_id')
+            state.last_character = catalog.get(character_id) if character_id else None
+            state.matcher = GuessMatcher(state.last_character) if state.last_character else None
+            state.first_guess = document.get('first_guess')
+            state.manually_summoned = document.get('manually_summoned', False)
+            state.message_count = document.get('message_count', 0)
+            state.retro_message_count = document.get('retro_message_count', 0)
+        return state
+
+    def to_document(self) -> dict:
+        return {
+            'last_character_id': self.last_character['id'] if self.last_character else None,
+            'first_guess': self.first_guess,
+            'manually_summoned': self.manually_summoned,
+            'message_count': self.message_count,
+            'retro_message_count': self.retro_message_count,
+        }
+
+    def estimate_size(self) -> int:
+        size = BASE_STATE_BYTES
+        if self.matcher is not None:
+            size += self.matcher.estimate_size()
+        for deck in self.decks.values():
+            size += DECK_OVERHEAD_BYTES + deck.order.itemsize * len(deck.order)
+        return size
+
+    def new_spawn(self, character: dict, manually_summoned: bool = False) -> None:
+        """Make ``character`` the active spawn of this chat"""
+        self.last_character = character
+        self.matcher = GuessMatcher(character)
+        self.first_guess = None
+        self.manually_summoned = manually_summoned
+
+
+class ChatRegistry:
+    def __init__(self, budget: int = CHAT_STATE_BUDGET):
+        self.budget = budget
+        self.used = 0
+        self._states = OrderedDict()  # {chat_id: ChatState}, least recently used first
+        self._hibernating = {}  # evicted states waiting for the next flush
+        self._loading = {}  # {chat_id: Future} for rehydrations in flight
+        self._dirty = set()
+        self._task = None
+        self.hits = 0
+        self.rehydrated = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    async def get(self, chat_id: int) -> ChatState:
+        """Return the chat's state, rehydrating it from Mongo if it was hibernated"""
+        state = self._states.get(chat_id)
+        if state is not None:
+            self.hits += 1
+            self._states.move_to_end(chat_id)
+            return state
+
+        state = self._hibernating.pop(chat_id, None)
+        if state is None:
+            pending = self._loading.get(chat_id)
+            if pending is not None:
+                try:
+                    return await asyncio.shield(pending)
+                except asyncio.CancelledError:
+                    if asyncio.current_task().cancelling():
+                        raise
+                    # The load we joined was cancelled with its caller; load it again
+                    return await self.get(chat_id)
+            future = self._loading[chat_id] = asyncio.get_running_loop().create_future()
+            try:
+                document = await chat_states_collection.find_one({'_id': chat_id})
+                state = ChatState.from_document(chat_id, document)
+                self.rehydrated += 1
+            except Exception as e:
+                LOGGER.error(f"Failed to rehydrate chat state {chat_id}: {e}")
+                state = ChatState(chat_id)
+            finally:
+                del self._loading[chat_id]
+                if state is None:
+                    # Cancelled mid-load, so callers that joined it retry
+                    future.cancel()
+            future.set_result(state)
+
+        self._insert(state)
+        return state
+
+    def peek(self, chat_id: int):
+        """Return the in-memory state without touching LRU order or Mongo"""
+        return self._states.get(chat_id)
+
+    def touch(self, state: ChatState) -> None:
+        """Mark a state changed and re-account its size"""
+        self._dirty.add(state.chat_id)
+        if self._states.get(state.chat_id) is state:
+            size = state.estimate_size()
+            if size != state.size:
+                self.used += size - state.size
+                state.size = size
+                self._enforce_budget()
+        elif self._hibernating.get(state.chat_id) is not state:
+            # Evicted clean while a handler held it across an await: take it back,
+            # so the flush writes this change and the next get doesn't load a stale copy
+            self._hibernating.pop(state.chat_id, None)
+            replaced = self._states.pop(state.chat_id, None)
+            if replaced is not None:
+                self.used -= replaced.size
+            self._insert(state)
+
+    def _insert(self, state: ChatState) -> None:
+        state.size = state.estimate_size()
+        self._states[state.chat_id] = state
+        self.used += state.size
+        self._enforce_budget()
+
+    def _enforce_budget(self) -> None:
+        while self.used > self.budget and len(self._states) > 1:
+            chat_id, state = self._states.popitem(last=False)
+            self.used -= state.size
+            self.evictions += 1
+            if chat_id in self._dirty:
+                # Written by the next flush; served from here if the chat comes back first
+                self._hibernating[chat_id] = state
+
+    async def flush(self) -> None:
+        """Write every changed chat with one bulk_write"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        operations = []
+        for chat_id in dirty:
+            state = self._states.get(chat_id) or self._hibernating.get(chat_id)
+            if state is not None:
+                operations.append(UpdateOne({'_id': chat_id}, {'$set': state.to_document()}, upsert=True))
+        if not operations:
+            return
+        try:
+            await chat_states_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # Keep them dirty so the next flush retries with the latest values
+            self._dirty |= dirty
+            LOGGER.error(f"Failed to flush chat states for {len(dirty)} chats: {e}")
+            return
+        for chat_id in dirty:
+            if chat_id not in self._dirty:
+                self._hibernating.pop(chat_id, None)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'chats': len(self._states),
+            'bytes': self.used,
+            'budget_bytes': self.budget,
+            'hits': self.hits,
+            'rehydrated': self.rehydrated,
+            'evictions': self.evictions,
+            'hibernating': len(self._hibernating),
+            'dirty': len(self._dirty),
+        }
+
+
+chat_states = ChatRegistry()
+metrics.register('chat_states', chat_states.stats)
@@ -17,6 +17,8 @@ class Config(object):
     CHARA_CHANNEL_ID = os.environ.get("CHARA_CHANNEL_ID", "-1002934487265")
     api_id = int(os.environ.get("TELEGRAM_API_ID", "0"))
     api_hash = os.environ.get("TELEGRAM_API_HASH")
+    CHAT_STATE_BUDGET_MB = int(os.environ.get("CHAT_STATE_BUDGET_MB", "64"))
+    HAREM_PAGE_CACHE_SIZE = int(os.environ.get("HAREM_PAGE_CACHE_SIZE", "5000"))
 
     
 class Production(Config):
@@ -0,0 +1,106 @@
+"""Precomputed /marry answers for the active spawn of a chat.
+
+A spawn rush brings dozens of guesses for the same character within a second,
+so everything a guess can be compared with is worked out once, when the
+character spawns. The rules are those of the original matcher, applied to the
+name and to every admin-defined alias (``/update id aliases a,b``):
+
+1. all the words of the name, in any order
+2. any single word of the name
+3. the start of a word, at least 3 characters
+4. a piece of a word, at least 4 characters and 70% of its length
+
+plus one typo (an insertion, deletion, substitution or swap) in a whole word
+of at least TYPO_MIN_LENGTH characters. Names and guesses are normalized the
+same way: case-folded, diacritics and emoji stripped, punctuation dropped.
+"""
+import unicodedata
+
+PREFIX_MIN_LENGTH = 3
+SUBSTRING_MIN_LENGTH = 4
+SUBSTRING_MIN_RATIO = 0.7
+TYPO_MIN_LENGTH = 5
+
+
+def normalize(text: str) -> str:
+    """Case-fold ``text`` and keep only letters, digits and single spaces"""
+    characters = []
+    for character in unicodedata.normalize('NFKD', text.casefold()):
+        category = unicodedata.category(character)
+        if category[0] in 'LN':
+            characters.append(character)
+        elif category[0] == 'Z' or character in '-_.':
+            characters.append(' ')
+        # Combining marks (diacritics), emoji, symbols and other punctuation are dropped
+    return ' '.join(''.join(characters).split())
+
+
+def _deletes(word: str) -> set:
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """True if ``a`` and ``b`` differ by at most one insertion, deletion, substitution or swap"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    if a[i + 1:] == b[i + 1:]:
+        return True
+    return i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]
+
+
+class GuessMatcher:
+    __slots__ = ("answers", "typos")
+
+    def __init__(self, character: dict):
+        self.answers = set()  # normalized guesses accepted as they are
+        self.typos = {}  # {word or word with one letter deleted: words it may be a typo of}
+        names = [character.get('name', '')] + list(character.get('aliases') or [])
+        for name in names:
+            words = normalize(name).split()
+            if words:
+                self._add_name(words)
+
+    def _add_name(self, words: list) -> None:
+        self.answers.add(' '.join(sorted(words)))
+        for word in words:
+            self.answers.add(word)
+            for end in range(PREFIX_MIN_LENGTH, len(word) + 1):
+                self.answers.add(word[:end])
+            min_length = max(SUBSTRING_MIN_LENGTH, len(word) * SUBSTRING_MIN_RATIO)
+            for start in range(len(word)):
+                for end in range(start + SUBSTRING_MIN_LENGTH, len(word) + 1):
+                    if end - start >= min_length:
+                        self.answers.add(word[start:end])
+            if len(word) >= TYPO_MIN_LENGTH:
+                for variant in _deletes(word) | {word}:
+                    self.typos.setdefault(variant, set()).add(word)
+
+    def estimate_size(self) -> int:
+        """Rough memory footprint, for the chat state budget"""
+        return 64 * len(self.answers) + 96 * len(self.typos)
+
+    def matches(self, guess: str) -> bool:
+        words = normalize(guess).split()
+        if not words:
+            return False
+        if len(words) == 1:
+            word = words[0]
+            if word in self.answers:
+                return True
+            if len(word) >= TYPO_MIN_LENGTH - 1:
+                # Symmetric deletes: a one-edit typo shares a variant with the word
+                for variant in _deletes(word) | {word}:
+                    for candidate in self.typos.get(variant, ()):
+                        if _within_one_edit(word, candidate):
+                            return True
+            return False
+        return ' '.join(sorted(words)) in self.answers
@@ -0,0 +1,134 @@
+"""Rendered /harem pages, so flipping pages of an unchanged harem skips the rebuild.
+
+A page is keyed by the user, their harem version, the filter and sort
+preferences, the name in the title and the page number. Every ownership
+write for a user and every preference or favorite change bumps that user's
+version, and any catalog change other than new media (such as a captured
+file_id) bumps a global generation, so stale pages are never served; they
+simply stop being hit and age out of the LRU.
+
+Versions are read before the data a page is built from, so a page rendered
+while a write was in flight is stored under the old version and never served.
+
+Versions come from one counter shared by all users, and only MAX_VERSIONS
+users are remembered. Forgetting a user advances the counter, so when they
+come back their version is newer than any key stored for them before.
+"""
+from collections import OrderedDict
+
+from shivu import metrics
+from shivu.catalog import catalog, CatalogListener
+from shivu.config import Config
+
+PREF_FIELDS = ('filter_type', 'filter_value', 'sort_preference', 'favorites')
+MAX_VERSIONS = 100000  # users whose harem version is remembered
+
+
+class HaremPageCache(CatalogListener):
+    def __init__(self, catalog, max_pages: int = Config.HAREM_PAGE_CACHE_SIZE, max_versions: int = MAX_VERSIONS):
+        self.max_pages = max_pages
+        self.max_versions = max_versions
+        self.generation = 0  # bumped on every catalog change but new media
+        self._clock = 0  # last version handed out; advanced by every bump and every forgotten user
+        self._versions = OrderedDict()  # {user_id: harem version}, least recently used first
+        self.forgotten = 0
+        self._prefs = OrderedDict()  # {user_id: (version, preferences)}
+        self._pages = OrderedDict()  # {key: rendered page}
+        self.hits = 0
+        self.misses = 0
+        catalog.subscribe(self)
+
+    def reset(self, catalog) -> None:
+        self.generation += 1
+        self._pages.clear()
+
+    def added(self, character: dict) -> None:
+        self.generation += 1
+
+    def removed(self, character: dict) -> None:
+        self.generation += 1
+
+    def media_changed(self, old: dict, character: dict) -> None:
+        # Pages show the same text either way, and a stored picture still sends from its URL
+        pass
+
+    def version(self, user_id: int) -> int:
+        version = self._versions.get(user_id)
+        if version is None:
+            version = self._remember(user_id, self._clock)
+        else:
+            self._versions.move_to_end(user_id)
+        return version
+
+    def bump(self, user_id: int) -> None:
+        """The user's characters, favorite or preferences changed"""
+        self._clock += 1
+        self._remember(user_id, self._clock)
+        self._prefs.pop(user_id, None)
+
+    def _remember(self, user_id: int, version: int) -> int:
+        self._versions[user_id] = version
+        self._versions.move_to_end(user_id)
+        while len(self._versions) > self.max_versions:
+            forgotten, _version = self._versions.popitem(last=False)
+            self._prefs.pop(forgotten, None)
+            # Whatever version the user gets next is newer than their cached keys
+            self._clock += 1
+            self.forgotten += 1
+        return version
+
+    def get_prefs(self, user_id: int, version: int):
+        entry = self._prefs.get(user_id)
+        if entry is None or entry[0] != version:
+            return None
+        self._prefs.move_to_end(user_id)
+        return entry[1]
+
+    def put_prefs(self, user_id: int, version: int, user: dict) -> dict:
+        prefs = {field: user.get(field) for field in PREF_FIELDS}
+        if version == self.version(user_id):
+            self._prefs[user_id] = (version, prefs)
+            self._prefs.move_to_end(user_id)
+            while len(self._prefs) > self.max_pages:
+                self._prefs.popitem(last=False)
+        return prefs
+
+    def key(self, user_id: int, version: int, prefs: dict, user_name: str, page: int) -> tuple:
+        return (
+            user_id, version, self.generation,
+            prefs.get('filter_type'), prefs.get('filter_value'), prefs.get('sort_preference'),
+            user_name, page,
+        )
+
+    def get(self, key: tuple):
+        page = self._pages.get(key)
+        if page is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._pages.move_to_end(key)
+        return page
+
+    def put(self, key: tuple, page) -> None:
+        user_id, version, generation = key[:3]
+        if version != self.version(user_id) or generation != self.generation:
+            return
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            'pages': len(self._pages),
+            'prefs': len(self._prefs),
+            'versioned_users': len(self._versions),
+            'forgotten_users': self.forgotten,
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+harem_pages = HaremPageCache(catalog)
+metrics.register('harem_pages', harem_pages.stats)
@@ -0,0 +1,224 @@
+"""Every index the bot's queries rely on, created in the background at startup.
+
+Index creation used to be missing altogether apart from the ownership
+collection, so lookups of users and characters by id, leaderboard sorts and
+spawn lock checks could all be collection scans. INDEXES lists each index
+with the queries it serves; ``IndexManager.start`` creates any that are
+missing without holding up startup, and a failure (such as duplicate ids
+under a unique index) is logged and reported instead of stopping the bot.
+Indexes marked ``required`` guard writes that rely on them (concurrent
+ownership upserts) and are awaited before the handlers start.
+
+A plain index on a key that should be unique is converted in place where the
+server supports it (collMod, MongoDB 6.0+), else the unique index is built
+under another name first; the plain one is only dropped once the unique one
+exists, so the key is never left without an index.
+
+QUERY_SHAPES are the hot queries; /explain runs the planner on each of them
+and flags the ones answered by a collection scan.
+"""
+import asyncio
+
+from pymongo.errors import OperationFailure
+
+from shivu import (
+    collection, user_collection, user_totals_collection, group_user_totals_collection,
+    top_global_groups_collection, locked_spawns_collection, ownership_collection, LOGGER,
+)
+from shivu import metrics
+
+
+class Index:
+    def __init__(self, collection, keys: list, unique: bool = False, required: bool = False, serves: str = ''):
+        self.collection = collection
+        self.keys = keys
+        self.unique = unique
+        self.required = required  # ensured before the handlers start
+        self.serves = serves
+        self.name = '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+    def __str__(self) -> str:
+        return f"{self.collection.name}.{self.name}{' (unique)' if self.unique else ''}"
+
+
+class QueryShape:
+    def __init__(self, label: str, collection, filter: dict, sort: list = None, limit: int = 0):
+        self.label = label
+        self.collection = collection
+        self.filter = filter
+        self.sort = sort
+        self.limit = limit
+
+
+INDEXES = [
+    Index(user_collection, [('id', 1)], unique=True, serves="user lookups by id"),
+    Index(user_collection, [('characters.id', 1)], serves="owners of a character in embedded harems"),
+    Index(collection, [('id', 1)], unique=True, serves="character lookups by id and harem joins"),
+    Index(collection, [('anime', 1)], serves="characters of an anime"),
+    Index(ownership_collection, [('user_id', 1), ('character_id', 1)], unique=True, required=True, serves="harems and claims"),
+    Index(ownership_collection, [('character_id', 1), ('count', -1)], serves="owners of a character"),
+    Index(group_user_totals_collection, [('group_id', 1), ('count', -1)], serves="group leaderboards"),
+    Index(group_user_totals_collection, [('group_id', 1), ('user_id', 1)], serves="group claim counters"),
+    Index(top_global_groups_collection, [('group_id', 1)], serves="global group counters"),
+    Index(top_global_groups_collection, [('count', -1)], serves="the global group leaderboard"),
+    Index(locked_spawns_collection, [('character_id', 1)], serves="spawn lock checks"),
+    Index(user_totals_collection, [('chat_id', 1)], serves="spawn frequency per chat"),
+]
+
+QUERY_SHAPES = [
+    QueryShape("user by id", user_collection, {'id': 0}),
+    QueryShape("embedded owners of a character", user_collection, {'characters.id': '0'}),
+    QueryShape("character by id", collection, {'id': '0'}),
+    QueryShape("characters of an anime", collection, {'anime': ''}),
+    QueryShape("harem of a user", ownership_collection, {'user_id': 0, 'count': {'$gt': 0}}),
+    QueryShape("copies of a character", ownership_collection, {'user_id': 0, 'character_id': '0'}),
+    QueryShape("top owners of a character", ownership_collection, {'character_id': '0', 'count': {'$gt': 0}}, [('count', -1)], 20),
+    QueryShape("group leaderboard", group_user_totals_collection, {'group_id': 0}, [('count', -1)], 10),
+    QueryShape("group claim counter", group_user_totals_collection, {'group_id': 0, 'user_id': 0}),
+    QueryShape("global group leaderboard", top_global_groups_collection, {}, [('count', -1)], 10),
+    QueryShape("global group counter", top_global_groups_collection, {'group_id': 0}),
+    QueryShape("spawn lock", locked_spawns_collection, {'character_id': '0'}),
+    QueryShape("chat spawn frequency", user_totals_collection, {'chat_id': '0'}),
+]
+
+
+def _plan_stages(plan, stages: list) -> list:
+    """(stage, index name) of every stage in an explain plan, top down"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append((plan['stage'], plan.get('indexName')))
+        for value in plan.values():
+            _plan_stages(value, stages)
+    elif isinstance(plan, list):
+        for value in plan:
+            _plan_stages(value, stages)
+    return stages
+
+
+class IndexManager:
+    def __init__(self, indexes: list = INDEXES, shapes: list = QUERY_SHAPES):
+        self.indexes = indexes
+        self.shapes = shapes
+        self.status = {str(index): 'pending' for index in indexes}
+        self.ensured = 0
+        self.failed = 0
+        self._task = None
+
+    async def _duplicates(self, index: Index) -> int:
+        key = {field: f'${field}' for field, _direction in index.keys}
+        result = await index.collection.aggregate([
+            {'$group': {'_id': key, 'n': {'$sum': 1}}},
+            {'$match': {'n': {'$gt': 1}}},
+            {'$count': 'keys'},
+        ], allowDiskUse=True).to_list(length=1)
+        return result[0]['keys'] if result else 0
+
+    async def _convert_in_place(self, index: Index, existing_name: str) -> None:
+        """Make an existing index unique with collMod; raises if the server can't or duplicates exist"""
+        database = index.collection.database
+        # prepareUnique rejects new duplicates first, so none can slip in before the conversion
+        await database.command('collMod', index.collection.name, index={'name': existing_name, 'prepareUnique': True})
+        try:
+            await database.command('collMod', index.collection.name, index={'name': existing_name, 'unique': True})
+        except OperationFailure:
+            await database.command('collMod', index.collection.name, index={'name': existing_name, 'prepareUnique': False})
+            raise
+
+    async def _upgrade_to_unique(self, index: Index, existing_name: str) -> str:
+        """Make a plain index on the same keys unique, unless duplicates would break it; the plain one stays until then"""
+        duplicates = await self._duplicates(index)
+        if duplicates:
+            return f"failed: {duplicates} duplicated keys, the plain index {existing_name} stays"
+        try:
+            await self._convert_in_place(index, existing_name)
+            return 'converted to unique'
+        except OperationFailure as e:
+            LOGGER.info(f"Index {index}: in-place conversion unavailable ({e}), building it beside {existing_name}")
+        name = index.name if existing_name != index.name else f"{index.name}_unique"
+        try:
+            await index.collection.create_index(index.keys, unique=True, name=name)
+        except OperationFailure as e:
+            return f"failed: {e}; the plain index {existing_name} stays"
+        try:
+            await index.collection.drop_index(existing_name)
+        except OperationFailure as e:
+            return f"upgraded to unique as {name}; the plain index {existing_name} could not be dropped: {e}"
+        return f"upgraded to unique as {name}"
+
+    async def ensure(self, index: Index) -> str:
+        # An index on the same keys may exist under another name, created by hand or by older code
+        existing = await index.collection.index_information()
+        for name, info in existing.items():
+            if [tuple(key) for key in info['key']] != [tuple(key) for key in index.keys]:
+                continue
+            if index.unique and not info.get('unique'):
+                status = await self._upgrade_to_unique(index, name)
+            else:
+                status = 'ok' if name == index.name else f"ok (as {name})"
+            break
+        else:
+            await index.collection.create_index(index.keys, unique=index.unique, name=index.name)
+            status = 'created'
+        self.status[str(index)] = status
+        return status
+
+    async def ensure_all(self, indexes: list = None) -> dict:
+        """Create every missing index, one at a time so the database isn't swamped at startup"""
+        for index in self.indexes if indexes is None else indexes:
+            try:
+                status = await self.ensure(index)
+            except Exception as e:
+                status = self.status[str(index)] = f"failed: {e}"
+            if status.startswith('failed'):
+                self.failed += 1
+                LOGGER.warning(f"Index {index} ({index.serves}): {status}")
+            else:
+                self.ensured += 1
+        LOGGER.info(f"Indexes ensured: {self.ensured} ok, {self.failed} failed")
+        return dict(self.status)
+
+    async def ensure_required(self) -> dict:
+        return await self.ensure_all([index for index in self.indexes if index.required])
+
+    def start(self) -> None:
+        """Build the indexes that aren't required in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.ensure_all([index for index in self.indexes if not index.required]))
+
+    async def explain(self, shape: QueryShape) -> dict:
+        """{'stages', 'collscan', 'in_memory_sort', 'index'} of the planner's winning plan for a query shape"""
+        cursor = shape.collection.find(shape.filter)
+        if shape.sort:
+            cursor = cursor.sort(shape.sort)
+        if shape.limit:
+            cursor = cursor.limit(shape.limit)
+        plan = (await cursor.explain()).get('queryPlanner', {}).get('winningPlan', {})
+        stages = _plan_stages(plan, [])
+        return {
+            'stages': [stage for stage, _index in stages],
+            'collscan': any(stage == 'COLLSCAN' for stage, _index in stages),
+            'in_memory_sort': any(stage == 'SORT' for stage, _index in stages),
+            'index': next((index for _stage, index in stages if index), None),
+        }
+
+    async def explain_all(self) -> list:
+        """(shape, plan or error message) for every known query shape"""
+        results = []
+        for shape in self.shapes:
+            try:
+                results.append((shape, await self.explain(shape)))
+            except Exception as e:
+                results.append((shape, str(e)))
+        return results
+
+    def stats(self) -> dict:
+        return {
+            'indexes': len(self.indexes),
+            'ok': self.ensured,
+            'failed': self.failed,
+            'pending': sum(status == 'pending' for status in self.status.values()),
+        }
+
+
+index_manager = IndexManager()
+metrics.register('indexes', index_manager.stats)
@@ -0,0 +1,115 @@
+"""Prebuilt inline query results and short-lived ranked id lists per query.
+
+Inline queries used to rebuild every result object, with a timestamp in its
+id, for every keystroke and every scrolled page. Result ids are now the
+character ids, so an answer Telegram caches stays valid, and the built
+result for a character is kept until the character changes.
+
+The ranked character ids of a query are kept for QUERY_TTL seconds, so
+scrolling through an answer only slices the list. Global lists are keyed by
+the catalog generation and collection lists by the user's harem version, so
+a change to either is never answered from a stale list.
+
+When an answer has more than one page, its ids are frozen under an opaque
+token that goes into next_offset. Later pages slice the frozen list, so
+scrolling costs one page however deep it goes, and the order doesn't shift
+under the user if the catalog or their harem changes meanwhile.
+"""
+import secrets
+from collections import OrderedDict
+
+from cachetools import TTLCache
+
+from shivu import metrics
+from shivu.catalog import catalog, CatalogListener
+
+QUERY_TTL = 30  # Seconds a query's ranked ids are reused
+MAX_QUERIES = 10000
+MAX_RESULTS = 20000  # Built results kept, least recently used dropped first
+FROZEN_TTL = 900  # Seconds a continuation token stays valid, longer than Telegram caches an answer
+MAX_FROZEN = 50000
+
+
+class InlineResultCache(CatalogListener):
+    def __init__(self, catalog, query_ttl: float = QUERY_TTL, max_queries: int = MAX_QUERIES, max_results: int = MAX_RESULTS):
+        self.catalog = catalog
+        self.max_results = max_results
+        self.generation = 0  # bumped on every catalog change but new media
+        self._queries = TTLCache(maxsize=max_queries, ttl=query_ttl)  # {query key: [character ids]}
+        self._results = OrderedDict()  # {character_id: InlineQueryResult}
+        self._frozen = TTLCache(maxsize=MAX_FROZEN, ttl=FROZEN_TTL)  # {token: [character ids]}
+        self.query_hits = 0
+        self.query_misses = 0
+        self.result_hits = 0
+        self.result_misses = 0
+        catalog.subscribe(self)
+
+    def reset(self, catalog) -> None:
+        self.generation += 1
+        self._results.clear()
+
+    def added(self, character: dict) -> None:
+        self.generation += 1
+
+    def removed(self, character: dict) -> None:
+        self.generation += 1
+        self._results.pop(character['id'], None)
+
+    def media_changed(self, old: dict, character: dict) -> None:
+        # Search lists don't depend on media; only this character's result is rebuilt
+        self._results.pop(character['id'], None)
+
+    def get_ids(self, key: tuple):
+        ids = self._queries.get(key)
+        if ids is None:
+            self.query_misses += 1
+        else:
+            self.query_hits += 1
+        return ids
+
+    def put_ids(self, key: tuple, ids: list) -> None:
+        self._queries[key] = ids
+
+    def freeze(self, ids: list) -> str:
+        """Keep an answer's ids for its later pages; returns the token to put in next_offset"""
+        token = secrets.token_urlsafe(9)
+        self._frozen[token] = ids
+        return token
+
+    def frozen(self, token: str):
+        """The ids frozen under a token, or None once it expired"""
+        return self._frozen.get(token)
+
+    def get_result(self, character_id: str):
+        result = self._results.get(character_id)
+        if result is None:
+            self.result_misses += 1
+            return None
+        self.result_hits += 1
+        self._results.move_to_end(character_id)
+        return result
+
+    def put_result(self, character: dict, result) -> None:
+        # A result built while the character was being replaced is not kept
+        if self.catalog.get(character['id']) is not character:
+            return
+        self._results[character['id']] = result
+        self._results.move_to_end(character['id'])
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            'queries': len(self._queries),
+            'results': len(self._results),
+            'frozen': len(self._frozen),
+            'generation': self.generation,
+            'query_hits': self.query_hits,
+            'query_misses': self.query_misses,
+            'result_hits': self.result_hits,
+            'result_misses': self.result_misses,
+        }
+
+
+inline_results = InlineResultCache(catalog)
+metrics.register('inline_results', inline_results.stats)
@@ -0,0 +1,84 @@
+"""Per-user "latest wins" for handlers whose older events go stale.
+
+Telegram sends an inline query per keystroke, and /harem arrows get tapped
+several times a second. Each event ran its handler (and its searches and
+aggregations) to the end even when a newer event from the same user had
+already made the answer useless. Work run through ``LatestWins.run`` is
+cancelled as soon as a newer event for the same key arrives. An optional
+debounce delays the start, so a superseded event is dropped before it has
+done anything at all.
+"""
+import asyncio
+
+from shivu import metrics
+
+SHORT_QUERY_LENGTH = 2  # Inline queries this short are still being typed
+SHORT_QUERY_DEBOUNCE = 0.3  # Seconds such a query waits for the next keystroke
+
+
+class LatestWins:
+    def __init__(self):
+        self._current = {}  # {key: Task running the latest event}
+        self._superseded = set()  # tasks cancelled by a newer event
+        self.started = 0
+        self.completed = 0
+        self.skipped = 0  # superseded while debouncing, before any work
+        self.cancelled = 0  # superseded while working
+
+    async def run(self, key, work, debounce: float = 0.0, superseded=None):
+        """Await ``work()`` unless a newer event for ``key`` supersedes it; returns None if it did.
+
+        ``superseded()`` is awaited in that case, to close out the dropped event.
+        """
+        task = asyncio.current_task()
+        previous = self._current.get(key)
+        self._current[key] = task
+        if previous is not None and not previous.done():
+            self._superseded.add(previous)
+            previous.cancel()
+
+        self.started += 1
+        working = False
+        try:
+            if debounce:
+                await asyncio.sleep(debounce)
+            working = True
+            result = await work()
+            self.completed += 1
+            return result
+        except asyncio.CancelledError:
+            if task not in self._superseded:
+                raise
+            # Our own cancellation, so the rest of the handler may go on
+            task.uncancel()
+            if working:
+                self.cancelled += 1
+            else:
+                self.skipped += 1
+            if superseded is not None:
+                try:
+                    await superseded()
+                except Exception:
+                    pass
+            return None
+        finally:
+            self._superseded.discard(task)
+            if self._current.get(key) is task:
+                del self._current[key]
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._current),
+            'started': self.started,
+            'completed': self.completed,
+            'skipped': self.skipped,
+            'cancelled': self.cancelled,
+            'avoided': self.skipped + self.cancelled,
+            'avoided_rate': (self.skipped + self.cancelled) / self.started if self.started else 0.0,
+        }
+
+
+inline_queries = LatestWins()
+harem_clicks = LatestWins()
+metrics.register('latest_inline_queries', inline_queries.stats)
+metrics.register('latest_harem_clicks', harem_clicks.stats)
@@ -0,0 +1,194 @@
+"""Write-behind buffer for the group and global leaderboard counters.
+
+Every /marry bumps a per-group user count and a per-group total. Instead of
+two upserts on the reply path, the increments are merged by key in memory and
+written with one bulk_write per collection every FLUSH_INTERVAL seconds, as
+soon as FLUSH_OPS claims are pending, and once more on shutdown.
+
+/ctop and /TopGroups stay exact by merging the unflushed deltas into what
+Mongo returns (see ``top_group_users`` and ``top_groups``). A key that is
+neither in Mongo's top ten nor pending can't overtake it, so only pending
+keys outside the top ten need their stored count fetched.
+"""
+import asyncio
+
+from pymongo import UpdateOne
+
+from shivu import group_user_totals_collection, top_global_groups_collection, LOGGER
+from shivu import metrics
+
+FLUSH_INTERVAL = 5  # seconds between batched writes
+FLUSH_OPS = 500  # pending claims that trigger an early flush
+TOP_LIMIT = 10
+
+
+class LeaderboardBuffer:
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, flush_ops: int = FLUSH_OPS):
+        self.flush_interval = flush_interval
+        self.flush_ops = flush_ops
+        self.group_users = {}  # {(group_id, user_id): {'count', 'username', 'first_name'}}
+        self.groups = {}  # {group_id: {'count', 'group_name'}}
+        self.pending_ops = 0
+        self.flushed_ops = 0
+        self.flushes = 0
+        # Held while a batch is written and while a leaderboard is read, so a
+        # read never sees a batch both in Mongo and still pending, or in neither
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._early_flush = None
+
+    def record(self, user, chat) -> None:
+        """Count one claim by ``user`` in ``chat``"""
+        group_user = self.group_users.get((chat.id, user.id))
+        if group_user is None:
+            group_user = self.group_users[(chat.id, user.id)] = {'count': 0}
+        group_user['count'] += 1
+        group_user['username'] = user.username
+        group_user['first_name'] = user.first_name
+
+        group = self.groups.get(chat.id)
+        if group is None:
+            group = self.groups[chat.id] = {'count': 0}
+        group['count'] += 1
+        group['group_name'] = chat.title
+
+        self.pending_ops += 1
+        if self.pending_ops >= self.flush_ops and self._early_flush is None:
+            self._early_flush = asyncio.create_task(self._flush_early())
+
+    async def _flush_early(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self._early_flush = None
+
+    def _merge_back(self, group_users: dict, groups: dict) -> None:
+        """Return a failed batch to the buffer without losing newer deltas or names"""
+        for key, delta in group_users.items():
+            current = self.group_users.get(key)
+            if current is None:
+                self.group_users[key] = delta
+            else:
+                current['count'] += delta['count']
+        for key, delta in groups.items():
+            current = self.groups.get(key)
+            if current is None:
+                self.groups[key] = delta
+            else:
+                current['count'] += delta['count']
+
+    async def flush(self) -> None:
+        """Write every pending delta with one bulk_write per collection"""
+        async with self._lock:
+            if not self.group_users and not self.groups:
+                return
+            group_users, self.group_users = self.group_users, {}
+            groups, self.groups = self.groups, {}
+            ops, self.pending_ops = self.pending_ops, 0
+
+            group_user_operations = [
+                UpdateOne(
+                    {'user_id': user_id, 'group_id': group_id},
+                    {'$inc': {'count': delta['count']}, '$set': {'username': delta['username'], 'first_name': delta['first_name']}},
+                    upsert=True
+                )
+                for (group_id, user_id), delta in group_users.items()
+            ]
+            group_operations = [
+                UpdateOne(
+                    {'group_id': group_id},
+                    {'$inc': {'count': delta['count']}, '$set': {'group_name': delta['group_name']}},
+                    upsert=True
+                )
+                for group_id, delta in groups.items()
+            ]
+            results = await asyncio.gather(
+                self._write(group_user_totals_collection, group_user_operations),
+                self._write(top_global_groups_collection, group_operations),
+                return_exceptions=True
+            )
+
+            # Each collection succeeded or failed as a whole; retry only what failed
+            failed_group_users = group_users if isinstance(results[0], Exception) else {}
+            failed_groups = groups if isinstance(results[1], Exception) else {}
+            for result in results:
+                if isinstance(result, Exception):
+                    LOGGER.error(f"Failed to flush leaderboard counters: {result}")
+            if failed_group_users or failed_groups:
+                self._merge_back(failed_group_users, failed_groups)
+                self.pending_ops += ops
+            else:
+                self.flushed_ops += ops
+            self.flushes += 1
+
+    @staticmethod
+    async def _write(collection, operations: list) -> None:
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+
+    async def top_group_users(self, group_id: int, limit: int = TOP_LIMIT) -> list:
+        """Top users of a group by claims, including unflushed ones"""
+        async with self._lock:
+            rows = await group_user_totals_collection.find(
+                {'group_id': group_id},
+                {'_id': 0, 'user_id': 1, 'username': 1, 'first_name': 1, 'count': 1}
+            ).sort('count', -1).limit(limit).to_list(length=limit)
+            pending = {user_id: delta for (pending_group, user_id), delta in self.group_users.items() if pending_group == group_id}
+            return await self._merge(rows, 'user_id', pending, limit, lambda missing: group_user_totals_collection.find(
+                {'group_id': group_id, 'user_id': {'$in': missing}},
+                {'_id': 0, 'user_id': 1, 'username': 1, 'first_name': 1, 'count': 1}
+            ))
+
+    async def top_groups(self, limit: int = TOP_LIMIT) -> list:
+        """Top groups by claims, including unflushed ones"""
+        async with self._lock:
+            rows = await top_global_groups_collection.find(
+                {}, {'_id': 0, 'group_id': 1, 'group_name': 1, 'count': 1}
+            ).sort('count', -1).limit(limit).to_list(length=limit)
+            return await self._merge(rows, 'group_id', dict(self.groups), limit, lambda missing: top_global_groups_collection.find(
+                {'group_id': {'$in': missing}},
+                {'_id': 0, 'group_id': 1, 'group_name': 1, 'count': 1}
+            ))
+
+    @staticmethod
+    async def _merge(rows: list, key: str, pending: dict, limit: int, find_missing) -> list:
+        if not pending:
+            return rows
+        merged = {row[key]: row for row in rows}
+        missing = [value for value in pending if value not in merged]
+        if missing:
+            async for row in find_missing(missing):
+                merged[row[key]] = row
+        for value, delta in pending.items():
+            row = merged.setdefault(value, {key: value, 'count': 0})
+            row.update({field: name for field, name in delta.items() if field != 'count'})
+            row['count'] = row.get('count', 0) + delta['count']
+        return sorted(merged.values(), key=lambda row: row['count'], reverse=True)[:limit]
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'pending_claims': self.pending_ops,
+            'pending_group_users': len(self.group_users),
+            'pending_groups': len(self.groups),
+            'flushed_claims': self.flushed_ops,
+            'flushes': self.flushes,
+        }
+
+
+leaderboard_buffer = LeaderboardBuffer()
+metrics.register('leaderboard_buffer', leaderboard_buffer.stats)
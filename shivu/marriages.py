@@ -0,0 +1,42 @@
+"""Database side of a successful /marry.
+
+A claim used to read the user twice and then read-modify-write each of the
+user, group-user and group documents in turn, up to ten sequential round
+trips before the reply. Now the user document gets one atomic upsert and the
+character one ownership upsert, run together, and the group and global
+leaderboard counters go to the write-behind leaderboard buffer.
+"""
+import asyncio
+
+from shivu import user_collection
+from shivu import ownership
+from shivu.leaderboard_buffer import leaderboard_buffer
+from shivu.popular_feed import popular_feed
+
+DAILY_MARRIAGE_LIMIT = 30
+
+
+async def daily_marriage_count(user_id: int, today: str) -> int:
+    """Return how many characters the user married on ``today`` (UTC date)"""
+    user = await user_collection.find_one({'id': user_id}, {f'daily_marriages.{today}': 1})
+    if not user:
+        return 0
+    return user.get('daily_marriages', {}).get(today, 0)
+
+
+async def record_marriage(user, chat, character: dict, today: str) -> None:
+    """Give ``character`` to ``user`` and count the claim for the user, the group and the global board"""
+    await asyncio.gather(
+        user_collection.update_one(
+            {'id': user.id},
+            {
+                '$inc': {f'daily_marriages.{today}': 1},
+                '$set': {'username': user.username, 'first_name': user.first_name},
+                '$setOnInsert': {'ownership_migrated': True},
+            },
+            upsert=True
+        ),
+        ownership.add(user.id, character['id']),
+    )
+    leaderboard_buffer.record(user, chat)
+    popular_feed.record_claim(character['id'])
@@ -0,0 +1,235 @@
+"""Where a character's picture is sent from, and what kind of file it is.
+
+Telegram keeps every file the bot has sent and returns a file_id for it, and
+sending that id again skips the fetch of img_url from Catbox or Discord. The
+file_id of the database channel post is stored on the character at /upload
+and /update, spawns store one the first time they send a character without
+it, and /backfillfileids fills in the rest of the catalog.
+
+What the URL points to is worked out once, when it is set: ``probe`` asks the
+host for the content type and stores ``media_type`` ('photo' or 'video'),
+``mime_type`` and the normalized ``media_url`` on the character. Display
+paths read those fields instead of scanning the URL; /backfillmedia fills
+them in for characters uploaded before.
+"""
+import asyncio
+import mimetypes
+
+import aiohttp
+from pymongo import UpdateOne
+from telegram.error import BadRequest, RetryAfter
+
+from shivu import application, shivuu, collection, process_image_url, CHARA_CHANNEL_ID, LOGGER
+from shivu.catalog import catalog
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv')
+EXTENSION_MIME_TYPES = {
+    '.webm': 'video/webm',
+    '.mov': 'video/quicktime',
+    '.avi': 'video/x-msvideo',
+    '.mkv': 'video/x-matroska',
+    '.flv': 'video/x-flv',
+    '.mp4': 'video/mp4',
+}
+PROBE_TIMEOUT = 10  # Seconds per content-type probe
+PROBE_CONCURRENCY = 8  # Probes in flight during /backfillmedia
+BACKFILL_BATCH = 200  # Channel posts read per request
+BACKFILL_INTERVAL = 3.0  # Seconds between requests, well under the channel's flood limits
+
+
+def _guess_from_url(url: str, name: str = '') -> dict:
+    """Media type and MIME type from the URL's extension, for hosts that don't say"""
+    lowered = (url or '').lower()
+    for extension in VIDEO_EXTENSIONS:
+        if extension in lowered:
+            return {'media_type': 'video', 'mime_type': EXTENSION_MIME_TYPES[extension]}
+    if '🎬' in (name or ''):
+        return {'media_type': 'video', 'mime_type': 'video/mp4'}
+    mime_type = mimetypes.guess_type(lowered.split('?', 1)[0])[0]
+    return {'media_type': 'photo', 'mime_type': mime_type if mime_type and mime_type.startswith('image/') else 'image/jpeg'}
+
+
+async def _content_type(session, url: str):
+    for method, headers in (('HEAD', {}), ('GET', {'Range': 'bytes=0-0'})):
+        try:
+            async with session.request(method, url, headers=headers, allow_redirects=True) as response:
+                if response.status < 400:
+                    content_type = response.headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+                    if content_type.startswith(('image/', 'video/')):
+                        return content_type
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            continue
+    return None
+
+
+async def probe(url: str, name: str = '', session=None) -> dict:
+    """{'media_type', 'mime_type', 'media_url'} for an image URL, asking its host for the content type"""
+    media_url = await process_image_url(url)
+    info = _guess_from_url(media_url, name)
+    if session is None:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PROBE_TIMEOUT)) as session:
+            content_type = await _content_type(session, media_url)
+    else:
+        content_type = await _content_type(session, media_url)
+    if content_type and info['media_type'] == 'photo':
+        # The host knows better than the extension, except for the 🎬 marker and video extensions
+        info = {'media_type': 'video' if content_type.startswith('video/') else 'photo', 'mime_type': content_type}
+    elif content_type and content_type.startswith('video/'):
+        info['mime_type'] = content_type
+    info['media_url'] = media_url
+    return info
+
+
+def is_video(character: dict) -> bool:
+    """Whether the character's media has to be sent as a video"""
+    if not character:
+        return False
+    if character.get('file_id'):
+        return character.get('file_type') == 'video'
+    if character.get('media_type'):
+        return character['media_type'] == 'video'
+    return _guess_from_url(character.get('img_url'), character.get('name'))['media_type'] == 'video'
+
+
+def mime_type(character: dict) -> str:
+    return character.get('mime_type') or _guess_from_url(character.get('img_url'), character.get('name'))['mime_type']
+
+
+def file_fields(message) -> dict:
+    """{'file_id', 'file_type'} of the media in a sent message (python-telegram-bot or pyrogram), or {}"""
+    if message is None:
+        return {}
+    if getattr(message, 'video', None):
+        return {'file_id': message.video.file_id, 'file_type': 'video'}
+    if getattr(message, 'animation', None):
+        return {'file_id': message.animation.file_id, 'file_type': 'video'}
+    photo = getattr(message, 'photo', None)
+    if photo:
+        # The Bot API lists every size, pyrogram gives the largest one
+        if isinstance(photo, (list, tuple)):
+            photo = photo[-1]
+        return {'file_id': photo.file_id, 'file_type': 'photo'}
+    return {}
+
+
+async def media_source(character: dict) -> str:
+    """What to pass as photo/video when sending the character: its file_id, else its image URL"""
+    return character.get('file_id') or character.get('media_url') or await process_image_url(character.get('img_url'))
+
+
+async def remember(character: dict, message) -> None:
+    """Store the file_id Telegram returned for a message showing the character"""
+    fields = file_fields(message)
+    if not fields or fields['file_id'] == character.get('file_id'):
+        return
+    await collection.update_one({'id': character['id']}, {'$set': fields})
+    catalog.update(character['id'], fields)
+
+
+async def send_character(bot, chat_id: int, character: dict, caption: str, parse_mode: str = None):
+    """Send the character's picture by file_id when known; a stale file_id falls back to img_url"""
+    if character.get('file_id'):
+        send = bot.send_video if character.get('file_type') == 'video' else bot.send_photo
+        media_field = 'video' if character.get('file_type') == 'video' else 'photo'
+        try:
+            return await send(chat_id=chat_id, caption=caption, parse_mode=parse_mode, **{media_field: character['file_id']})
+        except BadRequest as e:
+            LOGGER.warning(f"Stored file_id of character {character['id']} was rejected ({e}), sending img_url instead")
+            character = {**character, 'file_id': None}
+
+    send = bot.send_video if is_video(character) else bot.send_photo
+    media_field = 'video' if is_video(character) else 'photo'
+    url = character.get('media_url') or await process_image_url(character['img_url'])
+    message = await send(chat_id=chat_id, caption=caption, parse_mode=parse_mode, **{media_field: url})
+    await remember(character, message)
+    return message
+
+
+async def _upload_for_file_id(character: dict):
+    """Post the character's media to the database channel and delete it again; the file_id outlives the post"""
+    send = application.bot.send_video if is_video(character) else application.bot.send_photo
+    media_field = 'video' if is_video(character) else 'photo'
+    url = character.get('media_url') or await process_image_url(character['img_url'])
+    try:
+        message = await send(chat_id=CHARA_CHANNEL_ID, **{media_field: url})
+    except RetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        message = await send(chat_id=CHARA_CHANNEL_ID, **{media_field: url})
+    try:
+        await message.delete()
+    except Exception:
+        pass
+    return message
+
+
+async def backfill_file_ids(progress=None) -> dict:
+    """Capture a file_id for every catalog character that has none, a few requests at a time.
+
+    The database channel posts are read first, BACKFILL_BATCH per request;
+    characters whose post is gone are uploaded to the channel once.
+    """
+    await catalog.ensure_loaded()
+    missing = [character for character in catalog.characters.values() if not character.get('file_id') and character.get('img_url')]
+    result = {'missing': len(missing), 'from_posts': 0, 'uploaded': 0, 'failed': 0}
+
+    posted = [character for character in missing if character.get('message_id')]
+    unposted = [character for character in missing if not character.get('message_id')]
+    for start in range(0, len(posted), BACKFILL_BATCH):
+        batch = posted[start:start + BACKFILL_BATCH]
+        try:
+            messages = await shivuu.get_messages(int(CHARA_CHANNEL_ID), [character['message_id'] for character in batch])
+        except Exception as e:
+            LOGGER.warning(f"Could not read database channel posts for file_ids: {e}")
+            messages = [None] * len(batch)
+        for character, message in zip(batch, messages):
+            if message is not None and not message.empty and file_fields(message):
+                await remember(character, message)
+                result['from_posts'] += 1
+            else:
+                unposted.append(character)
+        if progress:
+            await progress(result)
+        await asyncio.sleep(BACKFILL_INTERVAL)
+
+    for i, character in enumerate(unposted, start=1):
+        try:
+            await remember(character, await _upload_for_file_id(character))
+            result['uploaded'] += 1
+        except Exception as e:
+            LOGGER.warning(f"Could not capture a file_id for character {character['id']}: {e}")
+            result['failed'] += 1
+        if progress and i % 20 == 0:
+            await progress(result)
+        await asyncio.sleep(BACKFILL_INTERVAL)
+
+    LOGGER.info(f"file_id backfill: {result}")
+    return result
+
+
+async def backfill_media_info(progress=None) -> dict:
+    """Probe every catalog character without media_type and store what was found"""
+    await catalog.ensure_loaded()
+    missing = [character for character in catalog.characters.values() if not character.get('media_type') and character.get('img_url')]
+    result = {'missing': len(missing), 'probed': 0, 'videos': 0}
+    semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PROBE_TIMEOUT)) as session:
+        async def probe_one(character):
+            async with semaphore:
+                return character, await probe(character['img_url'], character.get('name', ''), session)
+
+        for start in range(0, len(missing), BACKFILL_BATCH):
+            probed = await asyncio.gather(*(probe_one(character) for character in missing[start:start + BACKFILL_BATCH]))
+            await collection.bulk_write(
+                [UpdateOne({'id': character['id']}, {'$set': info}) for character, info in probed],
+                ordered=False
+            )
+            for character, info in probed:
+                catalog.update(character['id'], info)
+                result['videos'] += info['media_type'] == 'video'
+            result['probed'] += len(probed)
+            if progress:
+                await progress(result)
+
+    LOGGER.info(f"Media info backfill: {result}")
+    return result
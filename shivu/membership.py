@@ -0,0 +1,108 @@
+"""Cached answers to "is this user in the main group?" for /harem.
+
+Each check used to be a live get_chat_member call, on every /harem and every
+page flip. Answers are now kept for POSITIVE_TTL seconds (members) or the
+shorter NEGATIVE_TTL (non-members, so someone who just joined isn't locked
+out for long). Join and leave updates from the group refresh entries as they
+happen, and concurrent checks for the same user share one lookup. Failed
+lookups are not cached.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+from shivu import metrics
+
+POSITIVE_TTL = 600  # Seconds a confirmed member is trusted
+NEGATIVE_TTL = 60  # Seconds a non-member answer is trusted
+MAX_ENTRIES = 100000
+
+
+class MembershipCache:
+    def __init__(self, positive_ttl: float = POSITIVE_TTL, negative_ttl: float = NEGATIVE_TTL, max_entries: int = MAX_ENTRIES):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # {user_id: (is_member, expires_at)}, least recently used first
+        self._inflight = {}  # {user_id: Future} for lookups in progress
+        self.hits = 0
+        self.shared = 0  # checks that joined a lookup already in flight
+        self.lookups = 0
+        self.prewarmed = 0
+
+    def record(self, user_id: int, is_member: bool, now: float = None) -> None:
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        self.entries[user_id] = (is_member, (now or time.monotonic()) + ttl)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def observe(self, user_id: int, is_member: bool) -> None:
+        """A join or leave seen in the group's member updates"""
+        self.record(user_id, is_member)
+        self.prewarmed += 1
+
+    def cached(self, user_id: int, now: float = None):
+        """The cached answer, or None if there is none or it expired"""
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        if (now or time.monotonic()) >= entry[1]:
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return entry[0]
+
+    async def check(self, user_id: int, lookup) -> bool:
+        """Answer from the cache, or await ``lookup(user_id)`` once for all concurrent callers"""
+        is_member = self.cached(user_id)
+        if is_member is not None:
+            self.hits += 1
+            return is_member
+
+        future = self._inflight.get(user_id)
+        if future is not None:
+            self.shared += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                # The lookup we joined was cancelled with its caller; look it up again
+                return await self.check(user_id, lookup)
+
+        future = self._inflight[user_id] = asyncio.get_running_loop().create_future()
+        self.lookups += 1
+        try:
+            is_member = await lookup(user_id)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            self.record(user_id, is_member)
+            future.set_result(is_member)
+            return is_member
+        finally:
+            del self._inflight[user_id]
+            if not future.done():
+                # Cancelled (say, by a newer /harem click), so joined callers retry
+                future.cancel()
+
+    def stats(self) -> dict:
+        checks = self.hits + self.shared + self.lookups
+        return {
+            'entries': len(self.entries),
+            'checks': checks,
+            'hits': self.hits,
+            'shared_lookups': self.shared,
+            'lookups': self.lookups,
+            'saved_calls': self.hits + self.shared,
+            'hit_rate': (self.hits + self.shared) / checks if checks else 0.0,
+            'prewarmed': self.prewarmed,
+        }
+
+
+group_membership = MembershipCache()
+metrics.register('group_membership', group_membership.stats)
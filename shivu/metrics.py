@@ -0,0 +1,22 @@
+"""Registry of in-process counters reported by the /metrics command.
+
+Components register a callable returning a flat dict of numbers; nothing is
+computed until an admin asks for a snapshot.
+"""
+
+_providers = {}
+
+
+def register(name: str, provider) -> None:
+    _providers[name] = provider
+
+
+def snapshot() -> dict:
+    """Return {component: {counter: value}} for every registered provider"""
+    result = {}
+    for name, provider in _providers.items():
+        try:
+            result[name] = provider()
+        except Exception as e:
+            result[name] = {'error': str(e)}
+    return result
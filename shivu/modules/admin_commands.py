@@ -3,6 +3,11 @@ from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import math
 
 from shivu import collection, locked_spawns_collection, shivuu
+from shivu import metrics
+from shivu import ownership
+from shivu import media
+from shivu.catalog import catalog
+from shivu.indexes import index_manager
 from shivu.config import Config
 
 @shivuu.on_message(filters.command("lockspawn"))
@@ -54,6 +59,7 @@ async def lockspawn(client, message):
         'locked_by': sender_id,
         'locked_by_username': message.from_user.username or message.from_user.first_name
     })
+    catalog.lock(character_id)
     
     rarity_emojis = {
         "Common": "⚪️",
@@ -108,6 +114,7 @@ async def unlockspawn(client, message):
     
     # Unlock the character
     await locked_spawns_collection.delete_one({'character_id': character_id})
+    catalog.unlock(character_id)
     
     await message.reply_text(
         f"🔓 **Spawn Unlocked!**\n\n"
@@ -312,3 +319,183 @@ async def rarity(client, message):
   
     await message.reply_text(message_text, parse_mode=enums.ParseMode.MARKDOWN)
 
+
+@shivuu.on_message(filters.command("metrics"))
+async def show_metrics(client, message):
+    """Show the in-process counters of the bot's caches and queues (sudo users only)"""
+    sender_id = message.from_user.id
+    
+    # Check if user is admin
+    if str(sender_id) not in [str(u) for u in Config.sudo_users]:
+        await message.reply_text("🚫 This command is only available to administrators.")
+        return
+    
+    message_text = "📈 **Bot Metrics**\n"
+    for component, counters in metrics.snapshot().items():
+        message_text += f"\n**{component}**\n"
+        for name, value in counters.items():
+            if isinstance(value, float):
+                value = f"{value:.2f}"
+            message_text += f"• `{name}`: {value}\n"
+    
+    await message.reply_text(message_text, parse_mode=enums.ParseMode.MARKDOWN)
+
+
+@shivuu.on_message(filters.command("explain"))
+async def explain_queries(client, message):
+    """Show the query plan of every hot query and flag collection scans (sudo users only)"""
+    sender_id = message.from_user.id
+
+    # Check if user is admin
+    if str(sender_id) not in [str(u) for u in Config.sudo_users]:
+        await message.reply_text("🚫 This command is only available to administrators.")
+        return
+
+    status_msg = await message.reply_text("🔎 Explaining query plans...")
+
+    collscans = 0
+    message_text = "🔎 **Query Plans**\n\n"
+    for shape, plan in await index_manager.explain_all():
+        if isinstance(plan, str):
+            message_text += f"❓ **{shape.label}**: {plan}\n"
+            continue
+        collscans += plan['collscan']
+        mark = "⚠️" if plan['collscan'] else "✅"
+        message_text += f"{mark} **{shape.label}** (`{shape.collection.name}`): {' → '.join(plan['stages'])}"
+        if plan['index']:
+            message_text += f" via `{plan['index']}`"
+        if plan['in_memory_sort']:
+            message_text += " (sorted in memory)"
+        message_text += "\n"
+
+    message_text += f"\n**Collection scans:** {collscans}\n\n📇 **Indexes**\n"
+    for index, status in index_manager.status.items():
+        message_text += f"• `{index}`: `{status}`\n"
+
+    await status_msg.edit_text(message_text, parse_mode=enums.ParseMode.MARKDOWN)
+
+
+def _format_storage_report(report):
+    text = ""
+    for layout in ('users', 'ownership'):
+        sizes = report[layout]
+        text += (
+            f"**{layout}**: {sizes['documents']} docs, "
+            f"avg {sizes['avg'] / 1024:.1f} KB, max {sizes['max'] / 1024:.1f} KB, "
+            f"total {sizes['total'] / 1024 / 1024:.2f} MB\n"
+        )
+    if 'user_document_read_ms' in report:
+        text += (
+            f"Sample user `{report['sample_user_id']}`: "
+            f"user document {report['user_document_read_ms']:.2f} ms, "
+            f"ownership read {report['collection_read_ms']:.2f} ms\n"
+        )
+    return text
+
+@shivuu.on_message(filters.command("migrateownership"))
+async def migrate_ownership(client, message):
+    """Move embedded character lists into the ownership collection (sudo users only)"""
+    sender_id = message.from_user.id
+    
+    # Check if user is admin
+    if str(sender_id) not in [str(u) for u in Config.sudo_users]:
+        await message.reply_text("🚫 This command is only available to administrators.")
+        return
+    
+    status = await message.reply_text("⏳ Measuring storage before migration...")
+    before = await ownership.storage_report()
+    
+    async def progress(migrated):
+        try:
+            await status.edit_text(f"⏳ Migrating ownership... {migrated} users done")
+        except Exception:
+            pass
+    
+    result = await ownership.migrate_all(progress)
+    after = await ownership.storage_report(before['sample_user_id'])
+    
+    await status.edit_text(
+        f"{'✅ **Ownership Migrated!**' if result['completed'] else '⚠️ **Migration Incomplete** - run it again to resume'}\n\n"
+        f"👥 **Users migrated:** {result['migrated']}\n\n"
+        f"**Before**\n{_format_storage_report(before)}\n"
+        f"**After**\n{_format_storage_report(after)}",
+        parse_mode=enums.ParseMode.MARKDOWN
+    )
+
+@shivuu.on_message(filters.command("backfillfileids"))
+async def backfill_file_ids(client, message):
+    """Capture Telegram file_ids for characters that are still sent by URL (sudo users only)"""
+    sender_id = message.from_user.id
+    
+    # Check if user is admin
+    if str(sender_id) not in [str(u) for u in Config.sudo_users]:
+        await message.reply_text("🚫 This command is only available to administrators.")
+        return
+    
+    status = await message.reply_text("⏳ Capturing file_ids...")
+    
+    async def progress(result):
+        try:
+            await status.edit_text(
+                f"⏳ Capturing file_ids... {result['from_posts'] + result['uploaded']}/{result['missing']} done"
+            )
+        except Exception:
+            pass
+    
+    result = await media.backfill_file_ids(progress)
+    
+    await status.edit_text(
+        f"✅ **file_id Backfill Finished!**\n\n"
+        f"🎴 **Missing:** {result['missing']}\n"
+        f"📨 **From channel posts:** {result['from_posts']}\n"
+        f"📤 **Uploaded:** {result['uploaded']}\n"
+        f"❌ **Failed:** {result['failed']}",
+        parse_mode=enums.ParseMode.MARKDOWN
+    )
+
+@shivuu.on_message(filters.command("backfillmedia"))
+async def backfill_media(client, message):
+    """Probe media type, MIME type and normalized URL for characters uploaded before they were stored (sudo users only)"""
+    sender_id = message.from_user.id
+    
+    # Check if user is admin
+    if str(sender_id) not in [str(u) for u in Config.sudo_users]:
+        await message.reply_text("🚫 This command is only available to administrators.")
+        return
+    
+    status = await message.reply_text("⏳ Probing character media...")
+    
+    async def progress(result):
+        try:
+            await status.edit_text(f"⏳ Probing character media... {result['probed']}/{result['missing']} done")
+        except Exception:
+            pass
+    
+    result = await media.backfill_media_info(progress)
+    
+    await status.edit_text(
+        f"✅ **Media Info Backfill Finished!**\n\n"
+        f"🎴 **Probed:** {result['probed']}/{result['missing']}\n"
+        f"🎬 **Videos:** {result['videos']}",
+        parse_mode=enums.ParseMode.MARKDOWN
+    )
+
+@shivuu.on_message(filters.command("rebuildstats"))
+async def rebuild_stats(client, message):
+    """Recompute per-character owner counts and top owners from scratch (sudo users only)"""
+    sender_id = message.from_user.id
+    
+    # Check if user is admin
+    if str(sender_id) not in [str(u) for u in Config.sudo_users]:
+        await message.reply_text("🚫 This command is only available to administrators.")
+        return
+    
+    status = await message.reply_text("⏳ Rebuilding character stats...")
+    characters = await ownership.rebuild_stats()
+    
+    await status.edit_text(
+        f"✅ **Character Stats Rebuilt!**\n\n"
+        f"🎴 **Characters with owners:** {characters}"
+        + ("" if not ownership.stats()['legacy_reads'] else "\n\n⚠️ Run /migrateownership first; stats stay unused until it completes."),
+        parse_mode=enums.ParseMode.MARKDOWN
+    )
@@ -4,6 +4,31 @@ from shivu import user_totals_collection, shivuu, sudo_users
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
+DEFAULT_MESSAGE_FREQUENCY = 100
+
+# Spawn frequency of every chat that changed it, loaded once at startup and
+# written through by /changetime so message_counter never has to ask Mongo
+message_frequencies = {}
+
+
+async def load_message_frequencies() -> None:
+    """Load every custom spawn frequency into memory in one query"""
+    frequencies = {}
+    async for document in user_totals_collection.find(
+        {'message_frequency': {'$exists': True}},
+        {'chat_id': 1, 'message_frequency': 1}
+    ):
+        try:
+            frequencies[int(document['chat_id'])] = int(document['message_frequency'])
+        except (KeyError, TypeError, ValueError):
+            continue
+    message_frequencies.clear()
+    message_frequencies.update(frequencies)
+
+
+def get_message_frequency(chat_id: int) -> int:
+    return message_frequencies.get(chat_id, DEFAULT_MESSAGE_FREQUENCY)
+
 
 @shivuu.on_message(filters.command("changetime"))
 async def change_time(client: Client, message: Message):
@@ -35,6 +60,7 @@ async def change_time(client: Client, message: Message):
             upsert=True,
             return_document=ReturnDocument.AFTER
         )
+        message_frequencies[chat_id] = new_frequency
 
         await message.reply_text(f'Successfully changed {new_frequency}')
     except Exception as e:
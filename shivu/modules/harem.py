@@ -1,58 +1,59 @@
 from telegram import Update
 from itertools import groupby
-from collections import Counter, defaultdict
+from collections import defaultdict
 import math
 from html import escape 
 import random
 
-from telegram.ext import CommandHandler, CallbackContext, CallbackQueryHandler
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CommandHandler, CallbackContext, CallbackQueryHandler, ChatMemberHandler
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
 from pyrogram import filters, enums
 from pyrogram.types import InlineKeyboardButton as PyroInlineKeyboardButton, InlineKeyboardMarkup as PyroInlineKeyboardMarkup
 from pyrogram.errors import UserNotParticipant, ChatAdminRequired, PeerIdInvalid
 
 from shivu import collection, user_collection, application, SUPPORT_CHAT, CHARA_CHANNEL_ID, shivuu, sudo_users
+from shivu import ownership
+from shivu import media
+from shivu.catalog import catalog
+from shivu.anime_totals import anime_totals
+from shivu.harem_cache import harem_pages
+from shivu.membership import group_membership
+from shivu.latest_wins import harem_clicks
 
-def is_video_url(url):
-    """Check if a URL points to a video file"""
-    if not url:
-        return False
-    return any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv'])
-
-def is_video_character(character):
-    """Check if a character is a video by URL extension or name marker"""
-    if not character:
-        return False
-    
-    # Check URL extension
-    url = character.get('img_url', '')
-    if is_video_url(url):
-        return True
-    
-    # Check for 🎬 emoji marker in name
-    name = character.get('name', '')
-    if '🎬' in name:
-        return True
-    
-    return False
+HAREM_PAGE_SIZE = 15
 
 # Main group for membership checking
 MAIN_GROUP = "@CollectorOfficialGroup"
 
-async def check_group_membership(user_id: int) -> bool:
-    """Check if user is a member of the main group"""
+async def _lookup_group_membership(user_id: int) -> bool:
     try:
         member = await shivuu.get_chat_member(MAIN_GROUP, user_id)
         # Check if user is member, admin, or creator
         return member.status in [enums.ChatMemberStatus.MEMBER, enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER]
     except (UserNotParticipant, ChatAdminRequired, PeerIdInvalid):
         return False
+
+async def check_group_membership(user_id: int) -> bool:
+    """Check if user is a member of the main group"""
+    try:
+        return await group_membership.check(user_id, _lookup_group_membership)
     except Exception as e:
         # Fail-closed: deny access on any unexpected error
         from shivu import LOGGER
         LOGGER.error(f"Error checking group membership for user {user_id}: {e}")
         return False
 
+async def track_group_membership(update: Update, context: CallbackContext) -> None:
+    """Keep the membership cache current from the main group's join and leave updates"""
+    member_update = update.chat_member
+    if not member_update or (member_update.chat.username or '').lower() != MAIN_GROUP.lstrip('@').lower():
+        return
+    new_member = member_update.new_chat_member
+    group_membership.observe(
+        new_member.user.id,
+        new_member.status in [ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER]
+    )
+
 async def sorts(update: Update, context: CallbackContext) -> None:
     """Set harem filtering and sorting preferences"""
     if not update.effective_user or not update.message:
@@ -88,6 +89,7 @@ async def sorts(update: Update, context: CallbackContext) -> None:
             {'$unset': {'sort_preference': '', 'filter_type': '', 'filter_value': ''}}, 
             upsert=True
         )
+        harem_pages.bump(user_id)
         await update.message.reply_text(
             "✅ Harem filters and sorting have been reset!\n\n"
             "Your /harem will now show all characters sorted by anime. 📋",
@@ -125,6 +127,7 @@ async def sorts(update: Update, context: CallbackContext) -> None:
             {'$set': {'filter_type': 'rarity', 'filter_value': rarity_filter, 'sort_preference': 'rarity'}}, 
             upsert=True
         )
+        harem_pages.bump(user_id)
         
         await update.message.reply_text(
             f"✅ Harem filter set to <b>{rarity_filter}</b> rarity only!\n\n"
@@ -144,13 +147,13 @@ async def sorts(update: Update, context: CallbackContext) -> None:
         character_filter = ' '.join(args[1:]).title()
         
         # Check if user has this character
-        user = await user_collection.find_one({'id': user_id})
-        if not user or not user.get('characters'):
+        owned = await ownership.owned_characters(user_id)
+        if not owned:
             await update.message.reply_text("❌ You don't have any characters yet!")
             return
         
         # Check if character exists in user's collection (partial match)
-        character_exists = any(character_filter.lower() in char['name'].lower() for char in user['characters'])
+        character_exists = any(character_filter.lower() in char['name'].lower() for char, _ in owned)
         if not character_exists:
             await update.message.reply_text(
                 f"❌ You don't have any characters named '{character_filter}' in your collection!",
@@ -164,6 +167,7 @@ async def sorts(update: Update, context: CallbackContext) -> None:
             {'$set': {'filter_type': 'character', 'filter_value': character_filter, 'sort_preference': 'name'}}, 
             upsert=True
         )
+        harem_pages.bump(user_id)
         
         await update.message.reply_text(
             f"✅ Harem filter set to <b>{character_filter}</b> character only!\n\n"
@@ -178,6 +182,7 @@ async def sorts(update: Update, context: CallbackContext) -> None:
             {'$set': {'sort_preference': sort_type}, '$unset': {'filter_type': '', 'filter_value': ''}}, 
             upsert=True
         )
+        harem_pages.bump(user_id)
         
         await update.message.reply_text(
             f"✅ Harem sorting set to <b>{sort_type}</b>!\n\n"
@@ -199,80 +204,26 @@ async def sorts(update: Update, context: CallbackContext) -> None:
         return
 
 
-async def harem(update: Update, context: CallbackContext, page=0) -> None:
-    if not update.effective_user:
-        return
-        
-    user_id = update.effective_user.id
-
-    # Check if user is a member of the main group
-    if not await check_group_membership(user_id):
-        message_text = (
-            "🚫 <b>Access Restricted</b>\n\n"
-            f"To use the /harem command, you must join our main group:\n"
-            f"👥 {MAIN_GROUP}\n\n"
-            f"Once you've joined, you'll be able to access your harem!"
-        )
-        if update.message:
-            await update.message.reply_text(message_text, parse_mode='HTML')
-        elif update.callback_query:
-            await update.callback_query.edit_message_text(message_text, parse_mode='HTML')
-        return
-
-    user = await user_collection.find_one({'id': user_id})
-    if not user:
-        if update.message:
-            await update.message.reply_text('You Have Not Guessed any Characters Yet..')
-        elif update.callback_query:
-            await update.callback_query.edit_message_text('You Have Not Guessed any Characters Yet..')
-        return
-
+async def _render_harem_page(user_id: int, user_name: str, prefs: dict, page: int):
+    """Build the text, keyboard and picture of one harem page, or None if the harem is empty"""
     # Get user's filter and sort preferences
-    filter_type = user.get('filter_type')
-    filter_value = user.get('filter_value')
-    sort_preference = user.get('sort_preference', 'anime')  # Default to anime (current behavior)
-    
-    # Apply filters first
-    characters = user['characters']
-    if filter_type == 'rarity' and filter_value:
-        characters = [char for char in characters if char.get('rarity') == filter_value]
-    elif filter_type == 'character' and filter_value:
-        characters = [char for char in characters if filter_value.lower() in char['name'].lower()]
-    
-    # Then apply sorting
-    if sort_preference == 'rarity':
-        # Sort by rarity (rarest first) then by name
-        rarity_order = ["Limited Edition", "Zenith", "Retro", "Mythic", "Legendary", "Epic", "Rare", "Uncommon", "Common"]
-        characters = sorted(characters, key=lambda x: (rarity_order.index(x.get('rarity', 'Common')), x['name']))
-    elif sort_preference == 'name':
-        # Sort by character name alphabetically
-        characters = sorted(characters, key=lambda x: x['name'])
-    elif sort_preference == 'limited_time':
-        # Sort by limited time cards first, then by rarity, then by name
-        rarity_order = ["Limited Edition", "Zenith", "Retro", "Mythic", "Legendary", "Epic", "Rare", "Uncommon", "Common"]
-        characters = sorted(characters, key=lambda x: (
-            0 if x.get('rarity') == 'Limited Edition' else 1,  # Limited Edition first
-            rarity_order.index(x.get('rarity', 'Common')),
-            x['name']
-        ))
-    else:
-        # Default: sort by anime then ID (existing behavior)
-        characters = sorted(characters, key=lambda x: (x['anime'], x['id']))
-
-    # Use Counter to properly count character occurrences regardless of sort order
-    character_counts = Counter(character['id'] for character in user['characters'])
-
-    
-    unique_characters = list({character['id']: character for character in characters}.values())
-
-    
-    total_pages = math.ceil(len(unique_characters) / 15)  
+    filter_type = prefs.get('filter_type')
+    filter_value = prefs.get('filter_value')
+    sort_preference = prefs.get('sort_preference') or 'anime'  # Default to anime (current behavior)
+    fav_character_id = prefs['favorites'][0] if prefs.get('favorites') else None
+
+    # Owned counts are joined to the in-memory catalog, then filtered, sorted and sliced
+    result = await ownership.harem_page(
+        user_id, page, HAREM_PAGE_SIZE, sort_preference, filter_type, filter_value, fav_character_id
+    )
+    if not result['unique']:
+        return None
+    page = result['page']
+    current_characters = [character for character, _ in result['entries']]
+    character_counts = {character['id']: copies for character, copies in result['entries']}
 
-    if page < 0 or page >= total_pages:
-        page = 0  
+    total_pages = math.ceil(result['matching'] / HAREM_PAGE_SIZE)
 
-    user_name = update.effective_user.first_name or "User"
-    
     # Build harem title with filter info
     title = f"{escape(user_name)}'s Harem"
     if filter_type == 'rarity' and filter_value:
@@ -283,8 +234,6 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
     
     harem_message = f"<b>{title}</b>\n"
 
-    
-    current_characters = unique_characters[page*15:(page+1)*15]
 
     # Group characters by anime properly regardless of sort order
     current_grouped_characters = defaultdict(list)
@@ -292,8 +241,8 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
         current_grouped_characters[character['anime']].append(character)
 
     for anime, characters in current_grouped_characters.items():
-        # Get total count of anime characters in database
-        anime_total = await collection.count_documents({"anime": anime})
+        # Total characters of the anime in the catalog, kept in memory
+        anime_total = anime_totals.total(anime)
         
         # Stylish anime header with count
         harem_message += f'\n✢ {anime} 「 {len(characters)}/{anime_total} 」\n'
@@ -322,7 +271,7 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
         harem_message += '⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋⚋\n'
 
 
-    total_count = len(user['characters'])
+    total_count = result['copies']
     
     keyboard = [
         [InlineKeyboardButton(f"See Collection ({total_count})", switch_inline_query_current_chat=f"collection.{user_id}")],
@@ -341,174 +290,151 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    if 'favorites' in user and user['favorites']:
-        
-        fav_character_id = user['favorites'][0]
-        fav_character = next((c for c in user['characters'] if c['id'] == fav_character_id), None)
-
-        if fav_character and 'img_url' in fav_character:
-            if update.message:
-                try:
-                    from shivu import process_image_url, LOGGER
-                    processed_url = await process_image_url(fav_character['img_url'])
-                    
-                    # Check if it's a video and use appropriate send method
-                    if is_video_character(fav_character):
-                        try:
-                            await update.message.reply_video(video=processed_url, parse_mode='HTML', caption=harem_message, reply_markup=reply_markup)
-                        except Exception as video_error:
-                            # Fallback: try as photo if video fails
-                            LOGGER.warning(f"Harem: Favorite video send failed, URL: {processed_url[:100]}, Error: {str(video_error)}. Trying as photo.")
-                            try:
-                                await update.message.reply_photo(photo=processed_url, parse_mode='HTML', caption=f"🎬 [Video] {harem_message}", reply_markup=reply_markup)
-                            except Exception as photo_error:
-                                # If media fails, send text instead
-                                LOGGER.error(f"Harem: Both favorite video and photo failed, URL: {processed_url[:100]}")
-                                await update.message.reply_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
-                    else:
-                        await update.message.reply_photo(photo=processed_url, parse_mode='HTML', caption=harem_message, reply_markup=reply_markup)
-                except Exception as e:
-                    # If media fails, send text instead
-                    await update.message.reply_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
-            else:
-                # For callback queries, update image and caption using media edit
-                try:
-                    from shivu import process_image_url, LOGGER
-                    from telegram import InputMediaPhoto, InputMediaVideo
-                    processed_url = await process_image_url(fav_character['img_url'])
-                    
-                    # Check if it's a video and use appropriate media type
-                    if is_video_character(fav_character):
-                        try:
-                            media = InputMediaVideo(media=processed_url, caption=harem_message, parse_mode='HTML')
-                            await update.callback_query.edit_message_media(media=media, reply_markup=reply_markup)
-                            await update.callback_query.answer()
-                        except Exception as video_error:
-                            # Fallback: try as photo if video fails
-                            LOGGER.warning(f"Harem callback: Favorite video edit failed, URL: {processed_url[:100]}, Error: {str(video_error)}. Trying as photo.")
-                            try:
-                                media = InputMediaPhoto(media=processed_url, caption=f"🎬 [Video] {harem_message}", parse_mode='HTML')
-                                await update.callback_query.edit_message_media(media=media, reply_markup=reply_markup)
-                                await update.callback_query.answer()
-                            except Exception as photo_error:
-                                # Fallback to just editing caption if media edit fails
-                                LOGGER.error(f"Harem callback: Both favorite video and photo edit failed, URL: {processed_url[:100]}")
-                                try:
-                                    if update.callback_query and update.callback_query.message and update.callback_query.message.caption != harem_message:
-                                        await update.callback_query.edit_message_caption(caption=harem_message, reply_markup=reply_markup, parse_mode='HTML')
-                                    if update.callback_query:
-                                        await update.callback_query.answer()
-                                except Exception:
-                                    if update.callback_query:
-                                        await update.callback_query.answer("Failed to update media")
-                    else:
-                        media = InputMediaPhoto(media=processed_url, caption=harem_message, parse_mode='HTML')
-                        await update.callback_query.edit_message_media(media=media, reply_markup=reply_markup)
-                        await update.callback_query.answer()
-                except Exception:
-                    # Fallback to just editing caption if media edit fails
-                    try:
-                        if update.callback_query and update.callback_query.message and update.callback_query.message.caption != harem_message:
-                            await update.callback_query.edit_message_caption(caption=harem_message, reply_markup=reply_markup, parse_mode='HTML')
-                        if update.callback_query:
-                            await update.callback_query.answer()
-                    except Exception:
-                        if update.callback_query:
-                            await update.callback_query.answer("Failed to update media")
-        else:
-            if update.message:
-                await update.message.reply_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
-            else:
-                
-                if update.callback_query and update.callback_query.message and update.callback_query.message.text != harem_message:
-                    await update.callback_query.edit_message_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
+    # The favorite if it is still owned, otherwise a random character of this page
+    if fav_character_id:
+        media_character = catalog.get(fav_character_id) if result['favorite_owned'] else None
+        media_label = "Favorite"
     else:
-        
-        if user['characters']:
-        
-            random_character = random.choice(user['characters'])
+        media_character = random.choice(current_characters) if current_characters else None
+        media_label = "Random"
+    if media_character and 'img_url' not in media_character:
+        media_character = None
+
+    return harem_message, reply_markup, media_character, media_label
+
 
-            if 'img_url' in random_character:
-                if update.message:
+async def _send_harem_page(update: Update, harem_message, reply_markup, media_character, media_label) -> None:
+    if media_character:
+        if update.message:
+            try:
+                from shivu import LOGGER
+                processed_url = await media.media_source(media_character)
+                
+                # Check if it's a video and use appropriate send method
+                if media.is_video(media_character):
                     try:
-                        from shivu import process_image_url, LOGGER
-                        processed_url = await process_image_url(random_character['img_url'])
-                        
-                        # Check if it's a video and use appropriate send method
-                        if is_video_character(random_character):
-                            try:
-                                await update.message.reply_video(video=processed_url, parse_mode='HTML', caption=harem_message, reply_markup=reply_markup)
-                            except Exception as video_error:
-                                # Fallback: try as photo if video fails
-                                LOGGER.warning(f"Harem: Random video send failed, URL: {processed_url[:100]}, Error: {str(video_error)}. Trying as photo.")
-                                try:
-                                    await update.message.reply_photo(photo=processed_url, parse_mode='HTML', caption=f"🎬 [Video] {harem_message}", reply_markup=reply_markup)
-                                except Exception as photo_error:
-                                    # If media fails, send text instead
-                                    LOGGER.error(f"Harem: Both random video and photo failed, URL: {processed_url[:100]}")
-                                    await update.message.reply_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
-                        else:
-                            await update.message.reply_photo(photo=processed_url, parse_mode='HTML', caption=harem_message, reply_markup=reply_markup)
-                    except Exception as e:
-                        # If media fails, send text instead
-                        await update.message.reply_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
+                        await update.message.reply_video(video=processed_url, parse_mode='HTML', caption=harem_message, reply_markup=reply_markup)
+                    except Exception as video_error:
+                        # Fallback: try as photo if video fails
+                        LOGGER.warning(f"Harem: {media_label} video send failed, URL: {processed_url[:100]}, Error: {str(video_error)}. Trying as photo.")
+                        try:
+                            await update.message.reply_photo(photo=processed_url, parse_mode='HTML', caption=f"🎬 [Video] {harem_message}", reply_markup=reply_markup)
+                        except Exception as photo_error:
+                            # If media fails, send text instead
+                            LOGGER.error(f"Harem: Both {media_label.lower()} video and photo failed, URL: {processed_url[:100]}")
+                            await update.message.reply_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
                 else:
-                    # For callback queries, update image and caption using media edit
+                    await update.message.reply_photo(photo=processed_url, parse_mode='HTML', caption=harem_message, reply_markup=reply_markup)
+            except Exception as e:
+                # If media fails, send text instead
+                await update.message.reply_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
+        else:
+            # For callback queries, update image and caption using media edit
+            try:
+                from shivu import LOGGER
+                from telegram import InputMediaPhoto, InputMediaVideo
+                processed_url = await media.media_source(media_character)
+                
+                # Check if it's a video and use appropriate media type
+                if media.is_video(media_character):
                     try:
-                        from shivu import process_image_url, LOGGER
-                        from telegram import InputMediaPhoto, InputMediaVideo
-                        processed_url = await process_image_url(random_character['img_url'])
-                        
-                        # Check if it's a video and use appropriate media type
-                        if is_video_character(random_character):
+                        input_media = InputMediaVideo(media=processed_url, caption=harem_message, parse_mode='HTML')
+                        await update.callback_query.edit_message_media(media=input_media, reply_markup=reply_markup)
+                        await update.callback_query.answer()
+                    except Exception as video_error:
+                        # Fallback: try as photo if video fails
+                        LOGGER.warning(f"Harem callback: {media_label} video edit failed, URL: {processed_url[:100]}, Error: {str(video_error)}. Trying as photo.")
+                        try:
+                            input_media = InputMediaPhoto(media=processed_url, caption=f"🎬 [Video] {harem_message}", parse_mode='HTML')
+                            await update.callback_query.edit_message_media(media=input_media, reply_markup=reply_markup)
+                            await update.callback_query.answer()
+                        except Exception as photo_error:
+                            # Fallback to just editing caption if media edit fails
+                            LOGGER.error(f"Harem callback: Both {media_label.lower()} video and photo edit failed, URL: {processed_url[:100]}")
                             try:
-                                media = InputMediaVideo(media=processed_url, caption=harem_message, parse_mode='HTML')
-                                await update.callback_query.edit_message_media(media=media, reply_markup=reply_markup)
-                                await update.callback_query.answer()
-                            except Exception as video_error:
-                                # Fallback: try as photo if video fails
-                                LOGGER.warning(f"Harem callback: Random video edit failed, URL: {processed_url[:100]}, Error: {str(video_error)}. Trying as photo.")
-                                try:
-                                    media = InputMediaPhoto(media=processed_url, caption=f"🎬 [Video] {harem_message}", parse_mode='HTML')
-                                    await update.callback_query.edit_message_media(media=media, reply_markup=reply_markup)
+                                if update.callback_query and update.callback_query.message and update.callback_query.message.caption != harem_message:
+                                    await update.callback_query.edit_message_caption(caption=harem_message, reply_markup=reply_markup, parse_mode='HTML')
+                                if update.callback_query:
                                     await update.callback_query.answer()
-                                except Exception as photo_error:
-                                    # Fallback to just editing caption if media edit fails
-                                    LOGGER.error(f"Harem callback: Both random video and photo edit failed, URL: {processed_url[:100]}")
-                                    try:
-                                        if update.callback_query and update.callback_query.message and update.callback_query.message.caption != harem_message:
-                                            await update.callback_query.edit_message_caption(caption=harem_message, reply_markup=reply_markup, parse_mode='HTML')
-                                        if update.callback_query:
-                                            await update.callback_query.answer()
-                                    except Exception:
-                                        if update.callback_query:
-                                            await update.callback_query.answer("Failed to update media")
-                        else:
-                            media = InputMediaPhoto(media=processed_url, caption=harem_message, parse_mode='HTML')
-                            await update.callback_query.edit_message_media(media=media, reply_markup=reply_markup)
-                            await update.callback_query.answer()
-                    except Exception:
-                        # Fallback to just editing caption if media edit fails
-                        try:
-                            if update.callback_query and update.callback_query.message and update.callback_query.message.caption != harem_message:
-                                await update.callback_query.edit_message_caption(caption=harem_message, reply_markup=reply_markup, parse_mode='HTML')
-                            if update.callback_query:
-                                await update.callback_query.answer()
-                        except Exception:
-                            if update.callback_query:
-                                await update.callback_query.answer("Failed to update media")
-            else:
-                if update.message:
-                    await update.message.reply_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
+                            except Exception:
+                                if update.callback_query:
+                                    await update.callback_query.answer("Failed to update media")
                 else:
-                
-                    if update.callback_query and update.callback_query.message and update.callback_query.message.text != harem_message:
-                        await update.callback_query.edit_message_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
+                    input_media = InputMediaPhoto(media=processed_url, caption=harem_message, parse_mode='HTML')
+                    await update.callback_query.edit_message_media(media=input_media, reply_markup=reply_markup)
+                    await update.callback_query.answer()
+            except Exception:
+                # Fallback to just editing caption if media edit fails
+                try:
+                    if update.callback_query and update.callback_query.message and update.callback_query.message.caption != harem_message:
+                        await update.callback_query.edit_message_caption(caption=harem_message, reply_markup=reply_markup, parse_mode='HTML')
                     if update.callback_query:
                         await update.callback_query.answer()
+                except Exception:
+                    if update.callback_query:
+                        await update.callback_query.answer("Failed to update media")
+    else:
+        if update.message:
+            await update.message.reply_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
         else:
+        
+            if update.callback_query and update.callback_query.message and update.callback_query.message.text != harem_message:
+                await update.callback_query.edit_message_text(harem_message, parse_mode='HTML', reply_markup=reply_markup)
+            if update.callback_query:
+                await update.callback_query.answer()
+
+
+async def harem(update: Update, context: CallbackContext, page=0) -> None:
+    if not update.effective_user:
+        return
+        
+    user_id = update.effective_user.id
+
+    # Check if user is a member of the main group
+    if not await check_group_membership(user_id):
+        message_text = (
+            "🚫 <b>Access Restricted</b>\n\n"
+            f"To use the /harem command, you must join our main group:\n"
+            f"👥 {MAIN_GROUP}\n\n"
+            f"Once you've joined, you'll be able to access your harem!"
+        )
+        if update.message:
+            await update.message.reply_text(message_text, parse_mode='HTML')
+        elif update.callback_query:
+            await update.callback_query.edit_message_text(message_text, parse_mode='HTML')
+        return
+
+    # Versions are read first, so a write racing with this render can't leave a stale page behind
+    version = harem_pages.version(user_id)
+    prefs = harem_pages.get_prefs(user_id, version)
+    if prefs is None:
+        # Preferences only; the characters come from the ownership collection joined with the catalog
+        user = await user_collection.find_one(
+            {'id': user_id},
+            {'filter_type': 1, 'filter_value': 1, 'sort_preference': 1, 'favorites': 1}
+        )
+        if not user:
+            if update.message:
+                await update.message.reply_text('You Have Not Guessed any Characters Yet..')
+            elif update.callback_query:
+                await update.callback_query.edit_message_text('You Have Not Guessed any Characters Yet..')
+            return
+        prefs = harem_pages.put_prefs(user_id, version, user)
+
+    user_name = update.effective_user.first_name or "User"
+
+    # A page flip on an unchanged harem is a cache lookup and one Telegram edit
+    key = harem_pages.key(user_id, version, prefs, user_name, page)
+    rendered = harem_pages.get(key)
+    if rendered is None:
+        rendered = await _render_harem_page(user_id, user_name, prefs, page)
+        if rendered is None:
             if update.message:
                 await update.message.reply_text("Your List is Empty :)")
+            return
+        harem_pages.put(key, rendered)
+
+    await _send_harem_page(update, *rendered)
 
 
 async def harem_callback(update: Update, context: CallbackContext) -> None:
@@ -534,8 +460,8 @@ async def harem_callback(update: Update, context: CallbackContext) -> None:
         await query.answer("its Not Your Harem", show_alert=True)
         return
 
-    
-    await harem(update, context, page)
+    # Taps faster than pages render only show the last one; dropped taps still stop their spinner
+    await harem_clicks.run(user_id, lambda: harem(update, context, page), superseded=query.answer)
 
 
 
@@ -559,14 +485,8 @@ async def fav(client, message):
     
     character_id = message.command[1]
     
-    # Get user's collection
-    user = await user_collection.find_one({'id': user_id})
-    if not user or not user.get('characters'):
-        await message.reply_text("❌ You don't have any characters yet!")
-        return
-    
-    # Find the character
-    character = next((c for c in user['characters'] if c['id'] == character_id), None)
+    # Find the character in the user's collection
+    character = catalog.get(character_id) if await ownership.count(user_id, character_id) else None
     if not character:
         await message.reply_text(f"❌ You don't have character ID `{character_id}` in your collection!", parse_mode=enums.ParseMode.MARKDOWN)
         return
@@ -603,11 +523,11 @@ async def fav(client, message):
     
     try:
         if 'img_url' in character:
-            from shivu import process_image_url, LOGGER
-            processed_url = await process_image_url(character['img_url'])
+            from shivu import LOGGER
+            processed_url = await media.media_source(character)
             
             # Check if it's a video and use appropriate send method
-            if is_video_character(character):
+            if media.is_video(character):
                 try:
                     await message.reply_video(
                         video=processed_url,
@@ -659,6 +579,7 @@ async def fav_callback(client, callback_query):
             {'$set': {'favorites': [character['id']]}},
             upsert=True
         )
+        harem_pages.bump(user_id)
         
         await callback_query.edit_message_caption(
             caption=f"💕 <b>Favorite Set!</b>\n\n🎴 <b>{escape(character['name'])}\n</b>📺 <b>{escape(character['anime'])}\n</b>✨ This character is now your favorite!",
@@ -713,45 +634,31 @@ async def transfer_harem(update: Update, context: CallbackContext) -> None:
         return
     
     # Find the old user's collection
-    old_user = await user_collection.find_one({'id': old_user_id})
-    if not old_user or not old_user.get('characters'):
+    old_user = await user_collection.find_one({'id': old_user_id}, {'username': 1, 'first_name': 1})
+    if not old_user or not await ownership.counts(old_user_id):
         await update.message.reply_text(f"❌ User {old_user_id} has no characters to transfer!")
         return
     
-    # Get character count for confirmation message
-    character_count = len(old_user['characters'])
     old_username = old_user.get('username', 'Unknown')
     old_first_name = old_user.get('first_name', 'Unknown')
     
-    # Check if new user exists, if not create their document
-    new_user = await user_collection.find_one({'id': new_user_id})
-    characters_to_transfer = old_user['characters']  # All characters will be transferred
-    
-    if not new_user:
-        # Create new user document
-        await user_collection.insert_one({
-            'id': new_user_id,
-            'first_name': 'Unknown',
-            'username': 'Unknown',
-            'characters': characters_to_transfer
-        })
-    else:
-        # Add all characters to existing user, preserving duplicates
-        existing_characters = new_user.get('characters', [])
-        all_characters = existing_characters + characters_to_transfer
-        await user_collection.update_one(
-            {'id': new_user_id},
-            {'$set': {'characters': all_characters}}
-        )
+    # Create the new user's document if needed
+    await user_collection.update_one(
+        {'id': new_user_id},
+        {'$setOnInsert': {'first_name': 'Unknown', 'username': 'Unknown', 'ownership_migrated': True}},
+        upsert=True
+    )
     
-    # Clear the old user's characters and favorites to maintain consistency
+    # Move all characters, preserving duplicates, then clear the old user's favorites
+    character_count = await ownership.move_all(old_user_id, new_user_id)
     await user_collection.update_one(
         {'id': old_user_id},
-        {'$set': {'characters': []}, '$unset': {'favorites': 1}}
+        {'$unset': {'favorites': 1}}
     )
+    harem_pages.bump(old_user_id)
     
     # Success message
-    new_user_info = await user_collection.find_one({'id': new_user_id})
+    new_user_info = await user_collection.find_one({'id': new_user_id}, {'username': 1, 'first_name': 1})
     new_username = new_user_info.get('username', 'Unknown') if new_user_info else 'Unknown'
     new_first_name = new_user_info.get('first_name', 'Unknown') if new_user_info else 'Unknown'
     
@@ -769,4 +676,5 @@ application.add_handler(CommandHandler("sorts", sorts, block=False))
 application.add_handler(CommandHandler("transfer", transfer_harem, block=False))
 harem_handler = CallbackQueryHandler(harem_callback, pattern='^harem', block=False)
 application.add_handler(harem_handler)
+application.add_handler(ChatMemberHandler(track_group_membership, ChatMemberHandler.CHAT_MEMBER, block=False))
     
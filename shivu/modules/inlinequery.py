@@ -1,37 +1,15 @@
-import re
-import time
-from html import escape
-from cachetools import TTLCache
-from pymongo import MongoClient, ASCENDING
-
-from telegram import Update, InlineQueryResultPhoto, InlineQueryResultVideo
-from telegram.ext import InlineQueryHandler, CallbackContext, CommandHandler 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-
-from shivu import user_collection, collection, application, db, LOGGER
-
-def is_video_url(url):
-    """Check if a URL points to a video file"""
-    if not url:
-        return False
-    return any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv'])
-
-def is_video_character(character):
-    """Check if a character is a video by URL extension or name marker"""
-    if not character:
-        return False
-    
-    # Check URL extension
-    url = character.get('img_url', '')
-    if is_video_url(url):
-        return True
-    
-    # Check for 🎬 emoji marker in name
-    name = character.get('name', '')
-    if '🎬' in name:
-        return True
-    
-    return False
+from telegram import Update, InlineQueryResultPhoto, InlineQueryResultVideo, InlineQueryResultCachedPhoto, InlineQueryResultCachedVideo
+from telegram.ext import InlineQueryHandler, CallbackContext
+
+from shivu import application, LOGGER
+from shivu import ownership
+from shivu import media
+from shivu.catalog import catalog
+from shivu.search_index import search_index
+from shivu.inline_results import inline_results
+from shivu.harem_cache import harem_pages
+from shivu.popular_feed import popular_feed
+from shivu.latest_wins import inline_queries, SHORT_QUERY_LENGTH, SHORT_QUERY_DEBOUNCE
 
 # Rarity emojis configuration (updated to match latest rarities)
 rarity_emojis = {
@@ -47,206 +25,201 @@ rarity_emojis = {
 }
 
 
-# Database indexes will be created automatically by MongoDB when needed
-# Removed manual index creation to avoid async/await issues
+# Database indexes are declared in shivu/indexes.py and created in the background at startup
+
+PAGE_SIZE = 50
+PUBLIC_CACHE_TIME = 300  # Global searches are the same for everyone, Telegram may reuse them for 5 minutes
+PERSONAL_CACHE_TIME = 10  # collection.<id> answers are per user and should show new catches quickly
+
+
+def _caption(character: dict) -> str:
+    # Get rarity emoji for consistent display
+    rarity_emoji = rarity_emojis.get(character.get('rarity', 'Common'), "✨")
+
+    return (
+        f"OwO! Check out this waifu!\n\n"
+        f"{character['anime']}\n"
+        f"{character['id']}: {character['name']} \n"
+        f"({rarity_emoji}𝙍𝘼𝙍𝙄𝙏𝙔:  {character.get('rarity', 'Unknown').lower()})"
+    )
+
+
+async def _build_result(character: dict, caption: str):
+    """The inline result for a character; its id is the character id, so it is the same in every answer"""
+    # Media the bot has sent before is answered by file_id, so Telegram doesn't fetch the URL
+    if character.get('file_id'):
+        if character.get('file_type') == 'video':
+            return InlineQueryResultCachedVideo(
+                id=character['id'],
+                video_file_id=character['file_id'],
+                title=f"{character['name']} - {character['anime']}",
+                caption=caption
+            )
+        return InlineQueryResultCachedPhoto(
+            id=character['id'],
+            photo_file_id=character['file_id'],
+            caption=caption
+        )
+
+    # Normalized URL and media facts were resolved when the image was set
+    processed_url = await media.media_source(character)
+
+    # Check if it's a video and use appropriate result type
+    if media.is_video(character):
+        mime_type = media.mime_type(character)
+
+        try:
+            # Use a placeholder thumbnail (must be JPEG for Telegram API)
+            placeholder_thumbnail = 'https://via.placeholder.com/320x180.jpg'
+
+            return InlineQueryResultVideo(
+                id=character['id'],
+                video_url=processed_url,
+                mime_type=mime_type,
+                thumbnail_url=placeholder_thumbnail,
+                title=f"{character['name']} - {character['anime']}",
+                caption=caption
+            )
+        except Exception as video_error:
+            # Fallback: treat as photo if video format is rejected
+            LOGGER.warning(f"Video inline result failed for character {character['id']} ({character['name']}), URL: {processed_url[:100]}, Error: {str(video_error)}. Falling back to photo.")
+            return InlineQueryResultPhoto(
+                thumbnail_url=processed_url,
+                id=character['id'],
+                photo_url=processed_url,
+                caption=f"🎬 [Video] {caption}"
+            )
+
+    return InlineQueryResultPhoto(
+        thumbnail_url=processed_url,
+        id=character['id'],
+        photo_url=processed_url,
+        caption=caption
+    )
+
+
+async def _collection_ids(query: str) -> list:
+    """Ranked ids for "collection.user_id optional_search_terms" """
+    # Parse the query: "collection.user_id optional_search_terms"
+    parts = query.split(' ', 1)  # Split into max 2 parts
+    collection_part = parts[0]  # "collection.user_id"
+    search_terms = parts[1].strip() if len(parts) > 1 else ""  # Optional search terms
+
+    # Extract user_id from "collection.user_id"
+    user_id = collection_part.split('.', 1)[1]
+    if not user_id.isdigit():
+        LOGGER.info(f"Invalid user ID format: {user_id}")
+        return []
+    user_id_int = int(user_id)
+
+    # The harem version is read first, so a list built during a catalog write is filed under the old one
+    key = ('collection', user_id_int, harem_pages.version(user_id_int), search_terms.lower())
+    ids = inline_results.get_ids(key)
+    if ids is not None:
+        return ids
+
+    # One entry per character, however many copies are owned
+    owned = await ownership.owned_characters(user_id_int)
+    ids = [character['id'] for character, _copies in owned]
+
+    # Apply search filter if provided, ranked like the general search
+    if search_terms and ids:
+        owned_ids = set(ids)
+        ids = [character_id for character_id in search_index.search(search_terms) if character_id in owned_ids]
+
+    LOGGER.info(f"Found {len(ids)} characters for user {user_id}")
+    inline_results.put_ids(key, ids)
+    return ids
+
+
+async def _search_ids(query: str) -> list:
+    await catalog.ensure_loaded()
+    if query:
+        # Ranked ids from the in-memory index over names and anime
+        key = ('search', inline_results.generation, query.lower())
+        ids = inline_results.get_ids(key)
+        if ids is None:
+            ids = search_index.search(query)
+            inline_results.put_ids(key, ids)
+        return ids
+
+    # Empty query - show popular characters with a rotating random slice, ranked in the background
+    return popular_feed.ids()
+
+
+def _parse_offset(offset: str) -> tuple:
+    """(continuation token or None, position) from an inline query offset"""
+    if not offset:
+        return None, 0
+    token, _, position = offset.rpartition(':')
+    if not position.isdigit():
+        return None, 0
+    # Plain numbers are offsets of answers sent before continuation tokens
+    return token or None, int(position)
 
-all_characters_cache = TTLCache(maxsize=10000, ttl=36000)
-user_collection_cache = TTLCache(maxsize=10000, ttl=60)
 
 async def inlinequery(update: Update, context: CallbackContext) -> None:
     if not update.inline_query:
         return
-        
+
+    # A newer keystroke or scroll from the same user cancels this one; short queries wait for the next keystroke
     query = update.inline_query.query.strip()
-    offset = int(update.inline_query.offset) if update.inline_query.offset else 0
+    short = 0 < len(query) <= SHORT_QUERY_LENGTH and not update.inline_query.offset
+    await inline_queries.run(
+        update.inline_query.from_user.id,
+        lambda: _answer_inline_query(update, query),
+        debounce=SHORT_QUERY_DEBOUNCE if short else 0.0
+    )
+
+
+async def _answer_inline_query(update: Update, query: str) -> None:
+    token, offset = _parse_offset(update.inline_query.offset)
     
     # Debug logging to help troubleshoot
     LOGGER.info(f"Inline query received: '{query}', offset: {offset}")
 
-    if query.startswith('collection.'):
-        # Handle user collection queries
-        user = None  # Initialize to prevent NameError
-        all_characters = []
-        
-        try:
-            # Parse the query: "collection.user_id optional_search_terms"
-            parts = query.split(' ', 1)  # Split into max 2 parts
-            collection_part = parts[0]  # "collection.user_id"
-            search_terms = parts[1] if len(parts) > 1 else ""  # Optional search terms
-            
-            # Extract user_id from "collection.user_id"
-            if '.' in collection_part:
-                user_id = collection_part.split('.')[1]
-                
-                if user_id.isdigit():
-                    user_id_int = int(user_id)
-                    
-                    # Get user from cache or database
-                    if user_id in user_collection_cache:
-                        user = user_collection_cache[user_id]
-                    else:
-                        user = await user_collection.find_one({'id': user_id_int})
-                        if user:
-                            user_collection_cache[user_id] = user
-
-                    if user and 'characters' in user:
-                        # Get unique characters by ID
-                        all_characters = list({v['id']:v for v in user['characters']}.values())
-                        
-                        # Apply search filter if provided
-                        if search_terms.strip():
-                            regex = re.compile(search_terms.strip(), re.IGNORECASE)
-                            all_characters = [character for character in all_characters 
-                                           if regex.search(character.get('name', '')) or 
-                                              regex.search(character.get('anime', ''))]
-                        
-                        LOGGER.info(f"Found {len(all_characters)} characters for user {user_id}")
-                    else:
-                        all_characters = []
-                        LOGGER.info(f"No user found or no characters for user {user_id}")
-                else:
-                    all_characters = []
-                    LOGGER.info(f"Invalid user ID format: {user_id}")
-            else:
-                all_characters = []
-                LOGGER.info(f"Invalid collection query format: {query}")
-        except Exception as e:
-            LOGGER.error(f"Error processing collection query '{query}': {str(e)}")
-            all_characters = []
-    else:
-        # Handle general character search
-        if query:
-            # Search for specific characters by name or anime
-            regex = re.compile(query, re.IGNORECASE)
-            all_characters = list(await collection.find({"$or": [{"name": regex}, {"anime": regex}]}).to_list(length=None))
+    is_personal = query.startswith('collection.')
+    # Later pages slice the ids frozen by the first one
+    ids = inline_results.frozen(token) if token else None
+    if ids is None:
+        # An expired token is not sent again; the recomputed list gets a new one
+        token = None
+        if is_personal:
+            # Handle user collection queries
+            try:
+                ids = await _collection_ids(query)
+            except Exception as e:
+                LOGGER.error(f"Error processing collection query '{query}': {str(e)}")
+                ids = []
         else:
-            # Empty query - show popular/random characters like Yandex image search
-            if 'all_characters' in all_characters_cache:
-                all_characters = all_characters_cache['all_characters']
-            else:
-                # Get a diverse selection of characters (limit to prevent too much load)
-                all_characters = list(await collection.find({}).limit(200).to_list(length=None))
-                all_characters_cache['all_characters'] = all_characters
+            # Handle general character search
+            ids = await _search_ids(query)
 
     # Limit characters per page for better performance
-    characters = all_characters[offset:offset+50]
-    if len(all_characters) > offset + 50:
-        next_offset = str(offset + 50)
+    characters = [character for character in map(catalog.get, ids[offset:offset + PAGE_SIZE]) if character is not None]
+    if len(ids) > offset + PAGE_SIZE:
+        next_offset = f"{token or inline_results.freeze(ids)}:{offset + PAGE_SIZE}"
     else:
         next_offset = ""
 
     results = []
     for character in characters:
-        try:
-            # Get rarity emoji for consistent display
-            rarity_emoji = rarity_emojis.get(character.get('rarity', 'Common'), "✨")
-            
-            # Get enhanced statistics
-            global_count = await user_collection.count_documents({'characters.id': character['id']})
-            
-            # Optimized display with proper rarity emojis and enhanced styling
-            if query.startswith('collection.') and user:
-                # For user collections, show detailed stats with owner info
-                anime_characters = await collection.count_documents({'anime': character['anime']})
-                user_character_count = sum(c['id'] == character['id'] for c in user['characters'])
-                user_anime_characters = sum(c['anime'] == character['anime'] for c in user['characters'])
-                
-                # Get top 5 users who have this character
-                top_users = await user_collection.find(
-                    {'characters.id': character['id']}, 
-                    {'first_name': 1, 'characters': 1}
-                ).limit(5).to_list(length=5)
-                user_list = ", ".join([f"{user.get('first_name', 'User')} (x{sum(1 for c in user.get('characters', []) if c['id'] == character['id'])})" for user in top_users])
-                
-                caption = (
-                    f"OwO! Check out this waifu!\n\n"
-                    f"{character['anime']}\n"
-                    f"{character['id']}: {character['name']} \n"
-                    f"({rarity_emoji}𝙍𝘼𝙍𝙄𝙏𝙔:  {character.get('rarity', 'Unknown').lower()})"
-                )
-            elif query:
-                # For search queries, show detailed global stats
-                # Get top 3 users who have this character for display
-                top_users = await user_collection.find(
-                    {'characters.id': character['id']}, 
-                    {'first_name': 1, 'characters': 1}
-                ).limit(3).to_list(length=3)
-                user_list = ", ".join([f"{user.get('first_name', 'User')} (x{sum(1 for c in user.get('characters', []) if c['id'] == character['id'])})" for user in top_users])
-                
-                caption = (
-                    f"OwO! Check out this waifu!\n\n"
-                    f"{character['anime']}\n"
-                    f"{character['id']}: {character['name']} \n"
-                    f"({rarity_emoji}𝙍𝘼𝙍𝙄𝙏𝙔:  {character.get('rarity', 'Unknown').lower()})"
-                )
-            else:
-                # For empty query, show simplified but styled info
-                caption = (
-                    f"OwO! Check out this waifu!\n\n"
-                    f"{character['anime']}\n"
-                    f"{character['id']}: {character['name']} \n"
-                    f"({rarity_emoji}𝙍𝘼𝙍𝙄𝙏𝙔:  {character.get('rarity', 'Unknown').lower()})"
-                )
-            
-            # Process image URL for compatibility (handles JFIF and other formats)
-            from shivu import process_image_url
-            processed_url = await process_image_url(character['img_url'])
-            
-            # Check if it's a video and use appropriate result type
-            if is_video_character(character):
-                # Determine mime type based on file extension
-                if '.webm' in character['img_url'].lower():
-                    mime_type = 'video/webm'
-                elif '.mov' in character['img_url'].lower():
-                    mime_type = 'video/quicktime'
-                elif '.avi' in character['img_url'].lower():
-                    mime_type = 'video/x-msvideo'
-                elif '.mkv' in character['img_url'].lower():
-                    mime_type = 'video/x-matroska'
-                elif '.flv' in character['img_url'].lower():
-                    mime_type = 'video/x-flv'
-                else:
-                    mime_type = 'video/mp4'
-                
-                try:
-                    # Use a placeholder thumbnail (must be JPEG for Telegram API)
-                    placeholder_thumbnail = 'https://via.placeholder.com/320x180.jpg'
-                    
-                    results.append(
-                        InlineQueryResultVideo(
-                            id=f"{character['id']}_{time.time()}",
-                            video_url=processed_url,
-                            mime_type=mime_type,
-                            thumbnail_url=placeholder_thumbnail,
-                            title=f"{character['name']} - {character['anime']}",
-                            caption=caption
-                        )
-                    )
-                except Exception as video_error:
-                    # Fallback: treat as photo if video format is rejected
-                    LOGGER.warning(f"Video inline result failed for character {character['id']} ({character['name']}), URL: {processed_url[:100]}, Error: {str(video_error)}. Falling back to photo.")
-                    results.append(
-                        InlineQueryResultPhoto(
-                            thumbnail_url=processed_url,
-                            id=f"{character['id']}_{time.time()}",
-                            photo_url=processed_url,
-                            caption=f"🎬 [Video] {caption}"
-                        )
-                    )
-            else:
-                results.append(
-                    InlineQueryResultPhoto(
-                        thumbnail_url=processed_url,
-                        id=f"{character['id']}_{time.time()}",
-                        photo_url=processed_url,
-                        caption=caption
-                    )
-                )
-        except Exception as e:
-            # Log error and skip problematic characters to prevent the entire query from failing
-            LOGGER.error(f"Failed to create inline result for character {character.get('id', 'unknown')} ({character.get('name', 'unknown')}): {str(e)}")
-            continue
-
-    await update.inline_query.answer(results, next_offset=next_offset, cache_time=5)
+        result = inline_results.get_result(character['id'])
+        if result is None:
+            try:
+                result = await _build_result(character, _caption(character))
+            except Exception as e:
+                # Log error and skip problematic characters to prevent the entire query from failing
+                LOGGER.error(f"Failed to create inline result for character {character.get('id', 'unknown')} ({character.get('name', 'unknown')}): {str(e)}")
+                continue
+            inline_results.put_result(character, result)
+        results.append(result)
+
+    await update.inline_query.answer(
+        results,
+        next_offset=next_offset,
+        cache_time=PERSONAL_CACHE_TIME if is_personal else PUBLIC_CACHE_TIME,
+        is_personal=is_personal
+    )
 
 application.add_handler(InlineQueryHandler(inlinequery, block=False))
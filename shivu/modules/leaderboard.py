@@ -10,16 +10,14 @@ from shivu import (application, PHOTO_URL, OWNER_ID,
                     group_user_totals_collection)
 
 from shivu import sudo_users as SUDO_USERS 
+from shivu import ownership
+from shivu.leaderboard_buffer import leaderboard_buffer
 
     
 async def global_leaderboard(update: Update, context: CallbackContext) -> None:
     
-    cursor = top_global_groups_collection.aggregate([
-        {"$project": {"group_name": 1, "count": 1}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ])
-    leaderboard_data = await cursor.to_list(length=10)
+    # Stored counts plus claims still waiting in the write-behind buffer
+    leaderboard_data = await leaderboard_buffer.top_groups(10)
 
     leaderboard_message = "🌐  𝗧𝗢𝗣 𝗚𝗿𝗼𝘂𝗽𝘀:\n"
     leaderboard_message += "┏━┅┅┄┄⟞⟦👥⟧⟝┄┄┉┉━┓\n"
@@ -46,13 +44,8 @@ async def global_leaderboard(update: Update, context: CallbackContext) -> None:
 async def ctop(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
 
-    cursor = group_user_totals_collection.aggregate([
-        {"$match": {"group_id": chat_id}},
-        {"$project": {"username": 1, "first_name": 1, "character_count": "$count"}},
-        {"$sort": {"character_count": -1}},
-        {"$limit": 10}
-    ])
-    leaderboard_data = await cursor.to_list(length=10)
+    # Stored counts plus claims still waiting in the write-behind buffer
+    leaderboard_data = await leaderboard_buffer.top_group_users(chat_id, 10)
 
     leaderboard_message = "<b>TOP 10 USERS WHO GUESSED CHARACTERS MOST TIME IN THIS GROUP..</b>\n\n"
 
@@ -62,7 +55,7 @@ async def ctop(update: Update, context: CallbackContext) -> None:
 
         if len(first_name) > 10:
             first_name = first_name[:15] + '...'
-        character_count = user['character_count']
+        character_count = user['count']
         leaderboard_message += f'{i}. <a href="https://t.me/{username}"><b>{first_name}</b></a> ➾ <b>{character_count}</b>\n'
     
     photo_url = random.choice(PHOTO_URL)
@@ -72,42 +65,18 @@ async def ctop(update: Update, context: CallbackContext) -> None:
 
 async def leaderboard(update: Update, context: CallbackContext) -> None:
     
-    cursor = user_collection.aggregate([
-        {
-            "$project": {
-                "username": 1, 
-                "first_name": 1, 
-                "total_characters": {"$size": "$characters"},
-                "unique_characters": {
-                    "$size": {
-                        "$setUnion": [
-                            {"$map": {
-                                "input": "$characters",
-                                "as": "char",
-                                "in": "$$char.id"
-                            }}, []
-                        ]
-                    }
-                }
-            }
-        },
-        {"$sort": {"unique_characters": -1}},
-        {"$limit": 10}
-    ])
-    leaderboard_data = await cursor.to_list(length=10)
+    leaderboard_data = await ownership.top_collectors(10)
 
     leaderboard_message = "🌐 𝗚𝗟𝗢𝗕𝗔𝗟 𝗧𝗢𝗣 𝗖𝗼𝗹𝗹𝗲𝗰𝘁𝘀:\n"
     leaderboard_message += "┏━┅┅┄┄⟞⟦🌐⟧⟝┄┄┉┉━┓\n"
 
     for i, user in enumerate(leaderboard_data, start=1):
-        username = user.get('username', 'Unknown')
-        first_name = html.escape(user.get('first_name', 'Unknown'))
-        user_id = user.get('_id', 'Unknown')  # MongoDB _id field
+        first_name = html.escape(user.get('first_name') or 'Unknown')
 
         if len(first_name) > 10:
             first_name = first_name[:15] + '...'
-        unique_count = user['unique_characters']
-        total_count = user['total_characters']
+        unique_count = user['unique']
+        total_count = user['total']
         leaderboard_message += f'┣ {i:02d}.  {first_name} ⇒ {unique_count} (total {total_count})\n'
     
     leaderboard_message += "┗━┅┅┄┄⟞⟦🌐⟧⟝┄┄┉┉━┛"
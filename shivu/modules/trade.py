@@ -1,8 +1,13 @@
+import asyncio
+
 from pyrogram import filters, enums
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from html import escape
 
 from shivu import user_collection, shivuu, collection
+from shivu import ownership
+from shivu import media
+from shivu.catalog import catalog
 from shivu.config import Config
 
 pending_trades = {}
@@ -28,26 +33,16 @@ async def trade(client, message):
 
     sender_character_id, receiver_character_id = message.command[1], message.command[2]
 
-    sender = await user_collection.find_one({'id': sender_id})
-    receiver = await user_collection.find_one({'id': receiver_id})
-
-    # Check if users exist and have characters field
-    if not sender or not sender.get('characters'):
-        await message.reply_text("You don't have any characters to trade!")
-        return
-        
-    if not receiver or not receiver.get('characters'):
-        await message.reply_text("The other user doesn't have any characters to trade!")
-        return
-
-    sender_character = next((character for character in sender['characters'] if character['id'] == sender_character_id), None)
-    receiver_character = next((character for character in receiver['characters'] if character['id'] == receiver_character_id), None)
+    sender_count, receiver_count = await asyncio.gather(
+        ownership.count(sender_id, sender_character_id),
+        ownership.count(receiver_id, receiver_character_id)
+    )
 
-    if not sender_character:
+    if not sender_count:
         await message.reply_text("You don't have the character you're trying to trade!")
         return
 
-    if not receiver_character:
+    if not receiver_count:
         await message.reply_text("The other user doesn't have the character they're trying to trade!")
         return
 
@@ -90,39 +85,25 @@ async def on_trade_callback_query(client, callback_query):
 
     if callback_query.data == "confirm_trade":
         
-        sender = await user_collection.find_one({'id': sender_id})
-        receiver = await user_collection.find_one({'id': receiver_id})
-
-        # Check if users still exist and have characters
-        if not sender or not sender.get('characters'):
-            await callback_query.answer("Sender no longer has characters!", show_alert=True)
-            return
-            
-        if not receiver or not receiver.get('characters'):
-            await callback_query.answer("Receiver no longer has characters!", show_alert=True)
-            return
-
-        sender_character = next((character for character in sender['characters'] if character['id'] == sender_character_id), None)
-        receiver_character = next((character for character in receiver['characters'] if character['id'] == receiver_character_id), None)
+        # Take both characters first; each removal only succeeds if the copy is still owned
+        sender_removed, receiver_removed = await asyncio.gather(
+            ownership.remove(sender_id, sender_character_id),
+            ownership.remove(receiver_id, receiver_character_id)
+        )
 
-        if not sender_character or not receiver_character:
+        if not sender_removed or not receiver_removed:
+            # Give back whichever side was taken
+            if sender_removed:
+                await ownership.add(sender_id, sender_character_id)
+            if receiver_removed:
+                await ownership.add(receiver_id, receiver_character_id)
             await callback_query.answer("One of the characters is no longer available!", show_alert=True)
             return
-        
-        sender['characters'].remove(sender_character)
-        receiver['characters'].remove(receiver_character)
-
-        
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-        await user_collection.update_one({'id': receiver_id}, {'$set': {'characters': receiver['characters']}})
 
-        
-        sender['characters'].append(receiver_character)
-        receiver['characters'].append(sender_character)
-
-        
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-        await user_collection.update_one({'id': receiver_id}, {'$set': {'characters': receiver['characters']}})
+        await asyncio.gather(
+            ownership.add(sender_id, receiver_character_id),
+            ownership.add(receiver_id, sender_character_id)
+        )
 
         
         del pending_trades[(sender_id, receiver_id)]
@@ -163,14 +144,7 @@ async def gift(client, message):
 
     character_id = message.command[1]
 
-    sender = await user_collection.find_one({'id': sender_id})
-
-    # Check if user exists and has characters field
-    if not sender or not sender.get('characters'):
-        await message.reply_text("You don't have any characters to gift!")
-        return
-
-    character = next((character for character in sender['characters'] if character['id'] == character_id), None)
+    character = catalog.get(character_id) if await ownership.count(sender_id, character_id) else None
 
     if not character:
         await message.reply_text("You don't have this character in your collection!")
@@ -215,10 +189,10 @@ async def gift(client, message):
 
     try:
         if 'img_url' in character:
-            from shivu import process_image_url
-            processed_url = await process_image_url(character['img_url'])
-            await message.reply_photo(
-                photo=processed_url,
+            processed_url = await media.media_source(character)
+            send = message.reply_video if media.is_video(character) else message.reply_photo
+            await send(
+                processed_url,
                 caption=caption,
                 parse_mode=enums.ParseMode.HTML,
                 reply_markup=keyboard
@@ -242,28 +216,23 @@ async def on_gift_callback_query(client, callback_query):
 
     if callback_query.data == "confirm_gift":
         
-        sender = await user_collection.find_one({'id': sender_id})
-        receiver = await user_collection.find_one({'id': receiver_id})
-
-        # Check if sender still exists and has characters
-        if not sender or not sender.get('characters'):
-            await callback_query.answer("You no longer have characters to gift!", show_alert=True)
+        # Check if sender still has the character
+        if not await ownership.remove(sender_id, gift['character']['id']):
+            await callback_query.answer("You no longer have this character to gift!", show_alert=True)
             return
-        
-        sender['characters'].remove(gift['character'])
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
 
-        
-        if receiver:
-            await user_collection.update_one({'id': receiver_id}, {'$push': {'characters': gift['character']}})
-        else:
-            
-            await user_collection.insert_one({
-                'id': receiver_id,
-                'username': gift['receiver_username'],
-                'first_name': gift['receiver_first_name'],
-                'characters': [gift['character']],
-            })
+        await asyncio.gather(
+            user_collection.update_one(
+                {'id': receiver_id},
+                {'$setOnInsert': {
+                    'username': gift['receiver_username'],
+                    'first_name': gift['receiver_first_name'],
+                    'ownership_migrated': True,
+                }},
+                upsert=True
+            ),
+            ownership.add(receiver_id, gift['character']['id'])
+        )
 
         
         del pending_gifts[(sender_id, receiver_id)]
@@ -335,22 +304,19 @@ async def give(client, message):
         await message.reply_text(f"❌ Character with ID `{character_id}` not found in the database.")
         return
     
-    # Check if receiver exists in database, if not create entry
-    receiver = await user_collection.find_one({'id': receiver_id})
-    if receiver:
-        # Add character to existing user
-        await user_collection.update_one(
-            {'id': receiver_id}, 
-            {'$push': {'characters': character}}
-        )
-    else:
-        # Create new user entry
-        await user_collection.insert_one({
-            'id': receiver_id,
-            'username': receiver_username,
-            'first_name': receiver_first_name,
-            'characters': [character],
-        })
+    # Create the receiver's entry if needed and add the character
+    await asyncio.gather(
+        user_collection.update_one(
+            {'id': receiver_id},
+            {'$setOnInsert': {
+                'username': receiver_username,
+                'first_name': receiver_first_name,
+                'ownership_migrated': True,
+            }},
+            upsert=True
+        ),
+        ownership.add(receiver_id, character['id'])
+    )
     
     # Success message
     if message.reply_to_message:
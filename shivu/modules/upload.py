@@ -8,6 +8,11 @@ from telegram import Update
 from telegram.ext import CommandHandler, CallbackContext
 
 from shivu import application, sudo_users, uploading_users, collection, db, CHARA_CHANNEL_ID, SUPPORT_CHAT, user_collection
+from shivu import ownership
+from shivu import media
+from shivu.catalog import catalog
+from shivu.chat_state import chat_states
+from shivu.spawn_pool import spawn_pool, SUMMON
 
 # Rarity styles for display purposes
 rarity_styles = {
@@ -61,30 +66,6 @@ def is_discord_cdn_url(url):
         return False
 
 
-def is_video_url(url):
-    """Check if a URL points to a video file"""
-    if not url:
-        return False
-    return any(ext in url.lower() for ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv'])
-
-def is_video_character(character):
-    """Check if a character is a video by URL extension or name marker"""
-    if not character:
-        return False
-    
-    # Check URL extension
-    url = character.get('img_url', '')
-    if is_video_url(url):
-        return True
-    
-    # Check for 🎬 emoji marker in name
-    name = character.get('name', '')
-    if '🎬' in name:
-        return True
-    
-    return False
-
-
 def validate_url(url):
     """
     Validate a URL and return whether it's accessible.
@@ -174,8 +155,8 @@ async def upload(update: Update, context: CallbackContext) -> None:
             await update.message.reply_text(f'Invalid URL: {validation_message}')
             return
         
-        # Check if it's a video based on validation message or URL extension
-        is_video = 'video' in validation_message.lower() or any(ext in args[0].lower() for ext in ['.mp4', '.mov', '.avi', '.mkv'])
+        # Resolve the media type, MIME type and normalized URL once, from the host's content type
+        media_info = await media.probe(args[0], character_name)
         
         # If it's a Discord CDN link, inform the user
         if is_discord_cdn_url(args[0]):
@@ -205,13 +186,13 @@ async def upload(update: Update, context: CallbackContext) -> None:
             'name': character_name,
             'anime': anime,
             'rarity': rarity,
-            'id': id
+            'id': id,
+            **media_info
         }
 
         try:
             rarity_emoji = rarity_styles.get(rarity, "")
-            from shivu import process_image_url
-            processed_url = await process_image_url(args[0])
+            processed_url = media_info['media_url']
             # Create neat and pretty caption format
             caption = (
                 f"✨ <b>{character_name}</b> ✨\n"
@@ -223,7 +204,7 @@ async def upload(update: Update, context: CallbackContext) -> None:
                 f"📤 Added by <a href='tg://user?id={update.effective_user.id}'>{update.effective_user.first_name}</a>"
             )
             
-            if is_video:
+            if media_info['media_type'] == 'video':
                 message = await context.bot.send_video(
                     chat_id=CHARA_CHANNEL_ID,
                     video=processed_url,
@@ -238,10 +219,14 @@ async def upload(update: Update, context: CallbackContext) -> None:
                     parse_mode='HTML'
                 )
             character['message_id'] = message.message_id
+            # Later sends reuse the channel post's file instead of fetching img_url again
+            character.update(media.file_fields(message))
             await collection.insert_one(character)
+            catalog.add(character)
             await update.message.reply_text('CHARACTER ADDED....')
         except:
             await collection.insert_one(character)
+            catalog.add(character)
             await update.effective_message.reply_text("Character Added but no Database Channel Found, Consider adding one.")
         
     except Exception as e:
@@ -265,15 +250,13 @@ async def delete(update: Update, context: CallbackContext) -> None:
         character = await collection.find_one_and_delete({'id': args[0]})
 
         if character:
+            catalog.remove(args[0])
+
             # Also remove from all user collections
-            from shivu import user_collection
-            user_result = await user_collection.update_many(
-                {'characters.id': args[0]},
-                {'$pull': {'characters': {'id': args[0]}}}
-            )
+            owner_count = await ownership.delete_character(args[0])
             
             await context.bot.delete_message(chat_id=CHARA_CHANNEL_ID, message_id=character['message_id'])
-            await update.message.reply_text(f'✅ Character deleted from database and removed from {user_result.modified_count} user collections.')
+            await update.message.reply_text(f'✅ Character deleted from database and removed from {owner_count} user collections.')
         else:
             await update.message.reply_text('Deleted Successfully from db, but character not found In Channel')
     except Exception as e:
@@ -289,71 +272,26 @@ async def summon(update: Update, context: CallbackContext) -> None:
         return
         
     try:
-        # Get total character count
-        total_characters = await collection.count_documents({})
-        
-        if total_characters == 0:
+        # Characters come from the in-memory catalog, so a summon costs no query
+        await catalog.ensure_loaded()
+        if not len(catalog):
             await update.message.reply_text('📭 No characters in database to summon!\n\nUpload some characters first using /upload')
             return
         
-        # Get characters grouped by rarity for weighted selection
-        rarities_weights = {
-            "Common": 20,
-            "Uncommon": 20,
-            "Rare": 20,
-            "Epic": 20,
-            "Legendary": 2,
-            "Mythic": 0.8,
-            "Retro": 0.3,
-            "Zenith": 0,
-            "Limited Edition": 0
-        }
-        
-        # Get available rarities from database (excluding Limited Edition)
-        available_rarities = await collection.distinct('rarity', {'rarity': {'$ne': 'Limited Edition'}})
+        # Weighted rarity draw from the spawn pool's alias table, then a random character of it (locked ones included)
+        character = await spawn_pool.pick(SUMMON)
         
-        if not available_rarities:
-            await update.message.reply_text('❌ No spawnable characters available!\n\nAll characters in the database appear to be Limited Edition or non-spawnable. Please upload some common characters using /upload.')
-            return
-        
-        # Filter weights to only include available rarities
-        available_weights = {rarity: rarities_weights.get(rarity, 0) for rarity in available_rarities if rarities_weights.get(rarity, 0) > 0}
-        
-        if not available_weights:
-            await update.message.reply_text('❌ No spawnable characters available!\n\nAll available character rarities have 0 spawn weight. Please upload some common characters using /upload.')
-            return
-        
-        # Use weighted random selection for rarity
-        import random
-        selected_rarity = random.choices(
-            population=list(available_weights.keys()),
-            weights=list(available_weights.values()),
-            k=1
-        )[0]
-        
-        # Get a random character from the selected rarity
-        random_character = await collection.aggregate([
-            {'$match': {'rarity': selected_rarity}},
-            {'$sample': {'size': 1}}
-        ]).to_list(length=1)
-        
-        if not random_character:
+        if not character:
             await update.message.reply_text('❌ No spawnable characters available!\n\nAll characters in the database appear to be Limited Edition or non-spawnable. Please upload some common characters using /upload.')
             return
             
-        character = random_character[0]
         chat_id = update.effective_chat.id
         
-        # Store character for marry command to find it
-        from shivu.__main__ import last_characters, first_correct_guesses, manually_summoned
-        last_characters[chat_id] = character
-        
-        # Mark as manually summoned to allow multiple marriages
-        manually_summoned[chat_id] = True
-        
-        # Clear any existing guesses for this chat
-        if chat_id in first_correct_guesses:
-            del first_correct_guesses[chat_id]
+        # Store character for marry command to find it, marked as manually
+        # summoned to allow multiple marriages and clearing any existing guess
+        state = await chat_states.get(chat_id)
+        state.new_spawn(character, manually_summoned=True)
+        chat_states.touch(state)
         
         # Get rarity emoji
         rarity_emoji = rarity_styles.get(character.get('rarity', ''), "")
@@ -363,15 +301,7 @@ async def summon(update: Update, context: CallbackContext) -> None:
         
         # Process the image URL for compatibility and handle errors gracefully
         try:
-            from shivu import process_image_url
-            processed_url = await process_image_url(character['img_url'])
-            
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=processed_url,
-                caption=caption,
-                parse_mode='HTML'
-            )
+            await media.send_character(context.bot, chat_id, character, caption=caption, parse_mode='HTML')
         except Exception as img_error:
             # If image fails to load, send text message instead
             await context.bot.send_message(
@@ -415,32 +345,19 @@ async def remove_character_from_user(update: Update, context: CallbackContext) -
             return
 
         # Find the user
-        from shivu import user_collection
-        user = await user_collection.find_one({'id': user_id})
+        user = await user_collection.find_one({'id': user_id}, {'first_name': 1})
         if not user:
             await update.message.reply_text(f'❌ User with ID {user_id} not found!')
             return
 
         # Check if user has this character
-        user_character_count = sum(1 for c in user.get('characters', []) if c.get('id') == character_id)
+        user_character_count = await ownership.count(user_id, character_id)
         if user_character_count == 0:
             await update.message.reply_text(f'❌ User does not have character #{character_id} ({character["name"]}) in their harem!')
             return
 
         # Remove one instance of the character
-        # Remove only one instance of the character (two-step process)
-        # First, unset the first matching character to null
-        await user_collection.update_one(
-            {'id': user_id, 'characters.id': character_id},
-            {'$unset': {'characters.$': 1}}
-        )
-        # Then pull the null values
-        result = await user_collection.update_one(
-            {'id': user_id},
-            {'$pull': {'characters': None}}
-        )
-
-        if result.modified_count > 0:
+        if await ownership.remove(user_id, character_id):
             remaining_count = user_character_count - 1
             user_name = user.get('first_name', 'User')
             await update.message.reply_text(
@@ -480,26 +397,12 @@ async def find(update: Update, context: CallbackContext) -> None:
         # Get rarity emoji
         rarity_emoji = rarity_styles.get(character.get('rarity', ''), "✨")
         
-        # Find global catchers - users who have this character
-        global_catchers = []
-        total_caught = 0
-        
-        users_with_character = user_collection.find({"characters.id": character_id})
-        async for user in users_with_character:
-            user_id = user['id']
-            character_count = sum(1 for c in user.get('characters', []) if c.get('id') == character_id)
-            if character_count > 0:
-                user_name = user.get('first_name', f'User{user_id}')
-                global_catchers.append({
-                    'user_id': user_id,
-                    'name': user_name,
-                    'count': character_count
-                })
-                total_caught += character_count
-        
-        # Sort by count and get top 10
-        global_catchers.sort(key=lambda x: x['count'], reverse=True)
-        top_10 = global_catchers[:10]
+        # Find global catchers - top 10 users who have this character
+        total_caught, top_owners = await ownership.owners(character_id, 10)
+        top_10 = [
+            {'user_id': owner['user_id'], 'name': owner['first_name'] or f"User{owner['user_id']}", 'count': owner['count']}
+            for owner in top_owners
+        ]
         
         # Create new format caption
         caption = f"OwO! Look out this character!\n\n"
@@ -518,12 +421,12 @@ async def find(update: Update, context: CallbackContext) -> None:
             else:
                 caption += f"{i+1}. \n"
         
-        # Process the image URL for compatibility
-        from shivu import process_image_url, LOGGER
-        processed_url = await process_image_url(character['img_url'])
+        # Stored file_id if there is one, otherwise the processed image URL
+        from shivu import LOGGER
+        processed_url = await media.media_source(character)
         
         # Check if it's a video and use appropriate send method
-        if is_video_character(character):
+        if media.is_video(character):
             try:
                 await context.bot.send_video(
                     chat_id=update.effective_chat.id,
@@ -545,7 +448,7 @@ async def find(update: Update, context: CallbackContext) -> None:
                     # Last resort: send text with link
                     LOGGER.error(f"/find: Both video and photo failed for character {character_id}, URL: {processed_url[:100]}")
                     await update.message.reply_text(
-                        f"{caption}\n\n⚠️ Media display failed. View directly: {processed_url}",
+                        f"{caption}\n\n⚠️ Media display failed. View directly: {character['img_url']}",
                         parse_mode='HTML'
                     )
         else:
@@ -581,7 +484,7 @@ async def update(update: Update, context: CallbackContext) -> None:
             return
 
         # Check if field is valid
-        valid_fields = ['img_url', 'name', 'anime', 'rarity']
+        valid_fields = ['img_url', 'name', 'anime', 'rarity', 'aliases']
         if args[1] not in valid_fields:
             await update.message.reply_text(f'Invalid field. Please use one of the following: {", ".join(valid_fields)}')
             return
@@ -606,26 +509,35 @@ async def update(update: Update, context: CallbackContext) -> None:
             except KeyError:
                 await update.message.reply_text('Invalid rarity. Please use 1-9:\n1=Common, 2=Uncommon, 3=Rare, 4=Epic, 5=Legendary, 6=Mythic, 7=Retro, 8=Zenith, 9=Limited Edition')
                 return
+        elif args[1] == 'aliases':
+            # Extra accepted /marry answers, e.g. /update 12 aliases straw-hat,mugiwara ("-" for none)
+            new_value = [alias.replace('-', ' ').strip() for alias in args[2].split(',')]
+            new_value = [alias for alias in new_value if alias]
         else:
             new_value = args[2]
 
-        await collection.find_one_and_update({'id': args[0]}, {'$set': {args[1]: new_value}})
+        changes = {args[1]: new_value}
+        if args[1] == 'img_url':
+            # The stored file belongs to the old image; the new channel post below captures a fresh one
+            changes.update({'file_id': None, 'file_type': None})
+            changes.update(await media.probe(new_value, character['name']))
+        await collection.find_one_and_update({'id': args[0]}, {'$set': changes})
+        catalog.update(args[0], changes)
 
-        # Update user collections when character properties change
-        from shivu import user_collection
-        if args[1] in ['name', 'anime', 'rarity']:
-            await user_collection.update_many(
-                {'characters.id': args[0]},
-                {'$set': {f'characters.$[elem].{args[1]}': new_value}},
-                array_filters=[{'elem.id': args[0]}]
-            )
+        # Owners are not rewritten: harems join character details from the catalog
+
+        if args[1] == 'aliases':
+            # Aliases are not shown in the channel caption
+            await update.message.reply_text(f'Aliases set to: {", ".join(new_value) or "none"}')
+            return
 
         if args[1] == 'img_url':
             await context.bot.delete_message(chat_id=CHARA_CHANNEL_ID, message_id=character['message_id'])
             rarity_emoji = rarity_styles.get(character["rarity"], "")
-            message = await context.bot.send_photo(
-                chat_id=CHARA_CHANNEL_ID,
-                photo=new_value,
+            send = context.bot.send_video if changes['media_type'] == 'video' else context.bot.send_photo
+            message = await send(
+                CHARA_CHANNEL_ID,
+                changes['media_url'],
                 caption=(
                     f"✨ <b>{character['name']}</b> ✨\n"
                     f"🎌 <i>{character['anime']}</i>\n"
@@ -638,7 +550,9 @@ async def update(update: Update, context: CallbackContext) -> None:
                 parse_mode='HTML'
             )
             character['message_id'] = message.message_id
-            await collection.find_one_and_update({'id': args[0]}, {'$set': {'message_id': message.message_id}})
+            post_fields = {'message_id': message.message_id, **media.file_fields(message)}
+            await collection.find_one_and_update({'id': args[0]}, {'$set': post_fields})
+            catalog.update(args[0], post_fields)
         else:
             # Update character dict with new value for accurate caption
             character[args[1]] = new_value
@@ -706,6 +620,9 @@ async def migrate_rarities(update: Update, context: CallbackContext) -> None:
             array_filters=[{'elem.rarity': 'Arcane'}]
         )
         
+        # Rarities changed in bulk, so rebuild the in-memory catalog
+        await catalog.load()
+
         # Verify changes
         celestial_count = await collection.count_documents({'rarity': 'Celestial'})
         arcane_count = await collection.count_documents({'rarity': 'Arcane'})
@@ -0,0 +1,565 @@
+"""Who owns which characters: one character_ownership document per (user_id, character_id) with a count.
+
+User documents used to embed a full copy of every owned character, duplicates
+included, so /update and /delete had to rewrite every owner and each user read
+shipped the whole collection. Ownership now lives in its own collection and
+character details are joined from the in-memory catalog at read time.
+
+Every ownership read and write goes through this module. While the migration
+runs, users whose document still embeds ``characters`` are read from it (dual
+read); any write first migrates that user under a per-user lock, so a user is
+never split between the two layouts. ``migrate_all`` streams the remaining
+users in _id order and checkpoints its position, so it can be stopped and
+resumed; once nobody is left on the old layout the legacy reads are skipped.
+
+character_stats holds, per character, the number of owners, the copies in
+circulation and the biggest owners, so /find and inline results read one
+small document instead of scanning ownership. Every write here keeps it up
+to date; ``rebuild_stats`` recomputes it from scratch after the migration.
+The stored ``top`` list is always the exact top ``len(top)`` owners: an
+owner whose count may have fallen behind someone outside the list is dropped
+rather than guessed, and the list is refilled from the ownership index once
+it gets shorter than STATS_TOP_SHOWN.
+"""
+import asyncio
+import re
+import time
+import weakref
+from collections import Counter, OrderedDict
+
+from pymongo import UpdateOne, ReturnDocument
+
+from shivu import ownership_collection, user_collection, migrations_collection, character_stats_collection, LOGGER
+from shivu import metrics
+from shivu.catalog import catalog
+from shivu.harem_cache import harem_pages
+
+MIGRATION_ID = 'ownership'
+STATS_ID = 'character_stats'
+CHECKPOINT_EVERY = 200  # users migrated between checkpoints
+STATS_TOP_SHOWN = 10  # owners listed by /find
+STATS_TOP_KEPT = 20  # owners stored per character, so a few departures don't force a refill
+MIGRATED_USERS_KEPT = 100000  # users remembered as migrated; a forgotten one costs one extra read
+
+# Rarest first, for the rarity and limited_time harem sorts
+RARITY_ORDER = ["Limited Edition", "Zenith", "Retro", "Mythic", "Legendary", "Epic", "Rare", "Uncommon", "Common"]
+
+
+def _rarity_rank(character: dict) -> int:
+    rarity = character.get('rarity') or 'Common'
+    return RARITY_ORDER.index(rarity) if rarity in RARITY_ORDER else -1
+
+
+HAREM_SORTS = {
+    'anime': lambda character: (character.get('anime') or '', character['id']),
+    'rarity': lambda character: (_rarity_rank(character), character.get('name') or '', character['id']),
+    'name': lambda character: (character.get('name') or '', character['id']),
+    'limited_time': lambda character: (
+        character.get('rarity') != 'Limited Edition', _rarity_rank(character), character.get('name') or '', character['id']
+    ),
+}
+
+_user_locks = weakref.WeakValueDictionary()  # {user_id: asyncio.Lock} while in use
+_stats_locks = weakref.WeakValueDictionary()  # {character_id: asyncio.Lock} while in use
+_migrated_users = OrderedDict()  # {user_id: None} known to be migrated, least recent first; emptied once legacy reads stop
+_state = {'legacy_reads': True, 'migrated_by_writes': 0, 'stats_ready': False, 'stats_refills': 0}
+
+
+def _lock(user_id: int) -> asyncio.Lock:
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = _user_locks[user_id] = asyncio.Lock()
+    return lock
+
+
+def _is_migrated(user_id: int) -> bool:
+    if user_id not in _migrated_users:
+        return False
+    _migrated_users.move_to_end(user_id)
+    return True
+
+
+def _mark_migrated(user_id: int) -> None:
+    if not _state['legacy_reads']:
+        return
+    _migrated_users[user_id] = None
+    _migrated_users.move_to_end(user_id)
+    while len(_migrated_users) > MIGRATED_USERS_KEPT:
+        _migrated_users.popitem(last=False)
+
+
+def _stop_legacy_reads() -> None:
+    _state['legacy_reads'] = False
+    _migrated_users.clear()
+
+
+def _embedded_counts(user):
+    """Counts from a user document still on the embedded layout, or None if it isn't"""
+    if not user or not user.get('characters'):
+        return None
+    return Counter(character['id'] for character in user['characters'] if character and 'id' in character)
+
+
+async def load_migration_state() -> None:
+    """Skip the legacy reads if an earlier run finished the migration, and use the stats once rebuilt"""
+    state = await migrations_collection.find_one({'_id': MIGRATION_ID})
+    if state and state.get('completed'):
+        _stop_legacy_reads()
+    else:
+        _state['legacy_reads'] = True
+    stats_state = await migrations_collection.find_one({'_id': STATS_ID})
+    _state['stats_ready'] = bool(stats_state and stats_state.get('completed'))
+
+
+async def _legacy_counts(user_id: int):
+    if not _state['legacy_reads'] or _is_migrated(user_id):
+        return None
+    user = await user_collection.find_one({'id': user_id}, {'characters.id': 1})
+    embedded = _embedded_counts(user)
+    if embedded is None and user is not None:
+        _mark_migrated(user_id)
+    return embedded
+
+
+async def _migrate_locked(user_id: int) -> bool:
+    """Move one user's embedded characters into the ownership collection; caller holds the user's lock"""
+    user = await user_collection.find_one({'id': user_id}, {'characters.id': 1, 'ownership_migrated': 1})
+    if user is None:
+        _mark_migrated(user_id)
+        return False
+    embedded = _embedded_counts(user)
+    if embedded:
+        # $set rather than $inc so a run interrupted before the $unset can simply be repeated
+        await ownership_collection.bulk_write([
+            UpdateOne({'user_id': user_id, 'character_id': character_id}, {'$set': {'count': count}}, upsert=True)
+            for character_id, count in embedded.items()
+        ], ordered=False)
+    if 'characters' in user or not user.get('ownership_migrated'):
+        await user_collection.update_one(
+            {'_id': user['_id']},
+            {'$set': {'ownership_migrated': True}, '$unset': {'characters': ''}}
+        )
+    _mark_migrated(user_id)
+    return embedded is not None
+
+
+async def ensure_migrated(user_id: int) -> None:
+    """Make sure writes for ``user_id`` can go to the ownership collection"""
+    if not _state['legacy_reads'] or _is_migrated(user_id):
+        return
+    async with _lock(user_id):
+        if not _is_migrated(user_id) and await _migrate_locked(user_id):
+            _state['migrated_by_writes'] += 1
+
+
+async def counts(user_id: int) -> dict:
+    """Return {character_id: copies} for everything the user owns"""
+    embedded = await _legacy_counts(user_id)
+    if embedded is not None:
+        return dict(embedded)
+    cursor = ownership_collection.find(
+        {'user_id': user_id, 'count': {'$gt': 0}},
+        {'_id': 0, 'character_id': 1, 'count': 1}
+    )
+    return {document['character_id']: document['count'] async for document in cursor}
+
+
+async def count(user_id: int, character_id: str) -> int:
+    """Return how many copies of a character the user owns"""
+    embedded = await _legacy_counts(user_id)
+    if embedded is not None:
+        return embedded.get(character_id, 0)
+    document = await ownership_collection.find_one({'user_id': user_id, 'character_id': character_id}, {'count': 1})
+    return max(document['count'], 0) if document else 0
+
+
+async def owned_characters(user_id: int) -> list:
+    """Return (character, copies) for every owned character that is still in the catalog"""
+    await catalog.ensure_loaded()
+    owned = []
+    for character_id, copies in (await counts(user_id)).items():
+        character = catalog.get(character_id)
+        if character is not None:
+            owned.append((character, copies))
+    return owned
+
+
+async def harem_page(user_id: int, page: int, page_size: int, sort: str = 'anime',
+                     filter_type: str = None, filter_value: str = None, favorite_id: str = None):
+    """One page of a harem, sorted and filtered against the in-memory catalog.
+
+    Returns {'entries': [(character, copies)], 'page', 'matching', 'unique',
+    'copies', 'favorite_owned'}. Only the user's ownership counts are read
+    from the database; characters are joined from the catalog, and ones
+    deleted from it drop out. An out-of-range page falls back to the first one.
+    """
+    owned = await owned_characters(user_id)
+
+    if filter_type == 'rarity' and filter_value:
+        matching = [(character, copies) for character, copies in owned if character.get('rarity') == filter_value]
+    elif filter_type == 'character' and filter_value:
+        pattern = re.compile(re.escape(filter_value), re.IGNORECASE)
+        matching = [(character, copies) for character, copies in owned if pattern.search(character.get('name') or '')]
+    else:
+        matching = owned
+    sort_key = HAREM_SORTS.get(sort, HAREM_SORTS['anime'])
+    matching.sort(key=lambda entry: sort_key(entry[0]))
+
+    if page < 0 or page * page_size >= len(matching):
+        page = 0
+    return {
+        'entries': matching[page * page_size:(page + 1) * page_size],
+        'page': page,
+        'matching': len(matching),
+        'unique': len(owned),
+        'copies': sum(copies for _character, copies in owned),
+        'favorite_owned': any(character['id'] == favorite_id for character, _copies in owned),
+    }
+
+
+def _stats_lock(character_id: str) -> asyncio.Lock:
+    lock = _stats_locks.get(character_id)
+    if lock is None:
+        lock = _stats_locks[character_id] = asyncio.Lock()
+    return lock
+
+
+async def _update_stats(character_id: str, user_id: int, owner_delta: int, copy_delta: int, count: int) -> None:
+    """Apply one ownership change to the character's stats; ``count`` is the user's copies afterwards"""
+    async with _stats_lock(character_id):
+        stats = await character_stats_collection.find_one_and_update(
+            {'_id': character_id},
+            {'$inc': {'owners': owner_delta, 'copies': copy_delta}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        top = stats.get('top', [])
+        others = [owner for owner in top if owner['user_id'] != user_id]
+        # The user's rank is only certain at or above the lowest listed count (their old one
+        # included), or anywhere if nobody else is missing from the list
+        floor = min((owner['count'] for owner in top), default=0)
+        if count > 0 and (count >= floor or stats['owners'] <= len(others) + 1):
+            others.append({'user_id': user_id, 'count': count})
+            others = sorted(others, key=lambda owner: owner['count'], reverse=True)[:STATS_TOP_KEPT]
+        if others != top:
+            await character_stats_collection.update_one({'_id': character_id}, {'$set': {'top': others}})
+        if stats['owners'] <= 0 or (len(others) < STATS_TOP_SHOWN and stats['owners'] > len(others)):
+            await _refill_top(character_id)
+
+
+async def _refill_top(character_id: str, force: bool = False) -> None:
+    stats = await character_stats_collection.find_one({'_id': character_id})
+    if not stats:
+        return
+    if stats.get('owners', 0) <= 0:
+        await character_stats_collection.delete_one({'_id': character_id, 'owners': {'$lte': 0}})
+        return
+    if not force and (len(stats.get('top', [])) >= STATS_TOP_SHOWN or stats['owners'] <= len(stats.get('top', []))):
+        return
+    # The (character_id, count) index serves this directly
+    top = await ownership_collection.find(
+        {'character_id': character_id, 'count': {'$gt': 0}},
+        {'_id': 0, 'user_id': 1, 'count': 1}
+    ).sort('count', -1).limit(STATS_TOP_KEPT).to_list(length=STATS_TOP_KEPT)
+    await character_stats_collection.update_one({'_id': character_id}, {'$set': {'top': top}})
+    _state['stats_refills'] += 1
+
+
+async def _recount_stats(character_id: str) -> None:
+    """Recompute one character's stats from the ownership collection"""
+    async with _stats_lock(character_id):
+        totals = await ownership_collection.aggregate([
+            {'$match': {'character_id': character_id, 'count': {'$gt': 0}}},
+            {'$group': {'_id': None, 'owners': {'$sum': 1}, 'copies': {'$sum': '$count'}}}
+        ]).to_list(length=1)
+        if not totals:
+            await character_stats_collection.delete_one({'_id': character_id})
+            return
+        await character_stats_collection.update_one(
+            {'_id': character_id},
+            {'$set': {'owners': totals[0]['owners'], 'copies': totals[0]['copies'], 'top': []}},
+            upsert=True
+        )
+        await _refill_top(character_id, force=True)
+
+
+async def add(user_id: int, character_id: str, copies: int = 1) -> None:
+    await ensure_migrated(user_id)
+    document = await ownership_collection.find_one_and_update(
+        {'user_id': user_id, 'character_id': character_id},
+        {'$inc': {'count': copies}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    harem_pages.bump(user_id)
+    new_owner = 1 if document['count'] == copies else 0
+    await _update_stats(character_id, user_id, new_owner, copies, document['count'])
+
+
+async def remove(user_id: int, character_id: str, copies: int = 1) -> bool:
+    """Take copies of a character from the user; False if they don't own that many"""
+    await ensure_migrated(user_id)
+    document = await ownership_collection.find_one_and_update(
+        {'user_id': user_id, 'character_id': character_id, 'count': {'$gte': copies}},
+        {'$inc': {'count': -copies}},
+        return_document=ReturnDocument.AFTER
+    )
+    if document is None:
+        return False
+    harem_pages.bump(user_id)
+    if document['count'] <= 0:
+        await ownership_collection.delete_one({'_id': document['_id'], 'count': {'$lte': 0}})
+    await _update_stats(character_id, user_id, -1 if document['count'] <= 0 else 0, -copies, document['count'])
+    return True
+
+
+async def move_all(from_user_id: int, to_user_id: int) -> int:
+    """Move every character of one user to another; returns the number of copies moved"""
+    await ensure_migrated(from_user_id)
+    await ensure_migrated(to_user_id)
+    documents = await ownership_collection.find(
+        {'user_id': from_user_id, 'count': {'$gt': 0}},
+        {'character_id': 1, 'count': 1}
+    ).to_list(length=None)
+    if not documents:
+        return 0
+    # Each document is taken with the count it has at that moment, so a copy added or
+    # removed concurrently is moved with it or stays with the source, never lost
+    taken = []
+    for document in documents:
+        taken_document = await ownership_collection.find_one_and_delete({'_id': document['_id']}, {'character_id': 1, 'count': 1})
+        if taken_document is not None and taken_document['count'] > 0:
+            taken.append(taken_document)
+    if taken:
+        await ownership_collection.bulk_write([
+            UpdateOne({'user_id': to_user_id, 'character_id': document['character_id']}, {'$inc': {'count': document['count']}}, upsert=True)
+            for document in taken
+        ], ordered=False)
+    harem_pages.bump(from_user_id)
+    harem_pages.bump(to_user_id)
+    # Transfers are rare; recounting the characters involved is simpler than tracking both sides
+    for document in documents:
+        await _recount_stats(document['character_id'])
+    return sum(document['count'] for document in taken)
+
+
+async def delete_character(character_id: str) -> int:
+    """Take a deleted character away from everyone; returns the number of owners"""
+    result = await ownership_collection.delete_many({'character_id': character_id})
+    await character_stats_collection.delete_one({'_id': character_id})
+    owners = result.deleted_count
+    if _state['legacy_reads']:
+        legacy = await user_collection.update_many(
+            {'characters.id': character_id},
+            {'$pull': {'characters': {'id': character_id}}}
+        )
+        owners += legacy.modified_count
+    return owners
+
+
+async def _names(user_ids: list) -> dict:
+    cursor = user_collection.find({'id': {'$in': user_ids}}, {'_id': 0, 'id': 1, 'first_name': 1})
+    return {user['id']: user.get('first_name') async for user in cursor}
+
+
+async def character_stats(character_ids: list) -> dict:
+    """{character_id: {'owners', 'copies', 'top'}} for a page of characters, in one query; {} until the stats are trusted"""
+    if not character_ids or not _state['stats_ready'] or _state['legacy_reads']:
+        return {}
+    cursor = character_stats_collection.find({'_id': {'$in': list(character_ids)}})
+    return {document['_id']: document async for document in cursor}
+
+
+async def popularity() -> dict:
+    """{character_id: copies owned} for every owned character, in one query"""
+    if _state['stats_ready'] and not _state['legacy_reads']:
+        cursor = character_stats_collection.find({'copies': {'$gt': 0}}, {'copies': 1})
+        return {document['_id']: document['copies'] async for document in cursor}
+    cursor = ownership_collection.aggregate([
+        {'$match': {'count': {'$gt': 0}}},
+        {'$group': {'_id': '$character_id', 'copies': {'$sum': '$count'}}},
+    ])
+    return {document['_id']: document['copies'] async for document in cursor}
+
+
+async def owners(character_id: str, limit: int = 10):
+    """Return (total copies, top owners as {'user_id', 'first_name', 'count'}) of a character"""
+    if _state['stats_ready'] and not _state['legacy_reads'] and limit <= STATS_TOP_SHOWN:
+        stats = (await character_stats([character_id])).get(character_id) or {}
+        top_owners = [dict(owner) for owner in stats.get('top', [])[:limit]]
+        names = await _names([owner['user_id'] for owner in top_owners]) if top_owners else {}
+        for owner in top_owners:
+            owner['first_name'] = names.get(owner['user_id'])
+        return stats.get('copies', 0), top_owners
+
+    async def copies():
+        result = await ownership_collection.aggregate([
+            {'$match': {'character_id': character_id, 'count': {'$gt': 0}}},
+            {'$group': {'_id': None, 'copies': {'$sum': '$count'}}}
+        ]).to_list(length=1)
+        return result[0]['copies'] if result else 0
+
+    async def top():
+        return await ownership_collection.find(
+            {'character_id': character_id, 'count': {'$gt': 0}},
+            {'_id': 0, 'user_id': 1, 'count': 1}
+        ).sort('count', -1).limit(limit).to_list(length=limit)
+
+    async def legacy():
+        if not _state['legacy_reads']:
+            return []
+        return await user_collection.aggregate([
+            {'$match': {'characters.id': character_id}},
+            {'$project': {'_id': 0, 'user_id': '$id', 'count': {'$size': {'$filter': {
+                'input': '$characters', 'cond': {'$eq': ['$$this.id', character_id]}
+            }}}}}
+        ]).to_list(length=None)
+
+    total, top_owners, legacy_owners = await asyncio.gather(copies(), top(), legacy())
+    total += sum(owner['count'] for owner in legacy_owners)
+    top_owners = sorted(top_owners + legacy_owners, key=lambda owner: owner['count'], reverse=True)[:limit]
+    names = await _names([owner['user_id'] for owner in top_owners]) if top_owners else {}
+    for owner in top_owners:
+        owner['first_name'] = names.get(owner['user_id'])
+    return total, top_owners
+
+
+async def top_collectors(limit: int = 10) -> list:
+    """Users with the most distinct characters, as {'user_id', 'first_name', 'unique', 'total'}"""
+    collectors = await ownership_collection.aggregate([
+        {'$match': {'count': {'$gt': 0}}},
+        {'$group': {'_id': '$user_id', 'unique': {'$sum': 1}, 'total': {'$sum': '$count'}}},
+        {'$sort': {'unique': -1}},
+        {'$limit': limit},
+        {'$project': {'_id': 0, 'user_id': '$_id', 'unique': 1, 'total': 1}}
+    ]).to_list(length=limit)
+    if _state['legacy_reads']:
+        collectors += await user_collection.aggregate([
+            {'$match': {'characters.0': {'$exists': True}}},
+            {'$project': {
+                '_id': 0,
+                'user_id': '$id',
+                'total': {'$size': '$characters'},
+                'unique': {'$size': {'$setUnion': [{'$map': {'input': '$characters', 'as': 'char', 'in': '$$char.id'}}, []]}},
+            }},
+            {'$sort': {'unique': -1}},
+            {'$limit': limit}
+        ]).to_list(length=limit)
+        collectors = sorted(collectors, key=lambda collector: collector['unique'], reverse=True)[:limit]
+    names = await _names([collector['user_id'] for collector in collectors]) if collectors else {}
+    for collector in collectors:
+        collector['first_name'] = names.get(collector['user_id'])
+    return collectors
+
+
+async def migrate_all(progress=None) -> dict:
+    """Migrate every user still on the embedded layout, resuming from the last checkpoint"""
+    state = await migrations_collection.find_one({'_id': MIGRATION_ID}) or {}
+    last_id = state.get('last_id')
+    migrated = state.get('migrated', 0)
+
+    query = {'characters': {'$exists': True}}
+    if last_id is not None:
+        query['_id'] = {'$gt': last_id}
+    seen = 0
+    async for user in user_collection.find(query, {'id': 1}).sort('_id', 1).batch_size(500):
+        if 'id' in user:
+            async with _lock(user['id']):
+                if await _migrate_locked(user['id']):
+                    migrated += 1
+        last_id = user['_id']
+        seen += 1
+        if seen % CHECKPOINT_EVERY == 0:
+            await migrations_collection.update_one(
+                {'_id': MIGRATION_ID}, {'$set': {'last_id': last_id, 'migrated': migrated}}, upsert=True
+            )
+            if progress:
+                await progress(migrated)
+
+    remaining = await user_collection.count_documents({'characters': {'$exists': True}}, limit=1)
+    completed = remaining == 0
+    await migrations_collection.update_one(
+        {'_id': MIGRATION_ID},
+        {'$set': {'last_id': last_id, 'migrated': migrated, 'completed': completed}},
+        upsert=True
+    )
+    if completed:
+        _stop_legacy_reads()
+    LOGGER.info(f"Ownership migration: {migrated} users migrated, completed={completed}")
+    return {'migrated': migrated, 'completed': completed}
+
+
+async def rebuild_stats() -> int:
+    """Recompute character_stats for the whole catalog from the ownership collection.
+
+    The result replaces the collection when the pipeline ends, so stats
+    updates made while it runs are lost; run it when few claims are coming in.
+    """
+    await ownership_collection.aggregate([
+        {'$match': {'count': {'$gt': 0}}},
+        {'$sort': {'count': -1}},
+        {'$group': {
+            '_id': '$character_id',
+            'owners': {'$sum': 1},
+            'copies': {'$sum': '$count'},
+            'top': {'$push': {'user_id': '$user_id', 'count': '$count'}},
+        }},
+        {'$project': {'owners': 1, 'copies': 1, 'top': {'$slice': ['$top', STATS_TOP_KEPT]}}},
+        {'$out': character_stats_collection.name},
+    ], allowDiskUse=True).to_list(length=None)
+    characters = await character_stats_collection.count_documents({})
+    # The legacy layout isn't counted, so the stats are only trusted once the migration is done
+    await migrations_collection.update_one(
+        {'_id': STATS_ID}, {'$set': {'completed': not _state['legacy_reads'], 'characters': characters}}, upsert=True
+    )
+    _state['stats_ready'] = not _state['legacy_reads']
+    LOGGER.info(f"Character stats rebuilt for {characters} characters")
+    return characters
+
+
+async def _document_sizes(target) -> dict:
+    result = await target.aggregate([
+        {'$project': {'size': {'$bsonSize': '$$ROOT'}}},
+        {'$group': {'_id': None, 'documents': {'$sum': 1}, 'avg': {'$avg': '$size'}, 'max': {'$max': '$size'}, 'total': {'$sum': '$size'}}}
+    ]).to_list(length=1)
+    if not result:
+        return {'documents': 0, 'avg': 0, 'max': 0, 'total': 0}
+    return {key: result[0][key] for key in ('documents', 'avg', 'max', 'total')}
+
+
+async def storage_report(sample_user_id: int = None) -> dict:
+    """Document sizes of both layouts and read latencies for one heavy user"""
+    if sample_user_id is None:
+        heaviest = await user_collection.aggregate([
+            {'$project': {'id': 1, 'size': {'$bsonSize': '$$ROOT'}}},
+            {'$sort': {'size': -1}},
+            {'$limit': 1}
+        ]).to_list(length=1)
+        sample_user_id = heaviest[0].get('id') if heaviest else None
+
+    report = {
+        'users': await _document_sizes(user_collection),
+        'ownership': await _document_sizes(ownership_collection),
+        'sample_user_id': sample_user_id,
+    }
+    if sample_user_id is not None:
+        start = time.perf_counter()
+        await user_collection.find_one({'id': sample_user_id})
+        report['user_document_read_ms'] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        await counts(sample_user_id)
+        report['collection_read_ms'] = (time.perf_counter() - start) * 1000
+    return report
+
+
+def stats() -> dict:
+    return {
+        'legacy_reads': int(_state['legacy_reads']),
+        'known_migrated_users': len(_migrated_users),
+        'migrated_by_writes': _state['migrated_by_writes'],
+        'stats_ready': int(_state['stats_ready']),
+        'stats_refills': _state['stats_refills'],
+    }
+
+
+metrics.register('ownership', stats)
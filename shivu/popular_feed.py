@@ -0,0 +1,137 @@
+"""The "popular" feed an empty inline query shows.
+
+It used to be the first 200 documents of the catalog, cached for ten hours.
+The feed is now ranked by how many copies of a character are owned, how
+often it was claimed lately and its rarity, with a random slice of the rest
+of the catalog mixed in and redrawn on every refresh. A background task
+rebuilds it every REFRESH_INTERVAL seconds from one query for the owned
+counts; claims are counted in memory as they happen. Serving it is a list
+lookup, and it pages past 200 like any other answer.
+"""
+import asyncio
+import math
+import random
+from collections import Counter
+
+from shivu import LOGGER
+from shivu import metrics
+from shivu import ownership
+from shivu.catalog import catalog
+
+REFRESH_INTERVAL = 300  # Seconds between rebuilds, and between redraws of the random slice
+RANKED_SIZE = 400  # Characters taken by score
+RANDOM_SIZE = 100  # Characters drawn from the rest of the catalog
+RANDOM_EVERY = 5  # One drawn character after every four ranked ones
+RECENT_DECAY = 0.5  # Weight left to a refresh's claims after each later refresh
+OWNED_WEIGHT = 10  # Points per e-fold of copies owned
+RECENT_WEIGHT = 20  # Points per e-fold of recent claims
+RARITY_POINTS = {
+    "Limited Edition": 12,
+    "Zenith": 10,
+    "Retro": 8,
+    "Mythic": 7,
+    "Legendary": 5,
+    "Epic": 3,
+    "Rare": 2,
+    "Uncommon": 1,
+    "Common": 0,
+}
+
+
+class PopularFeed:
+    def __init__(self, catalog, popularity=None, refresh_interval: float = REFRESH_INTERVAL):
+        self.catalog = catalog
+        self.popularity = popularity  # async () -> {character_id: copies owned}
+        self.refresh_interval = refresh_interval
+        self.feed = []  # character ids, in the order they are shown
+        self.owned = {}  # {character_id: copies} as of the last refresh
+        self.recent = {}  # {character_id: decayed claim count}
+        self.claims = Counter()  # claims since the last refresh
+        self.rng = random.Random()
+        self.refreshes = 0
+        self.failed_refreshes = 0
+        self._task = None
+
+    def record_claim(self, character_id: str) -> None:
+        self.claims[character_id] += 1
+
+    def score(self, character: dict) -> float:
+        character_id = character['id']
+        return (
+            OWNED_WEIGHT * math.log1p(self.owned.get(character_id, 0))
+            + RECENT_WEIGHT * math.log1p(self.recent.get(character_id, 0))
+            + RARITY_POINTS.get(character.get('rarity'), 0)
+        )
+
+    def rebuild(self) -> None:
+        """Fold in the claims since the last rebuild, rank the catalog and draw a new random slice"""
+        recent = {character_id: weight * RECENT_DECAY for character_id, weight in self.recent.items()}
+        for character_id, claims in self.claims.items():
+            recent[character_id] = recent.get(character_id, 0) + claims
+        self.recent = {character_id: weight for character_id, weight in recent.items() if weight >= 0.01}
+        self.claims = Counter()
+
+        characters = list(self.catalog.characters.values())
+        ranked = sorted(characters, key=lambda character: (-self.score(character), character['id']))
+        top = [character['id'] for character in ranked[:RANKED_SIZE]]
+        rest = [character['id'] for character in ranked[RANKED_SIZE:]]
+        drawn = self.rng.sample(rest, min(RANDOM_SIZE, len(rest)))
+
+        feed = []
+        top_iter, drawn_iter = iter(top), iter(drawn)
+        for position in range(len(top) + len(drawn)):
+            if position % RANDOM_EVERY == RANDOM_EVERY - 1:
+                feed.append(next(drawn_iter, None) or next(top_iter))
+            else:
+                feed.append(next(top_iter, None) or next(drawn_iter))
+        # A new list, so answers already paging through the old one keep their order
+        self.feed = feed
+
+    async def refresh(self) -> None:
+        await self.catalog.ensure_loaded()
+        if self.popularity is not None:
+            try:
+                self.owned = await self.popularity()
+            except Exception as e:
+                # Rank with the last known counts rather than not at all
+                LOGGER.warning(f"Could not read owned counts for the popular feed: {e}")
+                self.failed_refreshes += 1
+        self.rebuild()
+        self.refreshes += 1
+
+    def ids(self) -> list:
+        """The current feed; built from the catalog alone if no refresh has run yet"""
+        if not self.feed and self.catalog.loaded:
+            self.rebuild()
+        return self.feed
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                LOGGER.error(f"Popular feed refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_periodically())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'feed': len(self.feed),
+            'owned_characters': len(self.owned),
+            'recently_claimed': len(self.recent),
+            'pending_claims': sum(self.claims.values()),
+            'refreshes': self.refreshes,
+            'failed_refreshes': self.failed_refreshes,
+        }
+
+
+popular_feed = PopularFeed(catalog, ownership.popularity)
+metrics.register('popular_feed', popular_feed.stats)
@@ -0,0 +1,184 @@
+"""In-memory ranked search over character names and anime, for inline queries.
+
+Inline search used to turn the raw query into a Mongo regex and load every
+match on each keystroke. The catalog mirror already holds every character, so
+this index is built from it and patched by the same change events. Queries
+are normalized like /marry guesses (see guess_matcher.normalize), never
+compiled, so no input can make them slow.
+
+Every word of the query has to match the name or the anime, as a whole word,
+the start of a word or a piece of a word (found through trigrams); a word
+that matches nothing that way may match words one typo away (trigram
+similarity). Better matches and name matches rank higher; ties keep catalog
+order.
+"""
+import bisect
+from collections import Counter
+
+from shivu import metrics
+from shivu.catalog import catalog, CatalogListener
+from shivu.guess_matcher import normalize
+
+NAME, ANIME = 'name', 'anime'
+# Points per query word by how it matched: (word, prefix, substring, typo)
+FIELD_SCORES = {
+    NAME: (10, 6, 4, 2),
+    ANIME: (5, 3, 2, 1),
+}
+FULL_NAME_BONUS = 5  # The query is the whole name
+SIMILARITY_MIN = 0.5  # Dice coefficient of trigram sets for a typo match
+MAX_QUERY_LENGTH = 64
+MAX_QUERY_WORDS = 8
+
+
+def _trigrams(token: str) -> set:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def _catalog_order(character_id: str):
+    return (0, int(character_id), '') if character_id.isdigit() else (1, 0, character_id)
+
+
+class SearchIndex(CatalogListener):
+    def __init__(self, catalog):
+        self.postings = {NAME: {}, ANIME: {}}  # {field: {token: set of character ids}}
+        self.vocabulary = []  # every distinct token, sorted, for prefix ranges
+        self.token_refs = Counter()  # {token: postings it appears in}
+        self.trigrams = {}  # {trigram: set of tokens}
+        self.full_names = {}  # {character_id: normalized name}
+        self.order = {}  # {character_id: tie-break key}
+        catalog.subscribe(self)
+
+    def reset(self, catalog) -> None:
+        self.postings = {NAME: {}, ANIME: {}}
+        self.vocabulary = []
+        self.token_refs = Counter()
+        self.trigrams = {}
+        self.full_names = {}
+        self.order = {}
+        for character in catalog.characters.values():
+            self._index(character, sort=False)
+        self.vocabulary.sort()
+
+    def added(self, character: dict) -> None:
+        self._index(character, sort=True)
+
+    def removed(self, character: dict) -> None:
+        character_id = character['id']
+        for field in (NAME, ANIME):
+            for token in set(normalize(character.get(field) or '').split()):
+                ids = self.postings[field].get(token)
+                if ids is None or character_id not in ids:
+                    continue
+                ids.discard(character_id)
+                if not ids:
+                    del self.postings[field][token]
+                    self._release(token)
+        self.full_names.pop(character_id, None)
+        self.order.pop(character_id, None)
+
+    def _index(self, character: dict, sort: bool) -> None:
+        character_id = character['id']
+        for field in (NAME, ANIME):
+            for token in set(normalize(character.get(field) or '').split()):
+                ids = self.postings[field].get(token)
+                if ids is None:
+                    ids = self.postings[field][token] = set()
+                    self._retain(token, sort)
+                ids.add(character_id)
+        self.full_names[character_id] = ' '.join(normalize(character.get(NAME) or '').split())
+        self.order[character_id] = _catalog_order(character_id)
+
+    def _retain(self, token: str, sort: bool) -> None:
+        self.token_refs[token] += 1
+        if self.token_refs[token] > 1:
+            return
+        if sort:
+            bisect.insort(self.vocabulary, token)
+        else:
+            self.vocabulary.append(token)
+        for trigram in _trigrams(token):
+            self.trigrams.setdefault(trigram, set()).add(token)
+
+    def _release(self, token: str) -> None:
+        self.token_refs[token] -= 1
+        if self.token_refs[token] > 0:
+            return
+        del self.token_refs[token]
+        i = bisect.bisect_left(self.vocabulary, token)
+        if i < len(self.vocabulary) and self.vocabulary[i] == token:
+            del self.vocabulary[i]
+        for trigram in _trigrams(token):
+            tokens = self.trigrams.get(trigram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self.trigrams[trigram]
+
+    def _word_matches(self, word: str) -> dict:
+        """{token: match kind} for every vocabulary token a query word matches (0 word .. 3 typo)"""
+        matches = {}
+        start = bisect.bisect_left(self.vocabulary, word)
+        for i in range(start, len(self.vocabulary)):
+            token = self.vocabulary[i]
+            if not token.startswith(word):
+                break
+            matches[token] = 0 if token == word else 1
+
+        word_trigrams = _trigrams(word)
+        if word_trigrams:
+            shared = Counter()
+            for trigram in word_trigrams:
+                shared.update(self.trigrams.get(trigram, ()))
+            for token, count in shared.items():
+                if token not in matches and count == len(word_trigrams) and word in token:
+                    matches[token] = 2
+            # Typos are only a fallback, a word that matches something as typed means that
+            if not matches:
+                for token, count in shared.items():
+                    if 2 * count / (len(word_trigrams) + len(_trigrams(token))) >= SIMILARITY_MIN:
+                        matches[token] = 3
+        return matches
+
+    def _word_scores(self, word: str) -> dict:
+        scores = {}
+        for token, kind in self._word_matches(word).items():
+            for field in (NAME, ANIME):
+                score = FIELD_SCORES[field][kind]
+                for character_id in self.postings[field].get(token, ()):
+                    if scores.get(character_id, 0) < score:
+                        scores[character_id] = score
+        return scores
+
+    def search(self, query: str, limit: int = None) -> list:
+        """Character ids matching every word of the query, best first"""
+        words = normalize(query[:MAX_QUERY_LENGTH]).split()[:MAX_QUERY_WORDS]
+        if not words:
+            return []
+        scores = None
+        # Rarest words first keeps the running intersection small
+        for word_scores in sorted((self._word_scores(word) for word in words), key=len):
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {character_id: score + word_scores[character_id] for character_id, score in scores.items() if character_id in word_scores}
+            if not scores:
+                return []
+
+        phrase = ' '.join(words)
+        for character_id in scores:
+            if self.full_names.get(character_id) == phrase:
+                scores[character_id] += FULL_NAME_BONUS
+        ranked = sorted(scores, key=lambda character_id: (-scores[character_id], self.order[character_id]))
+        return ranked[:limit] if limit else ranked
+
+    def stats(self) -> dict:
+        return {
+            'characters': len(self.order),
+            'tokens': len(self.vocabulary),
+            'trigrams': len(self.trigrams),
+        }
+
+
+search_index = SearchIndex(catalog)
+metrics.register('search_index', search_index.stats)
@@ -0,0 +1,105 @@
+"""Per-user spam detection with constant work per message and bounded memory.
+
+Every user gets a deque holding at most SPAM_MESSAGE_LIMIT + 1 timestamps: once
+it is full and its oldest entry is still inside the window, the user sent more
+than the limit within SPAM_TIME_WINDOW seconds. Users are kept in LRU order of
+their last message, so a periodic sweep drops idle users (and expired blocks)
+from the front without scanning everyone.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from shivu import LOGGER
+from shivu import metrics
+
+SPAM_MESSAGE_LIMIT = 7  # Max messages allowed
+SPAM_TIME_WINDOW = 10  # Time window in seconds to check for spam
+BLOCK_DURATION = 720  # Block duration in seconds (12 minutes)
+EVICT_INTERVAL = 60  # Seconds between idle sweeps
+
+
+class SpamLimiter:
+    def __init__(self, limit: int = SPAM_MESSAGE_LIMIT, window: float = SPAM_TIME_WINDOW, block_duration: float = BLOCK_DURATION):
+        self.limit = limit
+        self.window = window
+        self.block_duration = block_duration
+        self.recent = OrderedDict()  # {user_id: deque of message times}, least recently active first
+        self.blocked = {}  # {user_id: block_end_time}
+        self.total_blocks = 0
+        self.evicted = 0
+        self._task = None
+
+    def is_blocked(self, user_id: int, now: float = None) -> bool:
+        """Check if user is currently blocked"""
+        block_end = self.blocked.get(user_id)
+        if block_end is None:
+            return False
+        if (now or time.time()) < block_end:
+            return True
+        # Block expired, remove from blocked list
+        del self.blocked[user_id]
+        return False
+
+    def block_remaining(self, user_id: int) -> float:
+        return max(0.0, self.blocked.get(user_id, 0) - time.time())
+
+    def hit(self, user_id: int, now: float = None) -> bool:
+        """Record a message and return True if it got the user blocked for spam"""
+        now = now or time.time()
+        times = self.recent.get(user_id)
+        if times is None:
+            times = self.recent[user_id] = deque(maxlen=self.limit + 1)
+        else:
+            self.recent.move_to_end(user_id)
+        times.append(now)
+
+        if len(times) > self.limit and now - times[0] <= self.window:
+            self.blocked[user_id] = now + self.block_duration
+            self.total_blocks += 1
+            times.clear()  # Clear message history
+            LOGGER.warning(f"User {user_id} blocked for spam (sent more than {self.limit} messages in {self.window}s)")
+            return True
+        return False
+
+    def evict_idle(self, now: float = None) -> int:
+        """Forget users with no message inside the window and drop expired blocks"""
+        now = now or time.time()
+        evicted = 0
+        while self.recent:
+            user_id, times = next(iter(self.recent.items()))
+            if times and now - times[-1] <= self.window:
+                break
+            self.recent.popitem(last=False)
+            evicted += 1
+        self.evicted += evicted
+
+        for user_id in [user_id for user_id, block_end in self.blocked.items() if block_end <= now]:
+            del self.blocked[user_id]
+        return evicted
+
+    def stats(self) -> dict:
+        return {
+            'active_users': len(self.recent),
+            'blocked_users': len(self.blocked),
+            'total_blocks': self.total_blocks,
+            'evicted_users': self.evicted,
+        }
+
+    async def _evict_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            self.evict_idle()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._evict_periodically())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+spam_limiter = SpamLimiter()
+metrics.register('spam', spam_limiter.stats)
@@ -0,0 +1,146 @@
+"""Per-chat shuffled decks so a chat sees every spawnable card before a repeat.
+
+Each chat keeps, per rarity, a seeded permutation of that rarity's spawnable
+characters stored as a compact int array plus a read position; the rarity
+itself is drawn by weight from the spawn pool's alias table. Drawing is an
+O(1) step of the position; ids removed or locked since the shuffle are skipped when reached and
+newly uploaded ids are swapped into the unread part of the deck, so catalog
+changes never force a reshuffle (cards unlocked or moved into a rarity by
+/update join at the next round). Decks are persisted to Mongo so the no-repeat
+guarantee survives restarts; the decks in use are cached on the chat's
+ChatState, so they are evicted along with it.
+"""
+import random
+import sys
+from array import array
+
+from bson import Binary
+
+from shivu import spawn_decks_collection, LOGGER
+from shivu.spawn_pool import spawn_pool
+
+
+def _pack(order: array) -> Binary:
+    if sys.byteorder != 'little':
+        order = array('I', order)
+        order.byteswap()
+    return Binary(order.tobytes())
+
+
+def _unpack(data: bytes) -> array:
+    order = array('I')
+    order.frombytes(bytes(data))
+    if sys.byteorder != 'little':
+        order.byteswap()
+    return order
+
+
+class SpawnDeck:
+    __slots__ = ("order", "position", "seed", "high_water")
+
+    def __init__(self, order: array, position: int = 0, seed: int = 0, high_water: int = 0):
+        self.order = order
+        self.position = position
+        self.seed = seed
+        self.high_water = high_water
+
+    @classmethod
+    def shuffled(cls, character_ids, high_water: int) -> "SpawnDeck":
+        seed = random.getrandbits(32)
+        order = array('I', sorted(int(character_id) for character_id in character_ids if character_id.isdigit()))
+        random.Random(seed).shuffle(order)
+        return cls(order, 0, seed, high_water)
+
+    def absorb(self, character_id: int) -> None:
+        """Insert a new id at a random spot among the cards not yet drawn"""
+        self.order.append(character_id)
+        swap = random.randrange(self.position, len(self.order))
+        last = len(self.order) - 1
+        self.order[swap], self.order[last] = self.order[last], self.order[swap]
+
+    def draw(self, bucket):
+        """Return the next id that is still in ``bucket``, or None once the deck is spent"""
+        while self.position < len(self.order):
+            character_id = str(self.order[self.position])
+            self.position += 1
+            if character_id in bucket:
+                return character_id
+        return None
+
+
+class SpawnDecks:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def _load(self, state, rarity: str):
+        deck = state.decks.get(rarity)
+        if deck is not None:
+            return deck
+        chat_id = state.chat_id
+        try:
+            document = await spawn_decks_collection.find_one({'_id': f'{chat_id}:{rarity}'})
+        except Exception as e:
+            LOGGER.error(f"Failed to load spawn deck for chat {chat_id} ({rarity}): {e}")
+            document = None
+        if document:
+            deck = SpawnDeck(
+                _unpack(document['order']),
+                document.get('position', 0),
+                document.get('seed', 0),
+                document.get('high_water', 0),
+            )
+            state.decks[rarity] = deck
+        return deck
+
+    async def _save(self, chat_id: int, rarity: str, deck: SpawnDeck, full: bool) -> None:
+        fields = {'position': deck.position}
+        if full:
+            fields.update({
+                'chat_id': chat_id,
+                'rarity': rarity,
+                'order': _pack(deck.order),
+                'seed': deck.seed,
+                'high_water': deck.high_water,
+            })
+        try:
+            await spawn_decks_collection.update_one({'_id': f'{chat_id}:{rarity}'}, {'$set': fields}, upsert=True)
+        except Exception as e:
+            LOGGER.error(f"Failed to save spawn deck for chat {chat_id} ({rarity}): {e}")
+
+    async def draw(self, state, profile: str):
+        """Return the chat's next character for a spawn profile, or None if nothing can spawn"""
+        rarity = self.pool.sample_rarity(profile)
+        if rarity is None:
+            return None
+        bucket = self.pool.buckets[rarity]
+
+        deck = await self._load(state, rarity)
+        full_save = False
+        high_water = self.pool.high_water.get(rarity, 0)
+
+        if deck is None:
+            deck = SpawnDeck.shuffled(bucket.ids, high_water)
+            state.decks[rarity] = deck
+            full_save = True
+        elif high_water > deck.high_water:
+            # Uploads since the deck was built join the unread part of it
+            for character_id in self.pool.ids_above(rarity, deck.high_water):
+                deck.absorb(character_id)
+            deck.high_water = high_water
+            full_save = True
+
+        character_id = deck.draw(bucket)
+        if character_id is None:
+            # Every card has been seen, start a new round
+            deck = SpawnDeck.shuffled(bucket.ids, high_water)
+            state.decks[rarity] = deck
+            full_save = True
+            character_id = deck.draw(bucket)
+            if character_id is None:
+                return None
+
+        await self._save(state.chat_id, rarity, deck, full_save)
+        return self.pool.catalog.get(character_id)
+
+
+spawn_decks = SpawnDecks(spawn_pool)
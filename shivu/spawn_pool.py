@@ -0,0 +1,251 @@
+"""Spawn-eligible character ids and the weighted rarity sampler behind every spawn.
+
+Automatic spawns used to pull the whole eligible catalog from Mongo every time
+a chat crossed its message threshold, and /summon asked Mongo for the distinct
+rarities and a $sample on each call. The pool is derived from the in-memory
+catalog instead and patched by its change events: ids are bucketed per rarity,
+and each spawn profile keeps a Vose alias table over the weights of the
+rarities that currently have characters, so picking a rarity and then a
+character are both O(1) with no round trip. A table is rebuilt lazily, only
+after a rarity gains its first or loses its last character or the weights of
+its profile change.
+
+Characters locked from spawning are kept in buckets of their own, which only
+/summon draws from, as it always could. A rarity without a weight never
+spawns; it is logged the first time one of its characters is seen.
+"""
+import random
+from bisect import bisect_left, bisect_right, insort
+
+from shivu import LOGGER
+from shivu.catalog import CatalogListener, catalog
+
+# Rarities that never appear through spawns or /summon
+NON_SPAWNABLE_RARITIES = ("Limited Edition", "Zenith")
+
+# Spawn profiles: message spawns, the 4000-message Retro spawn and /summon
+NORMAL = "normal"
+RETRO = "retro"
+SUMMON = "summon"
+
+RARITY_WEIGHTS = {
+    "Common": 20,
+    "Uncommon": 20,
+    "Rare": 20,
+    "Epic": 20,
+    "Legendary": 2,
+    "Mythic": 0.8,
+    "Retro": 0.3,
+    "Zenith": 0,
+    "Limited Edition": 0
+}
+
+PROFILE_WEIGHTS = {
+    # Retro characters only come from their own 4000-message spawn
+    NORMAL: {rarity: weight for rarity, weight in RARITY_WEIGHTS.items() if rarity != "Retro"},
+    RETRO: {"Retro": 1},
+    SUMMON: dict(RARITY_WEIGHTS),
+}
+
+# Profiles that may also draw characters locked from spawning
+LOCKED_PROFILES = (SUMMON,)
+
+
+class IdBucket:
+    """Set of ids supporting O(1) add, discard and uniform random choice"""
+
+    __slots__ = ("ids", "positions")
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, character_id) -> bool:
+        return character_id in self.positions
+
+    def add(self, character_id: str) -> None:
+        if character_id in self.positions:
+            return
+        self.positions[character_id] = len(self.ids)
+        self.ids.append(character_id)
+
+    def discard(self, character_id: str) -> None:
+        position = self.positions.pop(character_id, None)
+        if position is None:
+            return
+        # Swap the last id into the freed slot so removal stays O(1)
+        last = self.ids.pop()
+        if position < len(self.ids):
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def clear(self) -> None:
+        self.ids.clear()
+        self.positions.clear()
+
+    def choice(self):
+        return random.choice(self.ids) if self.ids else None
+
+
+class AliasTable:
+    """Vose alias table: O(n) to build, O(1) per weighted draw"""
+
+    __slots__ = ("outcomes", "probability", "alias")
+
+    def __init__(self, weights: dict):
+        self.outcomes = [outcome for outcome, weight in weights.items() if weight > 0]
+        count = len(self.outcomes)
+        self.probability = [0.0] * count
+        self.alias = [0] * count
+        if not count:
+            return
+
+        total = sum(weights[outcome] for outcome in self.outcomes)
+        scaled = [weights[outcome] * count / total for outcome in self.outcomes]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        # Whatever is left is 1 up to rounding error
+        for i in small + large:
+            self.probability[i] = 1.0
+
+    def __len__(self) -> int:
+        return len(self.outcomes)
+
+    def sample(self):
+        if not self.outcomes:
+            return None
+        i = random.randrange(len(self.outcomes))
+        return self.outcomes[i] if random.random() < self.probability[i] else self.outcomes[self.alias[i]]
+
+
+class SpawnPool(CatalogListener):
+    def __init__(self, catalog, profile_weights: dict = PROFILE_WEIGHTS):
+        self.catalog = catalog
+        self.profile_weights = {profile: dict(weights) for profile, weights in profile_weights.items()}
+        self.buckets = {}  # {rarity: IdBucket}
+        self.locked_buckets = {}  # {rarity: IdBucket} of characters locked from spawning
+        self.high_water = {}  # highest numeric id seen per rarity
+        self.numeric_ids = {}  # {rarity: sorted numeric ids of its spawnable characters}
+        self.unweighted = set()  # rarities already logged as having no weight
+        self._tables = {}  # {profile: AliasTable}, dropped whenever it goes stale
+        self.rebuilds = 0
+        catalog.subscribe(self)
+
+    def reset(self, catalog) -> None:
+        self.buckets = {}
+        self.locked_buckets = {}
+        self.high_water = {}
+        self.numeric_ids = {}
+        self._tables.clear()
+        for character in catalog.characters.values():
+            self._add(character, sort=False)
+        for ids in self.numeric_ids.values():
+            ids.sort()
+
+    def added(self, character: dict) -> None:
+        self._add(character, sort=True)
+
+    def _add(self, character: dict, sort: bool) -> None:
+        rarity = character.get('rarity')
+        if rarity in NON_SPAWNABLE_RARITIES:
+            return
+        if rarity not in RARITY_WEIGHTS and rarity not in self.unweighted:
+            self.unweighted.add(rarity)
+            LOGGER.warning(f"Rarity {rarity!r} of character {character['id']} has no spawn weight; its characters never spawn")
+        locked = character['id'] in self.catalog.locked
+        buckets = self.locked_buckets if locked else self.buckets
+        bucket = buckets.get(rarity)
+        if bucket is None:
+            bucket = buckets[rarity] = IdBucket()
+        if not bucket:
+            self._tables.clear()
+        if character['id'] in bucket:
+            return
+        bucket.add(character['id'])
+        if not locked and character['id'].isdigit():
+            self.high_water[rarity] = max(self.high_water.get(rarity, 0), int(character['id']))
+            ids = self.numeric_ids.setdefault(rarity, [])
+            if sort:
+                insort(ids, int(character['id']))
+            else:
+                ids.append(int(character['id']))
+
+    def removed(self, character: dict) -> None:
+        for buckets in (self.buckets, self.locked_buckets):
+            bucket = buckets.get(character.get('rarity'))
+            if bucket is None or character['id'] not in bucket:
+                continue
+            bucket.discard(character['id'])
+            if not bucket:
+                self._tables.clear()
+            if buckets is self.buckets and character['id'].isdigit():
+                ids = self.numeric_ids[character.get('rarity')]
+                del ids[bisect_left(ids, int(character['id']))]
+
+    def lock_changed(self, character_id: str, locked: bool) -> None:
+        character = self.catalog.get(character_id)
+        if not character:
+            return
+        # Moves it between the spawnable and the locked buckets
+        self.removed(character)
+        self.added(character)
+
+    def set_weights(self, profile: str, weights: dict) -> None:
+        self.profile_weights[profile] = dict(weights)
+        self._tables.pop(profile, None)
+
+    def table(self, profile: str) -> AliasTable:
+        """Return the profile's alias table over the rarities that have characters"""
+        table = self._tables.get(profile)
+        if table is None:
+            weights = {
+                rarity: weight for rarity, weight in self.profile_weights[profile].items()
+                if self._count(profile, rarity)
+            }
+            table = self._tables[profile] = AliasTable(weights)
+            self.rebuilds += 1
+        return table
+
+    def ids_above(self, rarity: str, character_id: int) -> list:
+        """Numeric ids of the rarity's spawnable characters greater than ``character_id``, ascending"""
+        ids = self.numeric_ids.get(rarity) or []
+        return ids[bisect_right(ids, character_id):]
+
+    def _count(self, profile: str, rarity: str) -> int:
+        count = len(self.buckets.get(rarity) or ())
+        if profile in LOCKED_PROFILES:
+            count += len(self.locked_buckets.get(rarity) or ())
+        return count
+
+    def size(self, profile: str) -> int:
+        return sum(self._count(profile, rarity) for rarity in self.table(profile).outcomes)
+
+    def sample_rarity(self, profile: str):
+        """Draw a rarity by the profile's weights, or None if none of them can spawn"""
+        return self.table(profile).sample()
+
+    async def pick(self, profile: str):
+        """Pick a rarity by weight, then a uniformly random character of it"""
+        await self.catalog.ensure_loaded()
+        rarity = self.sample_rarity(profile)
+        if rarity is None:
+            return None
+        bucket = self.buckets.get(rarity) or ()
+        if profile in LOCKED_PROFILES:
+            # Uniform over the rarity's spawnable and locked characters together
+            i = random.randrange(self._count(profile, rarity))
+            if i >= len(bucket):
+                return self.catalog.get(self.locked_buckets[rarity].ids[i - len(bucket)])
+        return self.catalog.get(bucket.choice())
+
+
+spawn_pool = SpawnPool(catalog)
@@ -0,0 +1,82 @@
+"""Bounded work queue that takes spawn selection and sending off the message path.
+
+message_counter only counts messages; when a chat crosses a threshold it
+submits a (chat_id, kind) job here and a small pool of workers picks the card
+and uploads it to Telegram. A chat has at most one queued or running job per
+kind, so a backlog can never fire two spawns for the same threshold.
+"""
+import asyncio
+
+from shivu import LOGGER
+from shivu import metrics
+
+QUEUE_SIZE = 1000
+WORKER_COUNT = 8
+DRAIN_TIMEOUT = 10  # Seconds stop() waits for queued spawns to be sent
+
+
+class SpawnQueue:
+    def __init__(self, maxsize: int = QUEUE_SIZE, worker_count: int = WORKER_COUNT):
+        self.maxsize = maxsize
+        self.worker_count = worker_count
+        self.pending = set()  # (chat_id, kind) jobs queued or running
+        self.dropped = 0
+        self._queue = None
+        self._handler = None
+        self._workers = []
+
+    def start(self, handler) -> None:
+        """Start the workers; ``handler(chat_id, kind)`` performs one spawn"""
+        if self._workers:
+            return
+        self._handler = handler
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.worker_count)]
+
+    def submit(self, chat_id: int, kind: str) -> bool:
+        """Queue a spawn unless the chat already has one of this kind pending"""
+        job = (chat_id, kind)
+        if job in self.pending or self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            LOGGER.warning(f"Spawn queue full, dropped {kind} spawn for chat {chat_id}")
+            return False
+        self.pending.add(job)
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._handler(*job)
+            except Exception as e:
+                LOGGER.error(f"Spawn job {job} failed: {e}")
+            finally:
+                self.pending.discard(job)
+                self._queue.task_done()
+
+    async def stop(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """Send the spawns already queued, for up to ``timeout`` seconds, then stop the workers"""
+        if self._workers:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                LOGGER.warning(f"Spawn queue stopped with {len(self.pending)} spawns not sent")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queue.qsize() if self._queue else 0,
+            'pending': len(self.pending),
+            'dropped': self.dropped,
+        }
+
+
+spawn_queue = SpawnQueue()
+metrics.register('spawn_queue', spawn_queue.stats)